@@ -1,15 +1,15 @@
 """
 Proxmox監視ダッシュボード - Web API サーバー
 """
-from flask import Flask, jsonify, render_template_string
+from flask import Flask, jsonify, render_template_string, request
 from flask_socketio import SocketIO, emit
 import asyncio
 import threading
 import json
 from datetime import datetime
 from monitoring_service import monitoring_service, ClusterStats
-from dataclasses import asdict
 import time
+from delta import DeltaTracker
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'proxmox_monitoring_secret'
@@ -19,16 +19,13 @@ socketio = SocketIO(app, cors_allowed_origins="*")
 latest_data_cache = None
 last_update_time = None
 
+# WebSocketクライアントに送った状態（差分計算用）
+delta_tracker = DeltaTracker()
+
 def dataclass_to_dict(obj):
-    """データクラスを辞書に変換（ネストされたオブジェクトも処理）"""
-    if hasattr(obj, '__dataclass_fields__'):
-        result = {}
-        for field_name, field_value in asdict(obj).items():
-            if isinstance(field_value, list):
-                result[field_name] = [dataclass_to_dict(item) for item in field_value]
-            else:
-                result[field_name] = field_value
-        return result
+    """ClusterStats を辞書に変換"""
+    if isinstance(obj, ClusterStats):
+        return obj.to_dict()
     return obj
 
 @app.route('/')
@@ -71,7 +68,9 @@ def get_proxmox_status():
 def get_proxmox_history():
     """Proxmox履歴データAPI"""
     try:
-        history = monitoring_service.get_history_data(24)
+        hours = request.args.get('hours', default=24, type=int)
+        max_points = request.args.get('max_points', default=None, type=int)
+        history = monitoring_service.get_history_data(hours, max_points)
         
         return jsonify({
             'status': 'success',
@@ -86,48 +85,61 @@ def get_proxmox_history():
             'data': []
         }), 500
 
+@app.route('/api/storage')
+def get_storage_status():
+    """ストレージ状況API（DBサイズ・行数・保持期間処理）"""
+    return jsonify({
+        'status': 'success',
+        'data': monitoring_service.get_storage_report(),
+        'timestamp': datetime.now().isoformat()
+    })
+
 @socketio.on('connect')
 def handle_connect():
     """WebSocket接続時"""
     print('クライアント接続')
     
-    # 最新データを送信
-    if latest_data_cache:
-        emit('proxmox_update', {
-            'data': latest_data_cache,
-            'timestamp': last_update_time
-        })
+    # 全体スナップショットを送信（以降は差分のみ）
+    snapshot = delta_tracker.snapshot()
+    if snapshot:
+        emit('proxmox_snapshot', snapshot)
+
+@socketio.on('proxmox_resync')
+def handle_resync():
+    """クライアントが連番の欠落を検出した場合にスナップショットを再送"""
+    snapshot = delta_tracker.snapshot()
+    if snapshot:
+        emit('proxmox_snapshot', snapshot)
 
 @socketio.on('disconnect')
 def handle_disconnect():
     """WebSocket切断時"""
     print('クライアント切断')
 
+# 通知待ちの最大時間（秒）- 待機中も定期的にループを回す
+BROADCAST_WAIT_TIMEOUT = 60
+
 def broadcast_updates():
-    """定期的にデータをブロードキャスト"""
-    global latest_data_cache, last_update_time
+    """収集完了の通知を受けて前回との差分をブロードキャスト"""
+    global last_update_time
+    last_stats = None
+    seen_version = 0
     
     while True:
         try:
+            seen_version = monitoring_service.updates.wait(seen_version, timeout=BROADCAST_WAIT_TIMEOUT)
             latest_data = monitoring_service.get_latest_data()
             
-            if latest_data:
-                new_data = dataclass_to_dict(latest_data)
+            # 監視サービスが新しいデータを取得した場合のみ差分を計算
+            if latest_data and latest_data is not last_stats:
+                last_stats = latest_data
                 new_timestamp = datetime.now().isoformat()
+                delta = delta_tracker.update(latest_data, new_timestamp)
                 
-                # データが更新された場合のみブロードキャスト
-                if new_data != latest_data_cache:
-                    latest_data_cache = new_data
+                if delta:
                     last_update_time = new_timestamp
-                    
-                    socketio.emit('proxmox_update', {
-                        'data': latest_data_cache,
-                        'timestamp': last_update_time
-                    })
-                    
-                    print(f"データ更新ブロードキャスト: {new_timestamp}")
-            
-            time.sleep(5)  # 5秒間隔
+                    socketio.emit('proxmox_delta', delta)
+                    print(f"差分ブロードキャスト: seq={delta['seq']}, 変更={len(delta['ops'])}")
             
         except Exception as e:
             print(f"ブロードキャストエラー: {e}")
@@ -525,13 +537,89 @@ DASHBOARD_HTML = """
             updateStatus('切断');
         });
         
-        // Proxmoxデータ更新受信
-        socket.on('proxmox_update', function(data) {
-            console.log('データ更新受信:', data);
-            updateDashboard(data.data);
-            updateLastUpdate(data.timestamp);
+        // 差分適用用の状態（一覧はキー -> 項目のMapで保持）
+        const KEYED_COLLECTIONS = ['nodes', 'vms', 'storages'];
+        let liveState = null;
+        let liveSeq = null;
+        
+        // 全体スナップショット受信（接続時・再同期時）
+        socket.on('proxmox_snapshot', function(message) {
+            liveState = {};
+            Object.keys(message.data).forEach(name => {
+                if (KEYED_COLLECTIONS.includes(name)) {
+                    liveState[name] = new Map(keyedItems(name, message.data[name]));
+                } else {
+                    liveState[name] = message.data[name];
+                }
+            });
+            liveSeq = message.seq;
+            renderLiveState(message.timestamp);
+        });
+        
+        // 差分受信
+        socket.on('proxmox_delta', function(message) {
+            if (liveSeq !== null && message.seq <= liveSeq) return;
+            if (liveSeq === null || message.seq !== liveSeq + 1) {
+                // 未同期または欠落を検出したらスナップショットを要求
+                console.log('差分の欠落を検出:', liveSeq, '->', message.seq);
+                liveSeq = null;
+                socket.emit('proxmox_resync');
+                return;
+            }
+            message.ops.forEach(applyOp);
+            liveSeq = message.seq;
+            renderLiveState(message.timestamp);
         });
         
+        // キーはサーバー側（delta.COLLECTION_KEYS）と同じ規則で作る
+        function itemKey(name, item) {
+            let key;
+            if (name === 'nodes') key = item.name;
+            else if (name === 'vms') key = String(item.vmid);
+            else key = `${item.node}/${item.storage}`;
+            return item.cluster ? `${item.cluster}/${key}` : key;
+        }
+        
+        function keyedItems(name, items) {
+            const seen = {};
+            return items.map(item => {
+                let key = itemKey(name, item);
+                if (key in seen) {
+                    seen[key] += 1;
+                    key = `${key}#${seen[key]}`;
+                } else {
+                    seen[key] = 1;
+                }
+                return [key, item];
+            });
+        }
+        
+        function applyOp(op) {
+            const path = op.path.split('/').slice(1).map(part => part.replace(/~1/g, '/').replace(/~0/g, '~'));
+            const name = path[0];
+            if (path.length === 1) {
+                liveState[name] = op.value;
+                return;
+            }
+            const items = liveState[name] || (liveState[name] = new Map());
+            if (op.op === 'remove') {
+                items.delete(path[1]);
+            } else if (path.length === 2) {
+                items.set(path[1], op.value);
+            } else if (items.has(path[1])) {
+                items.get(path[1])[path[2]] = op.value;
+            }
+        }
+        
+        function renderLiveState(timestamp) {
+            const data = {};
+            Object.keys(liveState).forEach(name => {
+                data[name] = liveState[name] instanceof Map ? Array.from(liveState[name].values()) : liveState[name];
+            });
+            updateDashboard(data);
+            updateLastUpdate(timestamp);
+        }
+        
         // ダッシュボード更新
         function updateDashboard(data) {
             if (!data) return;
@@ -540,7 +628,9 @@ DASHBOARD_HTML = """
             document.getElementById('total-nodes').textContent = data.nodes ? data.nodes.length : 0;
             document.getElementById('total-vms').textContent = data.vms ? data.vms.length : 0;
             
-            const runningVMs = data.vms ? data.vms.filter(vm => vm.status === 'running').length : 0;
+            // 集計はサーバー側で計算済み（aggregates）
+            const cluster = data.aggregates ? data.aggregates.cluster : null;
+            const runningVMs = cluster ? cluster.guests_running : (data.vms ? data.vms.filter(vm => vm.status === 'running').length : 0);
             document.getElementById('running-vms').textContent = runningVMs;
             document.getElementById('cluster-status').textContent = data.cluster_status || 'オフライン';
             
@@ -623,9 +713,9 @@ DASHBOARD_HTML = """
                 resourceChart.destroy();
             }
             
-            const nodes = data.nodes || [];
-            const totalCPU = nodes.reduce((sum, node) => sum + (node.cpu_usage * 100), 0) / nodes.length;
-            const totalMemory = nodes.reduce((sum, node) => sum + ((node.memory_usage / node.memory_total) * 100), 0) / nodes.length;
+            if (!data.aggregates) return;
+            const totalCPU = data.aggregates.cluster.cpu_avg_pct;
+            const totalMemory = data.aggregates.cluster.memory_avg_pct;
             
             resourceChart = new Chart(ctx, {
                 type: 'doughnut',
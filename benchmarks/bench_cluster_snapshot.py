@@ -0,0 +1,127 @@
+"""
+ClusterStats のメモリ使用量と変換速度のベンチマーク（従来のデータクラス+asdict vs __slots__付き不変レコード+to_dict）
+
+使い方:
+    python benchmarks/bench_cluster_snapshot.py [ゲスト数]
+
+ゲスト数を省略した場合は 5000 VM/CT（50ノード、ストレージ200件）で計測する。
+monitoring_service を読み込むため、リポジトリ直下の config.yaml が必要。
+"""
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+from dataclasses import asdict, dataclass
+from typing import List, Optional
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from monitoring_service import ClusterStats, NodeInfo, StorageInfo, VMInfo
+
+# 変更前と同じ定義
+@dataclass
+class LegacyNodeInfo:
+    name: str
+    status: str
+    cpu_usage: float
+    memory_usage: float
+    memory_total: int
+    uptime: int
+    temperature: Optional[float] = None
+    power: Optional[float] = None
+
+@dataclass
+class LegacyVMInfo:
+    vmid: int
+    name: str
+    status: str
+    node: str
+    type: str
+    cpu_usage: Optional[float] = None
+    memory_usage: Optional[int] = None
+    memory_max: Optional[int] = None
+
+@dataclass
+class LegacyStorageInfo:
+    node: str
+    storage: str
+    type: str
+    total: int
+    used: int
+    available: int
+
+@dataclass
+class LegacyClusterStats:
+    nodes: List[LegacyNodeInfo]
+    vms: List[LegacyVMInfo]
+    storages: List[LegacyStorageInfo]
+    total_cpu_cores: int
+    total_memory: int
+    cluster_status: str
+
+def legacy_dataclass_to_dict(obj):
+    # 変更前の app.py と同じ処理
+    if hasattr(obj, '__dataclass_fields__'):
+        result = {}
+        for field_name, field_value in asdict(obj).items():
+            if isinstance(field_value, list):
+                result[field_name] = [legacy_dataclass_to_dict(item) for item in field_value]
+            else:
+                result[field_name] = field_value
+        return result
+    return obj
+
+def build(guests, node_cls, vm_cls, storage_cls, stats_cls):
+    node_count = max(1, guests // 100)
+    nodes = [node_cls(f'pve{i}', 'online', 0.25, 8.0e9, 64 * 2**30, 86400, 45.0, None) for i in range(node_count)]
+    vms = [
+        vm_cls(100 + i, f'guest-{i}', 'running' if i % 3 else 'stopped', f'pve{i % node_count}',
+               'vm' if i % 2 else 'container', 0.05, 2**30, 4 * 2**30)
+        for i in range(guests)
+    ]
+    storages = [
+        storage_cls(f'pve{i % node_count}', f'store{i}', 'dir', 2**40, 2**39, 2**39)
+        for i in range(node_count * 4)
+    ]
+    return stats_cls(nodes, vms, storages, node_count * 32, node_count * 64 * 2**30, 'online')
+
+def measure_memory(factory):
+    tracemalloc.start()
+    stats = factory()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return stats, size
+
+def report(label, legacy, current, unit):
+    print(f"{label:<28} legacy {legacy:>10.2f} {unit}   current {current:>10.2f} {unit}   ({legacy / current:.1f}x)")
+
+def main():
+    guests = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    legacy_factory = lambda: build(guests, LegacyNodeInfo, LegacyVMInfo, LegacyStorageInfo, LegacyClusterStats)
+    current_factory = lambda: build(guests, NodeInfo, VMInfo, StorageInfo, ClusterStats)
+
+    legacy, legacy_bytes = measure_memory(legacy_factory)
+    current, current_bytes = measure_memory(current_factory)
+    assert legacy_dataclass_to_dict(legacy) == {k: v for k, v in current.to_dict().items() if k != 'aggregates'}
+
+    print(f"guests={guests}, nodes={len(current.nodes)}, storages={len(current.storages)}")
+    report('snapshot memory', legacy_bytes / 1024, current_bytes / 1024, 'KiB')
+
+    repeat = 20
+    legacy_build = min(timeit.repeat(legacy_factory, number=1, repeat=repeat)) * 1000
+    current_build = min(timeit.repeat(current_factory, number=1, repeat=repeat)) * 1000
+    report('build snapshot', legacy_build, current_build, 'ms')
+
+    legacy_dict = min(timeit.repeat(lambda: legacy_dataclass_to_dict(legacy), number=1, repeat=repeat)) * 1000
+    current_dict = min(timeit.repeat(current.to_dict, number=1, repeat=repeat)) * 1000
+    report('to dict', legacy_dict, current_dict, 'ms')
+
+    legacy_json = min(timeit.repeat(lambda: json.dumps(legacy_dataclass_to_dict(legacy)), number=1, repeat=repeat)) * 1000
+    current_json = min(timeit.repeat(lambda: json.dumps(current.to_dict()), number=1, repeat=repeat)) * 1000
+    report('to dict + json.dumps', legacy_json, current_json, 'ms')
+
+if __name__ == '__main__':
+    main()
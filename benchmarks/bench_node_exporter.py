@@ -0,0 +1,82 @@
+"""
+node_exporter /metrics 解析のベンチマーク（従来のsplit+startswith方式 vs ストリーミングパーサ）
+
+使い方:
+    python benchmarks/bench_node_exporter.py [キャプチャしたmetricsファイル]
+
+ファイルを省略した場合は約2MBの合成ペイロードを生成して計測する。
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from fetch import node_exporter
+
+CHUNK_SIZE = node_exporter.CHUNK_SIZE
+TARGET_SIZE = 2 * 1024 * 1024
+
+def legacy_parse(text):
+    # 変更前の fetch_metrics と同じ処理
+    lines = text.split('\n')
+    output = {}
+    for line in lines:
+        if line.startswith("node_memory_MemAvailable_bytes"):
+            output['mem_available'] = int(float(line.split()[-1]))
+        elif line.startswith("node_memory_MemTotal_bytes"):
+            output['mem_total'] = int(float(line.split()[-1]))
+        elif line.startswith("node_load1"):
+            output['load1'] = float(line.split()[-1])
+        elif line.startswith("node_load5"):
+            output['load5'] = float(line.split()[-1])
+        elif line.startswith("node_load15"):
+            output['load15'] = float(line.split()[-1])
+    return output
+
+def synthetic_payload():
+    parts = []
+    size = 0
+    family = 0
+    while size < TARGET_SIZE:
+        name = f'node_synthetic_family_{family}_total'
+        parts.append(f'# HELP {name} Synthetic counter family {family}.\n')
+        parts.append(f'# TYPE {name} counter\n')
+        for cpu in range(16):
+            for mode in ('idle', 'iowait', 'irq', 'nice', 'softirq', 'steal', 'system', 'user'):
+                parts.append(f'{name}{{cpu="{cpu}",mode="{mode}"}} {family * 1000 + cpu}.25\n')
+        size = sum(len(p) for p in parts)
+        family += 1
+    parts.append('# HELP node_load1 1m load average.\n# TYPE node_load1 gauge\nnode_load1 0.52\n')
+    parts.append('node_load5 0.61\nnode_load15 0.7\n')
+    parts.append('node_memory_MemAvailable_bytes 1.2345e+10\n')
+    parts.append('node_memory_MemTotal_bytes 3.3554432e+10\n')
+    return ''.join(parts).encode('utf-8')
+
+def chunks(payload):
+    return [payload[i:i + CHUNK_SIZE] for i in range(0, len(payload), CHUNK_SIZE)]
+
+def main():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], 'rb') as f:
+            payload = f.read()
+    else:
+        payload = synthetic_payload()
+
+    split_payload = chunks(payload)
+    legacy = legacy_parse(payload.decode('utf-8'))
+    streaming = node_exporter.parse_metrics(split_payload)
+    line_count = payload.count(b'\n')
+    print(f'payload: {len(payload) / 1024 / 1024:.2f} MB, {line_count} lines')
+    print(f'legacy:    {legacy}')
+    print(f'streaming: {streaming}')
+
+    runs = 20
+    # 従来方式はレスポンス全体のデコードも含めて計測
+    legacy_time = min(timeit.repeat(lambda: legacy_parse(payload.decode('utf-8')), number=1, repeat=runs))
+    streaming_time = min(timeit.repeat(lambda: node_exporter.parse_metrics(split_payload), number=1, repeat=runs))
+    print(f'legacy:    {legacy_time * 1000:.2f} ms')
+    print(f'streaming: {streaming_time * 1000:.2f} ms ({legacy_time / streaming_time:.1f}x)')
+
+if __name__ == '__main__':
+    main()
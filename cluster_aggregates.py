@@ -0,0 +1,95 @@
+"""
+クラスター集計 - スナップショットを1回走査して列を作り、使用率・パーセンタイル・上位N件・件数をまとめて計算
+"""
+import heapq
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# 上位消費者として返す件数
+TOP_N = 5
+# 計算するパーセンタイル
+PERCENTILES = (50, 90, 99)
+
+def _pct(used, total) -> Optional[float]:
+    return used * 100.0 / total if total else None
+
+def _mean(values: List[float]) -> float:
+    return sum(values) / len(values) if values else 0
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    """線形補間のパーセンタイル（ソートは1回だけ）"""
+    ordered = sorted(values)
+    result = {}
+    for p in PERCENTILES:
+        if not ordered:
+            result[f'p{p}'] = None
+            continue
+        rank = (len(ordered) - 1) * p / 100.0
+        lower = int(rank)
+        upper = min(lower + 1, len(ordered) - 1)
+        result[f'p{p}'] = ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+    return result
+
+def compute(nodes: Iterable[Tuple[str, str, float, float, float]],
+            guests: Iterable[Tuple[Any, str, str, Optional[float], Optional[float]]],
+            top_n: int = TOP_N) -> Dict[str, Any]:
+    """
+    nodes: (名前, ステータス, CPU使用率(0-1), メモリ使用量, メモリ総量)
+    guests: (VMID, 名前, ステータス, CPU使用率(0-1), メモリ使用量)
+    """
+    # ノード列
+    node_names, node_status, node_cpu, node_mem_used, node_mem_total = [], [], [], [], []
+    for name, status, cpu, mem_used, mem_total in nodes:
+        node_names.append(name)
+        node_status.append(status)
+        node_cpu.append((cpu or 0) * 100.0)
+        node_mem_used.append(mem_used or 0)
+        node_mem_total.append(mem_total or 0)
+    node_mem_pct = [_pct(used, total) or 0 for used, total in zip(node_mem_used, node_mem_total)]
+
+    # ゲスト列
+    guest_ids, guest_names, guest_cpu, guest_mem = [], [], [], []
+    status_counts: Dict[str, int] = {}
+    for vmid, name, status, cpu, mem_used in guests:
+        guest_ids.append(vmid)
+        guest_names.append(name)
+        guest_cpu.append((cpu or 0) * 100.0)
+        guest_mem.append(mem_used or 0)
+        status_counts[status] = status_counts.get(status, 0) + 1
+
+    memory_used = sum(node_mem_used)
+    memory_total = sum(node_mem_total)
+    indexes = range(len(guest_ids))
+
+    return {
+        'cluster': {
+            'cpu_avg_pct': _mean(node_cpu),
+            'memory_avg_pct': _mean(node_mem_pct),
+            'memory_pct': _pct(memory_used, memory_total),
+            'memory_used': memory_used,
+            'memory_total': memory_total,
+            'nodes': len(node_names),
+            'nodes_online': node_status.count('online'),
+            'guests': len(guest_ids),
+            'guests_running': status_counts.get('running', 0)
+        },
+        'nodes': {
+            name: {'cpu_pct': cpu, 'memory_pct': mem}
+            for name, cpu, mem in zip(node_names, node_cpu, node_mem_pct)
+        },
+        'percentiles': {
+            'node_cpu_pct': percentiles(node_cpu),
+            'node_memory_pct': percentiles(node_mem_pct),
+            'guest_cpu_pct': percentiles(guest_cpu)
+        },
+        'top': {
+            'cpu': [
+                {'vmid': guest_ids[i], 'name': guest_names[i], 'cpu_pct': guest_cpu[i]}
+                for i in heapq.nlargest(top_n, indexes, key=guest_cpu.__getitem__)
+            ],
+            'memory': [
+                {'vmid': guest_ids[i], 'name': guest_names[i], 'memory_used': guest_mem[i]}
+                for i in heapq.nlargest(top_n, indexes, key=guest_mem.__getitem__)
+            ]
+        },
+        'counts': {'guest_status': status_counts}
+    }
@@ -0,0 +1,36 @@
+"""
+クラスター識別 - /cluster/status から所属クラスターを判定し、同じクラスターのホストを1グループにまとめる
+"""
+from typing import Any, Callable, Dict, List, Optional
+
+# 識別結果を再確認する間隔（秒）- 構成変更（クラスター参加・離脱）への追従用
+IDENTITY_REFRESH_INTERVAL = 600
+
+def host_identity(host: str) -> str:
+    """クラスターに属さない（または識別できない）ホストの識別子"""
+    return f"host:{host}"
+
+def cluster_identity(status: Optional[List[Dict[str, Any]]], host: str) -> Optional[str]:
+    """/cluster/status の結果からクラスター識別子を返す（取得失敗時は None）
+    単体ノードは重複しうるノード名（既定の 'pve' など）ではなく設定上のホストで識別し、他のホストとまとめない"""
+    if not status:
+        return None
+    for entry in status:
+        if entry.get('type') == 'cluster':
+            return f"cluster:{entry.get('name')}"
+    return host_identity(host)
+
+def group_by_cluster(members: List[Any], identity_of: Callable[[Any], Optional[str]],
+                     name_of: Callable[[Any], str]) -> Dict[str, List[Any]]:
+    """同じクラスターのメンバーをまとめる（識別できないメンバーは単独のグループ、順序は設定順）"""
+    groups = {}
+    for member in members:
+        identity = identity_of(member) or host_identity(name_of(member))
+        groups.setdefault(identity, []).append(member)
+    return groups
+
+def failover_order(group: List[Any], active: Any) -> List[Any]:
+    """前回成功したメンバーを先頭にし、残りは設定順で予備とする"""
+    if active in group:
+        return [active] + [member for member in group if member is not active]
+    return list(group)
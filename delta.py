@@ -0,0 +1,99 @@
+"""
+WebSocket差分配信 - ClusterStats を前回との差分（JSON Patch形式の操作列）と連番で配信
+"""
+import threading
+from dataclasses import fields
+from typing import Any, Callable, Dict, List, Optional
+
+from records import record_to_dict
+
+def _qualified(item, key: str) -> str:
+    # 複数クラスターを収集するとノード名・VMIDが重複するため、クラスター識別子を前に付ける
+    cluster = getattr(item, 'cluster', '')
+    return f"{cluster}/{key}" if cluster else key
+
+# 一覧項目のキー（クラスター + ノード名 / VMID / ノード+ストレージ名）
+COLLECTION_KEYS: Dict[str, Callable[[Any], str]] = {
+    'nodes': lambda node: _qualified(node, node.name),
+    'vms': lambda vm: _qualified(vm, str(vm.vmid)),
+    'storages': lambda storage: _qualified(storage, f"{storage.node}/{storage.storage}"),
+}
+
+def _escape(key: str) -> str:
+    # RFC 6901 のパス要素エスケープ
+    return key.replace('~', '~0').replace('/', '~1')
+
+_field_name_cache: Dict[type, tuple] = {}
+
+def _field_names(obj) -> tuple:
+    names = _field_name_cache.get(type(obj))
+    if names is None:
+        names = _field_name_cache[type(obj)] = tuple(f.name for f in fields(obj))
+    return names
+
+class DeltaTracker:
+    def __init__(self):
+        self.seq = 0
+        self.timestamp: Optional[str] = None
+        # 一覧毎のキー -> 項目（前回送信した状態）
+        self._items: Dict[str, Dict[str, Any]] = {name: {} for name in COLLECTION_KEYS}
+        self._scalars: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def update(self, stats, timestamp: str) -> Optional[Dict[str, Any]]:
+        """新しい ClusterStats との差分を計算し、変化があれば差分メッセージを返す"""
+        with self._lock:
+            ops = []
+            for name in _field_names(stats):
+                value = getattr(stats, name)
+                if name in COLLECTION_KEYS:
+                    ops.extend(self._diff_collection(name, value))
+                elif self._scalars.get(name, object()) != value:
+                    self._scalars[name] = value
+                    ops.append({'op': 'replace', 'path': f'/{name}', 'value': value})
+            if not ops:
+                return None
+            self.seq += 1
+            self.timestamp = timestamp
+            return {'seq': self.seq, 'ops': ops, 'timestamp': timestamp}
+
+    def _diff_collection(self, name: str, items: list) -> List[Dict[str, Any]]:
+        key_of = COLLECTION_KEYS[name]
+        previous = self._items[name]
+        current = {}
+        ops = []
+        seen: Dict[str, int] = {}
+        for item in items:
+            key = key_of(item)
+            if key in seen:
+                # それでも重複したキーは出現順に '#2', '#3' を付けて区別する（クライアントも同じ規則でキーを作る）
+                seen[key] += 1
+                key = f"{key}#{seen[key]}"
+            else:
+                seen[key] = 1
+            current[key] = item
+            old = previous.get(key)
+            path = f'/{name}/{_escape(key)}'
+            if old is None:
+                ops.append({'op': 'add', 'path': path, 'value': record_to_dict(item)})
+            elif old != item:
+                # データクラスの等価比較で変化を検出し、変わった項目だけ送る
+                for field_name in _field_names(item):
+                    value = getattr(item, field_name)
+                    if getattr(old, field_name) != value:
+                        ops.append({'op': 'replace', 'path': f'{path}/{field_name}', 'value': value})
+        for key in previous:
+            if key not in current:
+                ops.append({'op': 'remove', 'path': f'/{name}/{_escape(key)}'})
+        self._items[name] = current
+        return ops
+
+    def snapshot(self) -> Optional[Dict[str, Any]]:
+        """接続時・再同期時に送る全体スナップショット（連番付き）"""
+        with self._lock:
+            if self.seq == 0:
+                return None
+            data = dict(self._scalars)
+            for name, items in self._items.items():
+                data[name] = [record_to_dict(item) for item in items.values()]
+            return {'seq': self.seq, 'data': data, 'timestamp': self.timestamp}
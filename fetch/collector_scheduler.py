@@ -0,0 +1,86 @@
+import math
+import threading
+import time
+from datetime import datetime
+
+class FixedRateCollector:
+    """1ソースを固定レートで実行する（開始時刻基準でドリフトを補正し、遅れた回は積まずにスキップ）"""
+
+    def __init__(self, name, fn, interval):
+        self.name = name
+        self.fn = fn
+        self.interval = interval
+        self.runs = 0
+        self.skipped = 0
+        self.last_started = None
+        self.last_duration = None
+        self.last_lag = None
+        self.max_lag = 0.0
+        self._next_run = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, delay=None):
+        self._next_run = time.monotonic() + (self.interval if delay is None else delay)
+        self._thread = threading.Thread(target=self._loop, name=f'collector-{self.name}', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.wait(max(0.0, self._next_run - time.monotonic())):
+            started = time.monotonic()
+            # 予定時刻からの遅れ（スレッドの起床遅延）
+            self.last_lag = started - self._next_run
+            self.max_lag = max(self.max_lag, self.last_lag)
+            self.last_started = datetime.now()
+            try:
+                self.fn()
+            except Exception as e:
+                print(f"[{datetime.now()}] Collector {self.name} error: {str(e)}")
+            finished = time.monotonic()
+            self.last_duration = finished - started
+            self.runs += 1
+
+            # 次回は前回の予定時刻 + 間隔（実行時間の分だけ周期が延びない）
+            self._next_run += self.interval
+            if finished > self._next_run:
+                # 間隔を超えて実行した場合は過ぎた回をまとめて飛ばす
+                missed = math.ceil((finished - self._next_run) / self.interval)
+                self.skipped += missed
+                self._next_run += missed * self.interval
+
+    def status(self):
+        return {
+            'interval': self.interval,
+            'runs': self.runs,
+            'skipped': self.skipped,
+            'last_started': self.last_started.isoformat() if self.last_started else None,
+            'last_duration': self.last_duration,
+            'last_lag': self.last_lag,
+            'max_lag': self.max_lag,
+            # 最終実行からの経過が間隔をどれだけ超えているか（鮮度の遅れ）
+            'staleness': max(0.0, (datetime.now() - self.last_started).total_seconds() - self.interval) if self.last_started else None
+        }
+
+class CollectorScheduler:
+    """ソース毎に独立したスレッドで収集し、遅いソースが他のソースの鮮度に影響しないようにする"""
+
+    def __init__(self):
+        self.collectors = {}
+
+    def add(self, name, fn, interval):
+        self.collectors[name] = FixedRateCollector(name, fn, interval)
+        return self.collectors[name]
+
+    def start(self):
+        for collector in self.collectors.values():
+            collector.start()
+
+    def stop(self):
+        for collector in self.collectors.values():
+            collector.stop()
+
+    def status(self):
+        return {name: collector.status() for name, collector in self.collectors.items()}
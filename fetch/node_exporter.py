@@ -1,22 +1,75 @@
+import random
+import time
 import requests
+from concurrent.futures import ThreadPoolExecutor, wait
+from fetch import prometheus_text
 
-def fetch_metrics(ip, port):
+# 取得対象のメトリクス名 -> (出力キー, 型)
+WANTED_METRICS = {
+    'node_memory_MemAvailable_bytes': ('mem_available', int),
+    'node_memory_MemTotal_bytes': ('mem_total', int),
+    'node_load1': ('load1', float),
+    'node_load5': ('load5', float),
+    'node_load15': ('load15', float),
+}
+
+CHUNK_SIZE = 64 * 1024
+
+# 複数ターゲット取得のデフォルト設定（config.yaml の node_exporter セクションで上書き可能）
+DEFAULT_TIMEOUT = 3
+DEFAULT_JITTER = 0.5
+DEFAULT_MAX_WORKERS = 64
+
+def parse_metrics(chunks):
+    output = {}
+    for name, labels, value in prometheus_text.parse_stream(chunks, WANTED_METRICS):
+        key, cast = WANTED_METRICS[name]
+        output[key] = cast(value)
+    return output
+
+def fetch_metrics(ip, port, timeout=DEFAULT_TIMEOUT):
     try:
         url = f"http://{ip}:{port}/metrics"
-        res = requests.get(url, timeout=3)
-        lines = res.text.split('\n')
-        output = {}
-        for line in lines:
-            if line.startswith("node_memory_MemAvailable_bytes"):
-                output['mem_available'] = int(float(line.split()[-1]))  # 修正
-            elif line.startswith("node_memory_MemTotal_bytes"):
-                output['mem_total'] = int(float(line.split()[-1]))      # 修正
-            elif line.startswith("node_load1"):
-                output['load1'] = float(line.split()[-1])
-            elif line.startswith("node_load5"):
-                output['load5'] = float(line.split()[-1])
-            elif line.startswith("node_load15"):
-                output['load15'] = float(line.split()[-1])
-        return output
+        # レスポンス全体をメモリに載せず、チャンク毎に解析する
+        with requests.get(url, timeout=timeout, stream=True) as res:
+            return parse_metrics(res.iter_content(chunk_size=CHUNK_SIZE))
     except Exception as e:
         return {"error": str(e)}
+
+def _target_name(target):
+    return target.get('name') or f"{target['host']}:{target.get('port', 9100)}"
+
+def _scrape_one(target, timeout, jitter):
+    # 全ターゲットへのリクエストが同時に発火しないよう開始時刻をずらす
+    if jitter:
+        time.sleep(random.uniform(0, jitter))
+    started = time.monotonic()
+    metrics = fetch_metrics(target['host'], target.get('port', 9100), timeout)
+    metrics['scrape_duration'] = round(time.monotonic() - started, 3)
+    return metrics
+
+def scrape_targets(cfg):
+    """config.yaml の node_exporter セクションに従い全ターゲットを並列取得"""
+    targets = cfg.get('targets') or []
+    if not targets:
+        return {}
+    timeout = cfg.get('timeout', DEFAULT_TIMEOUT)
+    jitter = cfg.get('jitter', DEFAULT_JITTER)
+    max_workers = min(len(targets), cfg.get('max_workers', DEFAULT_MAX_WORKERS))
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = {
+            executor.submit(_scrape_one, target, target.get('timeout', timeout), jitter): _target_name(target)
+            for target in targets
+        }
+        # 1回の巡回はジッター + 最長タイムアウトで打ち切る
+        sweep_timeout = jitter + max(target.get('timeout', timeout) for target in targets)
+        done, not_done = wait(futures, timeout=sweep_timeout)
+        results = {futures[future]: future.result() for future in done}
+        for future in not_done:
+            future.cancel()
+            results[futures[future]] = {'error': 'scrape timeout'}
+        return results
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,96 @@
+import re
+
+# Prometheusテキスト形式（exposition format）のストリーミングパーサ
+# 登録したメトリクス名を bytes.find（C実装の高速検索）で直接探し、
+# HELP/TYPE行や不要なメトリクスの行はPython側で一切分割・生成しない
+
+_LABEL_RE = re.compile(rb'([a-zA-Z_][a-zA-Z0-9_]*)\s*=\s*"((?:[^"\\]|\\.)*)"')
+_ESCAPES = {b'\\\\': '\\', b'\\"': '"', b'\\n': '\n'}
+_ESCAPE_RE = re.compile(rb'\\[\\"n]')
+
+def _unescape(value):
+    if b'\\' not in value:
+        return value.decode('utf-8')
+    return _ESCAPE_RE.sub(lambda m: _ESCAPES[m.group(0)].encode('utf-8'), value).decode('utf-8')
+
+def parse_labels(raw):
+    """b'{a="x",b="y"}' 形式のラベルを辞書に変換"""
+    if not raw:
+        return {}
+    return {name.decode('ascii'): _unescape(value) for name, value in _LABEL_RE.findall(raw)}
+
+_SPACE = (ord(' '), ord('\t'))
+_OPEN_BRACE = ord('{')
+
+class ExpositionParser:
+    def __init__(self, wanted):
+        names = list(dict.fromkeys(wanted))
+        if not names:
+            raise ValueError('wanted metric names must not be empty')
+        # (行頭を表す改行付きの検索キー, 名前のbytes, 名前)
+        self._needles = [(b'\n' + name.encode('ascii'), name.encode('ascii'), name) for name in names]
+        self._tail = b''
+
+    def _parse_line(self, buf, start, end, name_len, name):
+        line_end = buf.find(b'\n', start, end)
+        if line_end < 0:
+            line_end = end
+        i = start + name_len
+        if i >= line_end:
+            return None
+        ch = buf[i]
+        labels = None
+        if ch == _OPEN_BRACE:
+            close = buf.rfind(b'}', i, line_end)
+            if close < 0:
+                return None
+            labels = buf[i:close + 1]
+            i = close + 1
+        elif ch not in _SPACE:
+            # より長い別名のメトリクス（node_load1 に対する node_load15 など）
+            return None
+        fields = buf[i:line_end].split()
+        if not fields:
+            return None
+        try:
+            value = float(fields[0])
+        except ValueError:
+            return None
+        return name, parse_labels(labels), value
+
+    def _scan(self, buf, end):
+        # buf は常に行頭から始まる
+        for needle, raw, name in self._needles:
+            if buf.startswith(raw):
+                sample = self._parse_line(buf, 0, end, len(raw), name)
+                if sample:
+                    yield sample
+            pos = buf.find(needle, 0, end)
+            while pos >= 0:
+                sample = self._parse_line(buf, pos + 1, end, len(raw), name)
+                if sample:
+                    yield sample
+                pos = buf.find(needle, pos + 1, end)
+
+    def feed(self, chunk):
+        """チャンクを受け取り、完結した行からサンプル (名前, ラベル, 値) を返す"""
+        buf = self._tail + chunk if self._tail else chunk
+        cut = buf.rfind(b'\n')
+        if cut < 0:
+            self._tail = buf
+            return
+        self._tail = buf[cut + 1:]
+        # 末尾の未完結行はコピーせず endpos で除外
+        yield from self._scan(buf, cut + 1)
+
+    def close(self):
+        """最終行（改行なし）を処理"""
+        tail, self._tail = self._tail, b''
+        if tail:
+            yield from self._scan(tail, len(tail))
+
+def parse_stream(chunks, wanted):
+    parser = ExpositionParser(wanted)
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    yield from parser.close()
@@ -1,68 +1,234 @@
+import time
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from fetch import proxmox_health
 
-def fetch_proxmox(cfg):
-    auth = requests.post(
-        f"https://{cfg['host']}:8006/api2/json/access/ticket",
-        data={"username": cfg['username'], "password": cfg['password']},
-        verify=cfg.get('verify_ssl', True)
-    ).json()['data']
-
-    ticket = auth['ticket']
-    csrf = auth['CSRFPreventionToken']
-    headers = {'CSRFPreventionToken': csrf, 'Cookie': f"PVEAuthCookie={ticket}"}
-
-    # 取得できる主要なAPIエンドポイント
-    endpoints = {
-        'cluster_resources': f"https://{cfg['host']}:8006/api2/json/cluster/resources",
-        'cluster_status': f"https://{cfg['host']}:8006/api2/json/cluster/status",
-        'nodes': f"https://{cfg['host']}:8006/api2/json/nodes",
-        'cluster_backup': f"https://{cfg['host']}:8006/api2/json/cluster/backup",
-        'cluster_tasks': f"https://{cfg['host']}:8006/api2/json/cluster/tasks",
-        'cluster_metrics': f"https://{cfg['host']}:8006/api2/json/cluster/metrics",
-        'cluster_options': f"https://{cfg['host']}:8006/api2/json/cluster/options",
-        'cluster_log': f"https://{cfg['host']}:8006/api2/json/cluster/log",
-    }
-    result = {}
-    for key, url in endpoints.items():
+# 並列取得のデフォルト設定（config.yamlのホスト毎に max_concurrency / cycle_deadline で上書き可能）
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_CYCLE_DEADLINE = 8.0
+REQUEST_TIMEOUT = 10
+# 接続確立のタイムアウト（停止中ホストからのフェイルオーバー時間の上限になる）
+CONNECT_TIMEOUT = 3
+TIMEOUTS = (CONNECT_TIMEOUT, REQUEST_TIMEOUT)
+
+# Proxmoxのチケットは2時間有効。期限の少し前に取り直す
+TICKET_LIFETIME = 2 * 60 * 60
+TICKET_REFRESH_MARGIN = 10 * 60
+
+# 取得できる主要なAPIエンドポイント
+CLUSTER_ENDPOINTS = {
+    'cluster_resources': '/cluster/resources',
+    'cluster_status': '/cluster/status',
+    'nodes': '/nodes',
+    'cluster_backup': '/cluster/backup',
+    'cluster_tasks': '/cluster/tasks',
+    'cluster_metrics': '/cluster/metrics',
+    'cluster_options': '/cluster/options',
+    'cluster_log': '/cluster/log',
+}
+
+# 各ノードごとの詳細エンドポイント
+NODE_ENDPOINTS = {
+    'status': '/nodes/{node}/status',
+    'syslog': '/nodes/{node}/syslog',
+    'tasks': '/nodes/{node}/tasks',
+    'rrd': '/nodes/{node}/rrddata',
+    'services': '/nodes/{node}/services',
+}
+
+class ProxmoxClient:
+    """ホスト毎の長寿命クライアント（コネクションプールと認証チケットを保持）"""
+
+    def __init__(self, cfg):
+        self.cfg = cfg
+        self.host = cfg['host']
+        self.base = f"https://{cfg['host']}:8006/api2/json"
+        self.verify = cfg.get('verify_ssl', True)
+
+        # 並列取得に合わせてプールサイズを調整し、keep-aliveで接続を使い回す
+        pool_size = cfg.get('max_concurrency', DEFAULT_MAX_CONCURRENCY)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.verify = self.verify
+        self.session.headers.update({'Connection': 'keep-alive'})
+
+        self._auth_lock = threading.Lock()
+        self._headers = None
+        self._ticket_expires = 0.0
+
+    def _login(self):
+        auth = self.session.post(
+            f"{self.base}/access/ticket",
+            data={"username": self.cfg['username'], "password": self.cfg['password']},
+            timeout=TIMEOUTS
+        ).json()['data']
+        self._headers = {
+            'CSRFPreventionToken': auth['CSRFPreventionToken'],
+            'Cookie': f"PVEAuthCookie={auth['ticket']}"
+        }
+        self._ticket_expires = time.monotonic() + TICKET_LIFETIME - TICKET_REFRESH_MARGIN
+
+    def auth_headers(self):
+        # 有効なチケットがあれば再利用し、期限切れ間近か401を受けた時だけ再認証
+        with self._auth_lock:
+            if self._headers is None or time.monotonic() >= self._ticket_expires:
+                self._login()
+            return self._headers
+
+    def invalidate(self, headers):
+        with self._auth_lock:
+            # 他スレッドが既に更新済みなら破棄しない
+            if self._headers is headers:
+                self._headers = None
+
+    def get_json(self, path):
         try:
-            res = requests.get(url, headers=headers, verify=cfg.get('verify_ssl', True), timeout=10)
-            result[key] = res.json()
+            headers = self.auth_headers()
+            res = self.session.get(self.base + path, headers=headers, timeout=TIMEOUTS)
+            if res.status_code == 401:
+                self.invalidate(headers)
+                res = self.session.get(self.base + path, headers=self.auth_headers(), timeout=TIMEOUTS)
+            return res.json()
         except Exception as e:
-            result[key] = {'error': str(e)}
+            return {'error': str(e)}
+
+    def close(self):
+        self.session.close()
+
+# ホスト毎のクライアントを保持（プロセス内で使い回す）
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(cfg):
+    key = (cfg['host'], cfg['username'])
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None or client.cfg != cfg:
+            if client is not None:
+                client.close()
+            client = ProxmoxClient(cfg)
+            _clients[key] = client
+        return client
+
+def fetch_proxmox(cfg, client=None, cluster_keys=None, node_keys=None, node_names=None):
+    # cluster_keys / node_keys を省略した場合は全エンドポイントを取得
+    # node_names を渡すとノード一覧の取得を待たずにノード毎のリクエストを発行
+    client = client or get_client(cfg)
+    # 認証失敗はホスト障害として呼び出し元に伝える
+    client.auth_headers()
+
+    cluster_keys = list(CLUSTER_ENDPOINTS) if cluster_keys is None else list(cluster_keys)
+    node_keys = list(NODE_ENDPOINTS) if node_keys is None else list(node_keys)
+    if node_keys and node_names is None and 'nodes' not in cluster_keys:
+        cluster_keys.append('nodes')
+
+    max_concurrency = cfg.get('max_concurrency', DEFAULT_MAX_CONCURRENCY)
+    deadline = time.monotonic() + cfg.get('cycle_deadline', DEFAULT_CYCLE_DEADLINE)
+
+    result = {}
+    node_details = {}
+    # future -> (ノード名 or None, キー)
+    pending = {}
+
+    # クラスター全体のエンドポイントとノード毎の詳細を同時に発行する
+    # （ノード一覧が返ってきた時点でノード毎のリクエストを追加投入）
+    executor = ThreadPoolExecutor(max_workers=max_concurrency)
+
+    def submit_node(name):
+        node_details[name] = {}
+        for nkey in node_keys:
+            npath = NODE_ENDPOINTS[nkey].format(node=name)
+            pending[executor.submit(client.get_json, npath)] = (name, nkey)
 
-    # 各ノードごとの詳細情報も取得
     try:
-        nodes = result.get('nodes', {}).get('data', [])
-        node_details = {}
-        for node in nodes:
-            node_name = node.get('node')
-            if node_name:
-                node_endpoints = {
-                    'status': f"https://{cfg['host']}:8006/api2/json/nodes/{node_name}/status",
-                    'syslog': f"https://{cfg['host']}:8006/api2/json/nodes/{node_name}/syslog",
-                    'tasks': f"https://{cfg['host']}:8006/api2/json/nodes/{node_name}/tasks",
-                    'rrd': f"https://{cfg['host']}:8006/api2/json/nodes/{node_name}/rrddata",
-                    'services': f"https://{cfg['host']}:8006/api2/json/nodes/{node_name}/services",
-                }
-                node_details[node_name] = {}
-                for nkey, nurl in node_endpoints.items():
-                    try:
-                        nres = requests.get(nurl, headers=headers, verify=cfg.get('verify_ssl', True), timeout=10)
-                        node_details[node_name][nkey] = nres.json()
-                    except Exception as e:
-                        node_details[node_name][nkey] = {'error': str(e)}
-        result['node_details'] = node_details
-    except Exception as e:
-        result['node_details'] = {'error': str(e)}
+        for key in cluster_keys:
+            pending[executor.submit(client.get_json, CLUSTER_ENDPOINTS[key])] = (None, key)
+        if node_names is not None:
+            for name in node_names:
+                submit_node(name)
+
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, _ = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                node_name, key = pending.pop(future)
+                data = future.result()
+                if node_name is None:
+                    result[key] = data
+                    if key == 'nodes' and node_names is None:
+                        for node in (data.get('data') or []):
+                            name = node.get('node')
+                            if name:
+                                submit_node(name)
+                else:
+                    node_details[node_name][key] = data
 
+        # 期限切れのリクエストはエラーとして記録
+        for future, (node_name, key) in pending.items():
+            future.cancel()
+            timeout_error = {'error': 'cycle deadline exceeded'}
+            if node_name is None:
+                result[key] = timeout_error
+            else:
+                node_details[node_name][key] = timeout_error
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    result['node_details'] = node_details
     return result
 
-def fetch_proxmox_cluster_any(cfg_list):
-    for cfg in cfg_list:
+def _probe_host(client):
+    client.auth_headers()
+    res = client.get_json('/version')
+    if 'error' in res:
+        raise RuntimeError(res['error'])
+
+# 設定ホスト一覧毎のフェイルオーバーセレクタ
+_selectors = {}
+
+def get_selector(cfg_list):
+    key = tuple(cfg['host'] for cfg in cfg_list)
+    with _clients_lock:
+        selector = _selectors.get(key)
+        if selector is None:
+            by_host = {cfg['host']: cfg for cfg in cfg_list}
+            selector = proxmox_health.FailoverSelector(
+                key, probe=lambda host: _probe_host(get_client(by_host[host]))
+            )
+            _selectors[key] = selector
+    selector.start_probing()
+    return selector
+
+def _is_host_failure(result):
+    # 取得を試みたエンドポイントが全て失敗した場合はホスト障害とみなす
+    values = [v for k, v in result.items() if k != 'node_details']
+    for details in result.get('node_details', {}).values():
+        values.extend(details.values())
+    return bool(values) and all('error' in v for v in values)
+
+def fetch_proxmox_cluster_any(cfg_list, **kwargs):
+    selector = get_selector(cfg_list)
+    by_host = {cfg['host']: cfg for cfg in cfg_list}
+    cycle_started = time.monotonic()
+    for host in selector.candidates():
+        cfg = by_host[host]
+        started = time.monotonic()
         try:
-            result = fetch_proxmox(cfg)
-            if result:
-                return result
+            result = fetch_proxmox(cfg, get_client(cfg), **kwargs)
         except Exception as e:
+            selector.record_failure(host, e)
+            continue
+        if not result or _is_host_failure(result):
+            selector.record_failure(host, 'no endpoint responded')
             continue
+        selector.record_success(host, time.monotonic() - started, cycle_started)
+        return result
     return {"error": "All Proxmox nodes are unreachable"}
+
+def failover_status(cfg_list):
+    return get_selector(cfg_list).status()
@@ -0,0 +1,149 @@
+import threading
+import time
+from datetime import datetime
+
+# サーキットブレーカーの状態
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# 連続失敗がこの回数に達したらオープン
+FAILURE_THRESHOLD = 3
+# オープン後、バックグラウンドで再試行するまでの秒数
+OPEN_COOLDOWN = 30
+# レイテンシEWMAの平滑化係数
+EWMA_ALPHA = 0.3
+# バックグラウンドプローブの間隔
+PROBE_INTERVAL = 15
+
+class HostHealth:
+    def __init__(self, host):
+        self.host = host
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.latency_ewma = None
+        self.last_error = None
+        self.last_success = None
+        self.last_failure = None
+        self.opened_at = None
+
+    def record_success(self, latency):
+        if self.latency_ewma is None:
+            self.latency_ewma = latency
+        else:
+            self.latency_ewma = EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.latency_ewma
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = None
+        self.last_error = None
+        self.last_success = datetime.now()
+
+    def record_failure(self, error):
+        self.consecutive_failures += 1
+        self.last_error = str(error)
+        self.last_failure = datetime.now()
+        if self.state == HALF_OPEN or self.consecutive_failures >= FAILURE_THRESHOLD:
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    def probe_due(self):
+        if self.state == OPEN:
+            return time.monotonic() - self.opened_at >= OPEN_COOLDOWN
+        return self.consecutive_failures > 0
+
+    def score(self):
+        # 小さいほど良い（失敗回数優先、次にレイテンシ）
+        return (self.consecutive_failures, self.latency_ewma if self.latency_ewma is not None else float('inf'))
+
+    def to_dict(self):
+        return {
+            'host': self.host,
+            'state': self.state,
+            'consecutive_failures': self.consecutive_failures,
+            'latency_ewma_ms': round(self.latency_ewma * 1000, 1) if self.latency_ewma is not None else None,
+            'last_success': self.last_success.isoformat() if self.last_success else None,
+            'last_failure': self.last_failure.isoformat() if self.last_failure else None,
+            'last_error': self.last_error
+        }
+
+class FailoverSelector:
+    """ホストの健全性を追跡し、最後に成功したホストを優先して使い続ける"""
+
+    def __init__(self, hosts, probe):
+        self.hosts = list(hosts)
+        self.health = {host: HostHealth(host) for host in self.hosts}
+        self.primary = self.hosts[0] if self.hosts else None
+        self.last_failover = None
+        self._probe = probe
+        self._lock = threading.Lock()
+        self._prober = None
+
+    def candidates(self):
+        with self._lock:
+            healthy = [h for h in self.hosts if h != self.primary and self.health[h].state == CLOSED]
+            healthy.sort(key=lambda h: self.health[h].score())
+            order = []
+            if self.primary is not None and self.health[self.primary].state == CLOSED:
+                order.append(self.primary)
+            order.extend(healthy)
+            # 全ホストがオープンの場合のみ、オープン中のホストも試す
+            if not order:
+                order = sorted(self.hosts, key=lambda h: self.health[h].score())
+            return order
+
+    def record_success(self, host, latency, cycle_started):
+        with self._lock:
+            self.health[host].record_success(latency)
+            if host != self.primary:
+                self.last_failover = {
+                    'from': self.primary,
+                    'to': host,
+                    'at': datetime.now().isoformat(),
+                    'seconds': round(time.monotonic() - cycle_started, 3)
+                }
+                self.primary = host
+
+    def record_failure(self, host, error):
+        with self._lock:
+            self.health[host].record_failure(error)
+
+    def start_probing(self):
+        # 同時に最初の呼び出しがあってもプローブスレッドは1本だけ
+        with self._lock:
+            if self._prober is not None:
+                return
+            self._prober = threading.Thread(target=self._probe_loop, daemon=True)
+        self._prober.start()
+
+    def _probe_loop(self):
+        while True:
+            time.sleep(PROBE_INTERVAL)
+            self.probe_once()
+
+    def probe_once(self):
+        """再試行時期を迎えたホストをプローブ（オープン中のプライマリも含め、実トラフィックを待たずに復帰させる）"""
+        with self._lock:
+            due = [
+                h for h in self.hosts
+                if (h != self.primary or self.health[h].state != CLOSED) and self.health[h].probe_due()
+            ]
+            for host in due:
+                if self.health[host].state == OPEN:
+                    self.health[host].state = HALF_OPEN
+        for host in due:
+            started = time.monotonic()
+            try:
+                self._probe(host)
+            except Exception as e:
+                self.record_failure(host, e)
+            else:
+                with self._lock:
+                    self.health[host].record_success(time.monotonic() - started)
+
+    def status(self):
+        with self._lock:
+            return {
+                'active_host': self.primary,
+                'last_failover': self.last_failover,
+                'hosts': [self.health[h].to_dict() for h in self.hosts]
+            }
@@ -0,0 +1,89 @@
+import threading
+import time
+
+# エンドポイント毎の更新間隔（秒）。None はオンデマンド取得のみ
+# 'node.' で始まるキーはノード毎のエンドポイント
+DEFAULT_TIERS = {
+    'cluster_resources': 5,
+    'nodes': 10,
+    'cluster_status': 10,
+    'cluster_tasks': 30,
+    'cluster_metrics': 60,
+    'cluster_log': 300,
+    'cluster_options': 600,
+    'cluster_backup': 600,
+    'node.status': 30,
+    'node.tasks': 60,
+    'node.rrd': 60,
+    'node.services': 600,
+    'node.syslog': None,
+}
+
+NODE_PREFIX = 'node.'
+
+def _ok(value):
+    return isinstance(value, dict) and 'error' not in value
+
+class TieredScheduler:
+    """エンドポイント毎の更新間隔を管理し、取得結果をキャッシュにマージする"""
+
+    def __init__(self, tiers=None, slack=0.0):
+        self.tiers = dict(DEFAULT_TIERS)
+        if tiers:
+            self.tiers.update(tiers)
+        # 起床の揺らぎで間隔ちょうどの回を取りこぼさないための余裕（秒、収集間隔の半分程度）
+        self.slack = slack
+        self.last_fetch = {}
+        # due() が返したキー -> 取得を開始した時刻（merge で成功したキーの取得時刻にする）
+        self._dispatched = {}
+        self._lock = threading.Lock()
+
+    def due(self, force=False):
+        """今回取得すべき (クラスターキー, ノードキー) を返す（force=True は間隔を無視して定期取得の全階層）"""
+        now = time.monotonic()
+        cluster_keys, node_keys = [], []
+        with self._lock:
+            for key, interval in self.tiers.items():
+                if interval is None:
+                    continue
+                last = self.last_fetch.get(key)
+                if not force and last is not None and now - last < interval - self.slack:
+                    continue
+                self._dispatched[key] = now
+                if key.startswith(NODE_PREFIX):
+                    node_keys.append(key[len(NODE_PREFIX):])
+                else:
+                    cluster_keys.append(key)
+        return cluster_keys, node_keys
+
+    def _mark(self, key, now):
+        # 取得完了時刻ではなく開始時刻を記録し、取得にかかった時間の分だけ周期が延びないようにする
+        with self._lock:
+            self.last_fetch[key] = self._dispatched.pop(key, now)
+
+    def merge(self, cache, result):
+        """取得結果をキャッシュにマージする（失敗したエンドポイントは前回値を保持し次回再取得）"""
+        now = time.monotonic()
+        for key, value in result.items():
+            if key == 'node_details' or not _ok(value):
+                continue
+            cache[key] = value
+            self._mark(key, now)
+
+        node_cache = cache.setdefault('node_details', {})
+        # ノード一覧を取得できた場合は消えたノードの詳細を破棄
+        if _ok(result.get('nodes')):
+            alive = {node.get('node') for node in (result['nodes'].get('data') or [])}
+            for name in list(node_cache):
+                if name not in alive:
+                    del node_cache[name]
+
+        fetched_node_keys = set()
+        for name, details in (result.get('node_details') or {}).items():
+            for nkey, value in details.items():
+                if _ok(value):
+                    node_cache.setdefault(name, {})[nkey] = value
+                    fetched_node_keys.add(nkey)
+        for nkey in fetched_node_keys:
+            self._mark(NODE_PREFIX + nkey, now)
+        return cache
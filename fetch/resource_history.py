@@ -1,36 +1,337 @@
-import sqlite3
 import json
 import os
-from datetime import datetime, timedelta
+import time
+from datetime import datetime, timedelta, timezone
+from storage.sqlite_store import SQLiteStore
+from storage.history_window import HistoryWindow
+from storage.rollup import AGGREGATES, RAW_INTERVAL, RollupTables, choose_tier
+from storage.retention import RetentionManager, build_rules
 
-DB_PATH = os.path.join(os.path.dirname(__file__), 'resource_history.db')
+# RESOURCE_HISTORY_DB で保存先を変更可能（テストなど）
+DB_PATH = os.environ.get('RESOURCE_HISTORY_DB') or os.path.join(os.path.dirname(__file__), 'resource_history.db')
+
+store = SQLiteStore(DB_PATH)
+# ソース毎の収集スレッドの insert_resource を一定間隔でまとめてコミット
+start_batching = store.start_batching
+
+# 1分/10分/1時間の集計テーブル（samples_1m, samples_10m, samples_1h）
+rollups = RollupTables('samples', keys=('source', 'entity', 'metric'), values=('value',))
+
+# /metrics/*/history が返す期間（日）
+HISTORY_WINDOW_DAYS = 7
+
+# ソース毎の直近履歴（load_window で一括ロード、insert_resource で追記）
+windows = {}
+
+# ソース毎の最後に保存したサンプルの time.monotonic()（手動更新の連打などで RAW_INTERVAL より密に書かないため）
+last_insert = {}
+# 収集時間の揺らぎで RAW_INTERVAL 毎のサンプルを落とさないよう、この間隔未満だけを間引く
+MIN_INSERT_GAP = RAW_INTERVAL / 2
+
+# 保持期間ポリシー（start_retention で設定・開始）
+retention = None
+
+# 旧スキーマ（1サイクル1行のJSON）からの移行時に1トランザクションで処理する行数
+MIGRATION_BATCH = 500
+# 移行後の旧テーブル（削除せずに残す）
+LEGACY_BACKUP_TABLE = 'resource_history_legacy'
+
+# 1サンプル毎に必ず書く行（空のスナップショットでもその時刻のサンプルが残る）
+SAMPLE_MARKER = ('', '', None, None)
+
+# Proxmoxのフィルタ済みデータの一覧キー -> (エンティティ種別, ID項目, 稼働中とみなすステータス)
+PROXMOX_KINDS = {
+    'nodes': ('node', 'node', 'online'),
+    'vms': ('qemu', 'vmid', 'running'),
+    'containers': ('lxc', 'vmid', 'running'),
+}
 
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS resource_history (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        timestamp TEXT NOT NULL,
+    with store.transaction() as c:
+        _create_tables(c)
+    migrate_legacy_table()
+    # 集計導入前のDBは生データから集計テーブルを作成
+    rollups.backfill(store, 'samples', 'ts', ('source', 'entity', 'metric'), where='value IS NOT NULL')
+
+def _create_tables(c):
+    # 1行 = (時刻, ソース, エンティティ, メトリクス) の値（数値は value、文字列・真偽値はJSONで text）
+    c.execute('''CREATE TABLE IF NOT EXISTS samples (
+        ts INTEGER NOT NULL,
         source TEXT NOT NULL,
-        data TEXT NOT NULL
+        entity TEXT NOT NULL,
+        metric TEXT NOT NULL,
+        value REAL,
+        text TEXT
     )''')
-    conn.commit()
-    conn.close()
+    columns = {row[1] for row in c.execute('PRAGMA table_info(samples)').fetchall()}
+    if 'text' not in columns:
+        c.execute('ALTER TABLE samples ADD COLUMN text TEXT')
+    # 旧テーブルの移行の進み具合（途中で止まっても同じ行を二重に移行しない）
+    c.execute('CREATE TABLE IF NOT EXISTS migration_progress (name TEXT PRIMARY KEY, last_id INTEGER NOT NULL)')
+    # 単一系列の読み出し用（例: あるVMの7日分のCPU）
+    c.execute('CREATE INDEX IF NOT EXISTS idx_samples_series ON samples (source, entity, metric, ts)')
+    # ソース全体のスナップショット読み出し用
+    c.execute('CREATE INDEX IF NOT EXISTS idx_samples_source_ts ON samples (source, ts)')
+    rollups.create(c)
+
+def start_retention(cfg=None):
+    """config.yaml の retention 設定で古いサンプルの定期削除を開始"""
+    global retention
+    cfg = cfg or {}
+    if retention is None:
+        retention = RetentionManager(
+            store,
+            build_rules([('samples', 'ts', 'epoch')], [rollups], cfg.get('ttl_days')),
+            batch_size=cfg.get('batch_size', 5000)
+        )
+        retention.start(cfg.get('interval_minutes', 60))
+    return retention
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _flatten(obj, path=()):
+    # 葉を (パス, 値) として列挙（リストの要素は '[0]' として辞書のキーと区別する）
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            yield from _flatten(value, path + (str(key),))
+    elif isinstance(obj, list):
+        for index, value in enumerate(obj):
+            yield from _flatten(value, path + (f'[{index}]',))
+    elif obj is not None and path:
+        yield path, obj
+
+def _row(entity, metric, value):
+    if _is_number(value):
+        return (entity, metric, float(value), None)
+    return (entity, metric, None, json.dumps(value))
+
+def explode(source, data):
+    """ペイロードを (エンティティ, メトリクス, 数値, テキスト) の行に分解"""
+    rows = []
+    if source == 'proxmox':
+        for list_key, (kind, id_key, up_status) in PROXMOX_KINDS.items():
+            for item in data.get(list_key) or []:
+                if item.get(id_key) is None:
+                    continue
+                entity = f"{kind}/{item[id_key]}"
+                rows.append((entity, 'up', 1.0 if item.get('status') == up_status else 0.0, None))
+                # IDは型（VMIDは数値、ノード名は文字列）を保ったまま text に保存し、集計対象にしない
+                rows.append((entity, id_key, None, json.dumps(item[id_key])))
+                fields = {k: v for k, v in item.items() if k != id_key}
+                for path, value in _flatten(fields):
+                    rows.append(_row(entity, '.'.join(path), value))
+    else:
+        for path, value in _flatten(data):
+            rows.append(_row('.'.join(path[:-1]), path[-1], value))
+    return rows
+
+def _restore_value(value):
+    if value is not None and value.is_integer():
+        return int(value)
+    return value
+
+def _restore(value, text):
+    if text is not None:
+        return json.loads(text)
+    return _restore_value(value)
+
+def _set_path(target, path, value):
+    for key in path[:-1]:
+        target = target.setdefault(key, {})
+    target[path[-1]] = value
+
+def _is_index(key):
+    return key.startswith('[') and key.endswith(']') and key[1:-1].isdigit()
+
+def _lists_from_indexes(obj):
+    # 全キーがリストの要素（'[0]', '[1]', ...）の辞書はリストに戻す
+    if not isinstance(obj, dict):
+        return obj
+    restored = {key: _lists_from_indexes(value) for key, value in obj.items()}
+    if restored and all(_is_index(key) for key in restored):
+        return [restored[key] for key in sorted(restored, key=lambda key: int(key[1:-1]))]
+    return restored
+
+def implode(source, rows):
+    """(エンティティ, メトリクス, 数値, テキスト) の行からペイロードを再構成"""
+    if source == 'proxmox':
+        items = {}
+        up = {}
+        kinds = {kind: (list_key, id_key, up_status) for list_key, (kind, id_key, up_status) in PROXMOX_KINDS.items()}
+        data = {list_key: [] for list_key in PROXMOX_KINDS}
+        for entity, metric, value, text in rows:
+            kind, _, ident = entity.partition('/')
+            if not metric or kind not in kinds:
+                continue
+            list_key, id_key, up_status = kinds[kind]
+            item = items.get(entity)
+            if item is None:
+                # ID の行がない場合（集計階層など）はエンティティ名の文字列のまま
+                item = {id_key: ident}
+                items[entity] = item
+                data[list_key].append(item)
+            if metric == 'up':
+                up[entity] = up_status if value else ('offline' if kind == 'node' else 'stopped')
+            else:
+                _set_path(item, metric.split('.'), _restore(value, text))
+        # ステータス文字列がない行（集計階層など）は稼働フラグから戻す
+        for entity, status in up.items():
+            items[entity].setdefault('status', status)
+        return data
+
+    data = {}
+    for entity, metric, value, text in rows:
+        if not metric:
+            continue
+        path = (entity.split('.') if entity else []) + [metric]
+        _set_path(data, path, _restore(value, text))
+    return _lists_from_indexes(data)
+
+def _insert_rows(c, ts, source, rows):
+    c.executemany(
+        'INSERT INTO samples (ts, source, entity, metric, value, text) VALUES (?, ?, ?, ?, ?, ?)',
+        [(ts, source, entity, metric, value, text) for entity, metric, value, text in [SAMPLE_MARKER] + rows]
+    )
+    # 集計テーブルも同じトランザクションで更新（数値の行のみ）
+    rollups.update(c, ts, [((source, entity, metric), (value,)) for entity, metric, value, _ in rows if value is not None])
+
+def _to_epoch(iso_timestamp):
+    return int(datetime.fromisoformat(iso_timestamp).replace(tzinfo=timezone.utc).timestamp())
+
+def _to_iso(ts):
+    return datetime.fromtimestamp(ts, tz=timezone.utc).replace(tzinfo=None).isoformat()
+
+def migrate_legacy_table():
+    """旧 resource_history テーブル（JSON TEXT）を samples に移行し、旧テーブルは名前を変えて残す"""
+    with store.reader() as c:
+        c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='resource_history'")
+        if c.fetchone() is None:
+            return
+        c.execute("SELECT last_id FROM migration_progress WHERE name='resource_history'")
+        progress = c.fetchone()
+        c.execute('SELECT COUNT(*) FROM resource_history')
+        total = c.fetchone()[0]
+    print(f"[{datetime.now()}] Migrating resource_history to samples...")
+    last_id = progress[0] if progress else 0
+    migrated = 0
+    skipped = 0
+    # ソース毎の直前のサンプル時刻（同じ秒の旧行は次の空いている秒にずらして別サンプルとして残す）
+    last_ts = {}
+    while True:
+        # バッチ毎にコミットし、ライターを長時間占有しない（進み具合も同じトランザクションで記録）
+        with store.transaction() as c:
+            c.execute(
+                'SELECT id, timestamp, source, data FROM resource_history WHERE id > ? ORDER BY id LIMIT ?',
+                (last_id, MIGRATION_BATCH)
+            )
+            batch = c.fetchall()
+            for row_id, timestamp, source, data in batch:
+                try:
+                    ts = _to_epoch(timestamp)
+                    if source in last_ts and ts <= last_ts[source]:
+                        ts = last_ts[source] + 1
+                    _insert_rows(c, ts, source, explode(source, json.loads(data)))
+                    last_ts[source] = ts
+                    migrated += 1
+                except (ValueError, TypeError, AttributeError) as e:
+                    print(f"[{datetime.now()}] Skipping legacy row {row_id}: {str(e)}")
+                    skipped += 1
+                last_id = row_id
+            c.execute(
+                "INSERT OR REPLACE INTO migration_progress (name, last_id) VALUES ('resource_history', ?)",
+                (last_id,)
+            )
+        if not batch:
+            break
+
+    # 全行を処理できたことを確かめてから旧テーブルを退避（削除はしない）
+    with store.reader() as c:
+        c.execute('SELECT COUNT(*) FROM resource_history WHERE id > ?', (last_id,))
+        remaining = c.fetchone()[0]
+    incomplete = remaining or (progress is None and migrated + skipped != total)
+    if incomplete:
+        print(f"[{datetime.now()}] Legacy migration incomplete ({migrated + skipped}/{total} rows), keeping resource_history")
+        return
+    with store.transaction() as c:
+        c.execute(f'ALTER TABLE resource_history RENAME TO {LEGACY_BACKUP_TABLE}')
+    print(f"[{datetime.now()}] Migrated {migrated} legacy history rows ({skipped} skipped), old table kept as {LEGACY_BACKUP_TABLE}")
 
 def insert_resource(source, data):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('INSERT INTO resource_history (timestamp, source, data) VALUES (?, ?, ?)', (datetime.utcnow().isoformat(), source, json.dumps(data)))
-    conn.commit()
-    conn.close()
-
-def get_resource_history(source, days=7):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    since = (datetime.utcnow() - timedelta(days=days)).isoformat()
-    c.execute('SELECT timestamp, data FROM resource_history WHERE source=? AND timestamp >= ? ORDER BY timestamp DESC', (source, since))
-    rows = c.fetchall()
-    conn.close()
-    return [(ts, json.loads(d)) for ts, d in rows]
+    now = time.monotonic()
+    last = last_insert.get(source)
+    if last is not None and now - last < MIN_INSERT_GAP:
+        return
+    last_insert[source] = now
+    ts = int(time.time())
+    rows = explode(source, data)
+    store.write(lambda c: _insert_rows(c, ts, source, rows), lambda: _append_window(source, ts, rows))
+
+def _append_window(source, ts, rows):
+    # コミットされた行だけを、DBから読み出した場合と同じ形で追記（ロールバックされたサイクルは載せない）
+    window = windows.get(source)
+    if window is not None and window.loaded:
+        window.append(ts, _to_iso(ts), implode(source, rows))
+
+def history_window(source):
+    window = windows.get(source)
+    if window is None:
+        window = windows.setdefault(source, HistoryWindow(HISTORY_WINDOW_DAYS * 86400))
+    return window
+
+def load_window(source):
+    """起動時に直近の履歴をDBから履歴ウィンドウへ一括ロード"""
+    window = history_window(source)
+    history = get_resource_history(source, days=HISTORY_WINDOW_DAYS)
+    window.load((_to_epoch(ts), ts, data) for ts, data in history)
+    return window
+
+def _group_snapshots(source, rows):
+    # 同一時刻の (ts, エンティティ, メトリクス, 数値, テキスト) 行をまとめてスナップショットに戻す
+    history = []
+    current_ts = None
+    current_rows = []
+    for ts, entity, metric, value, text in rows:
+        if ts != current_ts and current_rows:
+            history.append((_to_iso(current_ts), implode(source, current_rows)))
+            current_rows = []
+        current_ts = ts
+        current_rows.append((entity, metric, value, text))
+    if current_rows:
+        history.append((_to_iso(current_ts), implode(source, current_rows)))
+    return history
+
+def get_resource_history(source, days=7, max_points=None):
+    """履歴を新しい順に返す。max_points を指定すると点数に収まる集計階層（平均値）を使う"""
+    since = int((datetime.now(timezone.utc) - timedelta(days=days)).timestamp())
+    tier = choose_tier(days * 86400, max_points)
+    with store.reader() as c:
+        if tier is None:
+            c.execute('SELECT ts, entity, metric, value, text FROM samples WHERE source=? AND ts >= ? ORDER BY ts DESC', (source, since))
+            rows = c.fetchall()
+        else:
+            rows = [
+                (bucket, entity, metric, value, None)
+                for _, entity, metric, bucket, value in rollups.query(c, tier[0], since, {'source': source}, descending=True)
+            ]
+    return _group_snapshots(source, rows)
+
+def get_series(source, entity, metric, days=7, max_points=None, aggregate='avg'):
+    """単一系列（例: proxmox / qemu/100 / cpu）の (時刻, 値) を古い順に返す"""
+    if aggregate not in AGGREGATES:
+        raise ValueError(f"unknown aggregate: {aggregate}")
+    since = int((datetime.now(timezone.utc) - timedelta(days=days)).timestamp())
+    tier = choose_tier(days * 86400, max_points)
+    with store.reader() as c:
+        if tier is None:
+            c.execute(
+                'SELECT ts, value FROM samples WHERE source=? AND entity=? AND metric=? AND ts >= ? ORDER BY ts',
+                (source, entity, metric, since)
+            )
+            rows = c.fetchall()
+        else:
+            where = {'source': source, 'entity': entity, 'metric': metric}
+            rows = [(bucket, value) for _, _, _, bucket, value in rollups.query(c, tier[0], since, where, aggregate)]
+    return [(_to_iso(ts), _restore_value(value)) for ts, value in rows]
 
 init_db()
@@ -1,5 +1,5 @@
-from flask import Flask, jsonify
-from fetch import nextcloud_api, proxmox_api
+from flask import Flask, jsonify, request
+from fetch import nextcloud_api, proxmox_api, node_exporter
 import yaml
 import urllib3
 import os
@@ -7,22 +7,69 @@ import threading
 import time
 from datetime import datetime
 from fetch import resource_history
+from fetch import proxmox_schedule
+from fetch.collector_scheduler import CollectorScheduler
+from serving.response_cache import ResponseCache
+from serving.detailed_index import DetailedIndex, QueryError
+from serving.inventory import Inventory
+from serving.refresh_jobs import RefreshJobs
+from serving.snapshots import SingleFlight, SnapshotStore
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 app = Flask(__name__)
 
-# グローバルキャッシュ
-cache = {
-    'nextcloud': {'data': None, 'last_update': None, 'error': None},
-    'nextcloud_history': {'data': None, 'last_update': None, 'error': None},
-    'proxmox': {'data': None, 'last_update': None, 'error': None},
-    'proxmox_detailed': {'data': None, 'last_update': None, 'error': None},
-    'proxmox_history': {'data': None, 'last_update': None, 'error': None}
-}
+# グローバルキャッシュ（ソース毎の不変スナップショットを参照の差し替えで更新）
+cache = SnapshotStore([
+    'nextcloud', 'nextcloud_history', 'proxmox', 'proxmox_detailed', 'proxmox_history', 'node_exporter'
+])
+
+# 同じソースの同時更新（定期収集と手動更新）を1回の取得にまとめる
+refresh_flight = SingleFlight()
 
 # 更新間隔（秒）
 UPDATE_INTERVAL = 10
 
+# 手動更新の ?wait= で待つ最大秒数
+MAX_REFRESH_WAIT = 60
+
+# ソース毎の収集間隔（秒）- config.yaml の intervals で上書き可能
+# Proxmoxは最短の階層（cluster_resources: 5秒）に合わせる
+DEFAULT_COLLECTOR_INTERVALS = {
+    'nextcloud': UPDATE_INTERVAL,
+    'proxmox': proxmox_schedule.DEFAULT_TIERS['cluster_resources'],
+    'node_exporter': UPDATE_INTERVAL,
+}
+
+# Proxmoxの履歴はこの階層（10秒 = RAW_INTERVAL）を取得した回に保存
+HISTORY_TIER = 'nodes'
+
+# Proxmoxエンドポイント毎の更新間隔と、各階層の取得結果をマージした生データ
+proxmox_scheduler = proxmox_schedule.TieredScheduler()
+proxmox_raw_cache = {'node_details': {}}
+# proxmox_raw_cache への書き込み・読み出し（収集スレッドとsyslogリクエストのスレッド）を直列化
+proxmox_raw_lock = threading.Lock()
+
+# 更新時にシリアライズ済みの /metrics レスポンス
+response_cache = ResponseCache()
+
+def publish(key, data, indexes=None):
+    """新しいスナップショットを公開し、レスポンスとして1度だけシリアライズ"""
+    snapshot = cache.publish(key, data, indexes)
+    response_cache.put(key, {
+        "data": snapshot.data,
+        "last_update": snapshot.last_update.isoformat() if snapshot.last_update else None
+    })
+    return snapshot
+
+def history_response(source):
+    """履歴ウィンドウの世代毎に、最初のリクエスト時にシリアライズ"""
+    window = resource_history.history_window(source)
+    response_cache.put_lazy(f'{source}_history', window.version, lambda: {
+        "data": window.newest_first(),
+        "last_update": window.last_update.isoformat() if window.last_update else None
+    })
+    return response_cache.response(f'{source}_history')
+
 # CORSヘッダーを追加
 @app.after_request
 def after_request(response):
@@ -53,177 +100,287 @@ config = load_config()
 @app.route('/metrics/nextcloud')
 def nextcloud_metrics():
     print(f"[{datetime.now()}] API Request: /metrics/nextcloud")
-    if cache['nextcloud']['error']:
-        return jsonify({"error": cache['nextcloud']['error']}), 500
+    snapshot = cache['nextcloud']
+    if snapshot.error:
+        return jsonify({"error": snapshot.error}), 500
     
-    if cache['nextcloud']['data'] is None:
+    if snapshot.data is None:
         return jsonify({"error": "Data not yet available"}), 503
     
-    return jsonify({
-        "data": cache['nextcloud']['data'],
-        "last_update": cache['nextcloud']['last_update'].isoformat() if cache['nextcloud']['last_update'] else None
-    })
+    return response_cache.response('nextcloud')
 
 @app.route('/metrics/nextcloud/history')
 def nextcloud_history():
-    if cache['nextcloud_history']['error']:
-        return jsonify({"error": cache['nextcloud_history']['error']}), 500
+    # 期間や最大点数が指定された場合は集計階層から直接返す
+    if 'days' in request.args or 'max_points' in request.args:
+        return history_query('nextcloud')
     
-    if cache['nextcloud_history']['data'] is None:
+    error = cache['nextcloud_history'].error
+    if error:
+        return jsonify({"error": error}), 500
+    
+    if not resource_history.history_window('nextcloud').loaded:
         return jsonify({"error": "History data not yet available"}), 503
     
-    return jsonify({
-        "data": cache['nextcloud_history']['data'],
-        "last_update": cache['nextcloud_history']['last_update'].isoformat() if cache['nextcloud_history']['last_update'] else None
-    })
+    return history_response('nextcloud')
+
+def history_query(source):
+    try:
+        days = request.args.get('days', default=7, type=float)
+        max_points = request.args.get('max_points', default=None, type=int)
+        history = resource_history.get_resource_history(source, days=days, max_points=max_points)
+        return jsonify({
+            "data": [{'timestamp': ts, 'data': d} for ts, d in history],
+            "last_update": datetime.now().isoformat()
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
 @app.route('/metrics/proxmox')
 def proxmox_metrics():
     print(f"[{datetime.now()}] API Request: /metrics/proxmox")
-    if cache['proxmox']['error']:
-        return jsonify({"error": cache['proxmox']['error']}), 500
+    snapshot = cache['proxmox']
+    if snapshot.error:
+        return jsonify({"error": snapshot.error}), 500
     
-    if cache['proxmox']['data'] is None:
+    if snapshot.data is None:
         return jsonify({"error": "Data not yet available"}), 503
     
-    return jsonify({
-        "data": cache['proxmox']['data'],
-        "last_update": cache['proxmox']['last_update'].isoformat() if cache['proxmox']['last_update'] else None
-    })
+    return response_cache.response('proxmox')
 
 @app.route('/metrics/proxmox/history')
 def proxmox_history():
-    if cache['proxmox_history']['error']:
-        return jsonify({"error": cache['proxmox_history']['error']}), 500
+    # 期間や最大点数が指定された場合は集計階層から直接返す
+    if 'days' in request.args or 'max_points' in request.args:
+        return history_query('proxmox')
+    
+    error = cache['proxmox_history'].error
+    if error:
+        return jsonify({"error": error}), 500
     
-    if cache['proxmox_history']['data'] is None:
+    if not resource_history.history_window('proxmox').loaded:
         return jsonify({"error": "History data not yet available"}), 503
     
+    return history_response('proxmox')
+
+# 単一系列（例: /metrics/proxmox/history/qemu/100/cpu?days=1&max_points=200&aggregate=max）
+@app.route('/metrics/proxmox/history/<path:entity>/<metric>')
+def proxmox_series(entity, metric):
+    days = request.args.get('days', default=7, type=float)
+    max_points = request.args.get('max_points', default=None, type=int)
+    aggregate = request.args.get('aggregate', default='avg')
+    try:
+        series = resource_history.get_series('proxmox', entity, metric, days=days, max_points=max_points, aggregate=aggregate)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
     return jsonify({
-        "data": cache['proxmox_history']['data'],
-        "last_update": cache['proxmox_history']['last_update'].isoformat() if cache['proxmox_history']['last_update'] else None
+        "data": [{'timestamp': ts, 'value': value} for ts, value in series],
+        "last_update": datetime.now().isoformat()
     })
 
 # 詳細なProxmoxデータ取得エンドポイント
+# ?fields=nodes.cpu,storage&node=pve1&type=qemu&status=running で射影・絞り込み
 @app.route('/metrics/proxmox/detailed')
 def proxmox_detailed():
-    if cache['proxmox_detailed']['error']:
-        return jsonify({"error": cache['proxmox_detailed']['error']}), 500
+    snapshot = cache['proxmox_detailed']
+    if snapshot.error:
+        return jsonify({"error": snapshot.error}), 500
     
-    if cache['proxmox_detailed']['data'] is None:
+    if snapshot.data is None:
         return jsonify({"error": "Data not yet available"}), 503
     
-    return jsonify({
-        "data": cache['proxmox_detailed']['data'],
-        "last_update": cache['proxmox_detailed']['last_update'].isoformat() if cache['proxmox_detailed']['last_update'] else None
+    args = request.args
+    if not any(name in args for name in ('fields', 'node', 'type', 'status')):
+        return response_cache.response('proxmox_detailed')
+    
+    # データと同じスナップショットに含まれる索引を使う（last_update と内容の世代が一致する）
+    index = snapshot.indexes['detailed']
+    try:
+        data = index.query(args.get('fields'), args.get('node'), args.get('type'), args.get('status'))
+    except QueryError as e:
+        return jsonify({"error": str(e)}), 400
+    return response_cache.render({
+        "data": data,
+        "last_update": snapshot.last_update.isoformat() if snapshot.last_update else None
     })
 
+# VMID で1台のVM/コンテナを取得
+@app.route('/metrics/proxmox/vm/<int:vmid>')
+def proxmox_vm(vmid):
+    snapshot = cache['proxmox_detailed']
+    if snapshot.data is None:
+        return jsonify({"error": snapshot.error or "Data not yet available"}), 503
+    
+    guest = snapshot.indexes['inventory'].guest(vmid)
+    if guest is None:
+        return jsonify({"error": f"VM {vmid} not found"}), 404
+    return jsonify({"data": guest, "last_update": snapshot.last_update.isoformat() if snapshot.last_update else None})
+
+# ノード上のVM/コンテナ一覧（?type=qemu|lxc&status=running で絞り込み）
+@app.route('/metrics/proxmox/node/<node_name>/guests')
+def proxmox_node_guests(node_name):
+    snapshot = cache['proxmox_detailed']
+    if snapshot.data is None:
+        return jsonify({"error": snapshot.error or "Data not yet available"}), 503
+    
+    inventory = snapshot.indexes['inventory']
+    if not inventory.has_node(node_name):
+        return jsonify({"error": f"Node {node_name} not found"}), 404
+    try:
+        guests = inventory.node_guests(node_name, request.args.get('type'), request.args.get('status'))
+    except QueryError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"data": guests, "last_update": snapshot.last_update.isoformat() if snapshot.last_update else None})
+
+@app.route('/metrics/node_exporter')
+def node_exporter_metrics():
+    snapshot = cache['node_exporter']
+    if snapshot.error:
+        return jsonify({"error": snapshot.error}), 500
+    
+    if snapshot.data is None:
+        return jsonify({"error": "Data not yet available"}), 503
+    
+    return response_cache.response('node_exporter')
+
+# ノードのsyslogはオンデマンドで取得
+@app.route('/metrics/proxmox/node/<node_name>/syslog')
+def proxmox_node_syslog(node_name):
+    fetched = proxmox_api.fetch_proxmox_cluster_any(
+        config['proxmox'], cluster_keys=[], node_keys=['syslog'], node_names=[node_name]
+    )
+    if 'error' in fetched:
+        return jsonify({"error": fetched['error']}), 500
+    syslog = fetched['node_details'].get(node_name, {}).get('syslog', {})
+    if 'error' in syslog:
+        return jsonify({"error": syslog['error']}), 500
+    with proxmox_raw_lock:
+        proxmox_scheduler.merge(proxmox_raw_cache, fetched)
+    return jsonify({"data": syslog.get('data'), "last_update": datetime.now().isoformat()})
+
+# 手動更新ジョブの応答（?wait=秒 で完了まで待つ、最大 MAX_REFRESH_WAIT 秒）
+def refresh_wait():
+    try:
+        return min(max(float(request.args.get('wait', 0)), 0), MAX_REFRESH_WAIT)
+    except ValueError:
+        return 0
+
+def job_response(jobs, include_result=False):
+    deadline = time.monotonic() + refresh_wait()
+    for job in jobs:
+        refresh_jobs.wait(job, deadline - time.monotonic())
+    body = {"jobs": [job.to_dict(include_result) for job in jobs], "timestamp": datetime.now().isoformat()}
+    if any(job.status == 'failed' for job in jobs):
+        return jsonify(body), 500
+    if all(job.status == 'done' for job in jobs):
+        return jsonify(body)
+    return jsonify(body), 202
+
 # デバッグ用エンドポイント
 @app.route('/debug/proxmox/raw')
 def proxmox_raw():
-    data = proxmox_api.fetch_proxmox_cluster_any(config['proxmox'])
-    return jsonify(data)
+    return job_response([refresh_jobs.submit('proxmox_raw')], include_result=True)
 
-# 手動更新エンドポイント
+# 手動更新エンドポイント（ジョブを開始してすぐに返す）
 @app.route('/refresh/all')
 def refresh_all():
-    try:
-        update_nextcloud_data()
-        update_proxmox_data()
-        return jsonify({"message": "All data refreshed successfully", "timestamp": datetime.now().isoformat()})
-    except Exception as e:
-        return jsonify({"error": f"Refresh failed: {str(e)}"}), 500
+    return job_response([refresh_jobs.submit('nextcloud'), refresh_jobs.submit('proxmox')])
 
 @app.route('/refresh/nextcloud')
 def refresh_nextcloud():
-    try:
-        update_nextcloud_data()
-        return jsonify({"message": "Nextcloud data refreshed successfully", "timestamp": datetime.now().isoformat()})
-    except Exception as e:
-        return jsonify({"error": f"Refresh failed: {str(e)}"}), 500
+    return job_response([refresh_jobs.submit('nextcloud')])
 
 @app.route('/refresh/proxmox')
 def refresh_proxmox():
-    try:
-        update_proxmox_data()
-        return jsonify({"message": "Proxmox data refreshed successfully", "timestamp": datetime.now().isoformat()})
-    except Exception as e:
-        return jsonify({"error": f"Refresh failed: {str(e)}"}), 500
+    return job_response([refresh_jobs.submit('proxmox')])
+
+@app.route('/refresh/jobs/<job_id>')
+def refresh_job_status(job_id):
+    job = refresh_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return job_response([job], include_result=job.source == 'proxmox_raw')
+
+def history_status(source):
+    # 最終更新は履歴ウィンドウへの最後の追記（コミット済みのサイクル）から取る
+    window = resource_history.history_window(source)
+    return {
+        "last_update": window.last_update.isoformat() if window.last_update else None,
+        "has_data": window.loaded,
+        "entries": len(window),
+        "error": cache[f'{source}_history'].error
+    }
 
 # ステータス確認エンドポイント
 @app.route('/status')
 def status():
     return jsonify({
-        "nextcloud": {
-            "last_update": cache['nextcloud']['last_update'].isoformat() if cache['nextcloud']['last_update'] else None,
-            "has_data": cache['nextcloud']['data'] is not None,
-            "error": cache['nextcloud']['error']
-        },
-        "nextcloud_history": {
-            "last_update": cache['nextcloud_history']['last_update'].isoformat() if cache['nextcloud_history']['last_update'] else None,
-            "has_data": cache['nextcloud_history']['data'] is not None,
-            "error": cache['nextcloud_history']['error']
-        },
-        "proxmox": {
-            "last_update": cache['proxmox']['last_update'].isoformat() if cache['proxmox']['last_update'] else None,
-            "has_data": cache['proxmox']['data'] is not None,
-            "error": cache['proxmox']['error']
-        },
-        "proxmox_detailed": {
-            "last_update": cache['proxmox_detailed']['last_update'].isoformat() if cache['proxmox_detailed']['last_update'] else None,
-            "has_data": cache['proxmox_detailed']['data'] is not None,
-            "error": cache['proxmox_detailed']['error']
-        },
-        "proxmox_history": {
-            "last_update": cache['proxmox_history']['last_update'].isoformat() if cache['proxmox_history']['last_update'] else None,
-            "has_data": cache['proxmox_history']['data'] is not None,
-            "error": cache['proxmox_history']['error']
-        },
+        "nextcloud": cache['nextcloud'].status(),
+        "nextcloud_history": history_status('nextcloud'),
+        "proxmox": cache['proxmox'].status(),
+        "proxmox_detailed": cache['proxmox_detailed'].status(),
+        "proxmox_history": history_status('proxmox'),
+        "node_exporter": cache['node_exporter'].status(),
+        "proxmox_failover": proxmox_api.failover_status(config['proxmox']),
+        "storage": resource_history.retention.report() if resource_history.retention else None,
+        "inventory": cache['proxmox_detailed'].indexes['inventory'].counts() if cache['proxmox_detailed'].indexes else None,
+        "collectors": collector_scheduler.status(),
+        "refresh_jobs": refresh_jobs.status(),
         "update_interval": UPDATE_INTERVAL
     })
 
-# データ更新関数
+# データ更新関数（今回の更新のエラーを返す。成功時は None）
 def update_nextcloud_data():
     try:
         print(f"[{datetime.now()}] Updating Nextcloud data...")
         data = nextcloud_api.fetch_nextcloud_serverinfo(config['nextcloud'])
-        cache['nextcloud']['data'] = data
-        cache['nextcloud']['last_update'] = datetime.now()
-        cache['nextcloud']['error'] = None
+        publish('nextcloud', data)
         
         # データベースに保存
         resource_history.insert_resource('nextcloud', data)
         
-        # 履歴データもキャッシュ
-        update_nextcloud_history_cache()
-        
         print(f"[{datetime.now()}] Nextcloud data updated successfully")
     except Exception as e:
         print(f"[{datetime.now()}] Error updating Nextcloud data: {str(e)}")
-        cache['nextcloud']['error'] = str(e)
+        cache.fail('nextcloud', str(e))
+        return str(e)
 
 def update_nextcloud_history_cache():
     try:
-        history = resource_history.get_resource_history('nextcloud')
-        formatted_history = [
-            {'timestamp': ts, 'data': d} for ts, d in history
-        ]
-        cache['nextcloud_history']['data'] = formatted_history
-        cache['nextcloud_history']['last_update'] = datetime.now()
-        cache['nextcloud_history']['error'] = None
+        # 起動時の一括ロード（以降は insert_resource がウィンドウに追記）
+        resource_history.load_window('nextcloud')
+        cache.publish('nextcloud_history', None)
     except Exception as e:
         print(f"[{datetime.now()}] Error updating Nextcloud history cache: {str(e)}")
-        cache['nextcloud_history']['error'] = str(e)
+        cache.fail('nextcloud_history', str(e))
 
-def update_proxmox_data():
+def update_proxmox_data(force=False):
     try:
         print(f"[{datetime.now()}] Updating Proxmox data...")
-        raw_data = proxmox_api.fetch_proxmox_cluster_any(config['proxmox'])
-        
-        if 'error' in raw_data:
-            cache['proxmox']['error'] = raw_data['error']
-            cache['proxmox_detailed']['error'] = raw_data['error']
+        # 更新時期を迎えたエンドポイントだけを取得し、前回までの結果にマージ（手動更新は全階層）
+        cluster_keys, node_keys = proxmox_scheduler.due(force)
+        if not cluster_keys and not node_keys:
+            # 今回は更新時期のエンドポイントがない（公開も履歴の保存もしない）
             return
+        with proxmox_raw_lock:
+            known_nodes = list(proxmox_raw_cache['node_details']) or None
+        fetched = proxmox_api.fetch_proxmox_cluster_any(
+            config['proxmox'], cluster_keys=cluster_keys, node_keys=node_keys,
+            node_names=None if 'nodes' in cluster_keys else known_nodes
+        )
+        
+        if 'error' in fetched:
+            cache.fail('proxmox', fetched['error'])
+            cache.fail('proxmox_detailed', fetched['error'])
+            return fetched['error']
+
+        with proxmox_raw_lock:
+            merged = proxmox_scheduler.merge(proxmox_raw_cache, fetched)
+            # ロックの外で組み立てるため、後のマージで変更されるノード詳細までコピー
+            raw_data = dict(merged)
+            raw_data['node_details'] = {name: dict(detail) for name, detail in merged['node_details'].items()}
 
         # フィルタ済みデータ
         filtered_data = {
@@ -289,10 +446,13 @@ def update_proxmox_data():
             'storage': []
         }
         
-        # ノード情報
+        # ノード情報（ノード名 -> 詳細データのノード）
+        detailed_nodes = {}
         if 'nodes' in raw_data and 'data' in raw_data['nodes']:
             for node in raw_data['nodes']['data']:
-                detailed_data['nodes'].append(node)
+                detailed_node = dict(node)
+                detailed_data['nodes'].append(detailed_node)
+                detailed_nodes[detailed_node.get('node')] = detailed_node
         
         # リソース情報から VM/コンテナ/ストレージを分類
         if 'cluster_resources' in raw_data and 'data' in raw_data['cluster_resources']:
@@ -307,60 +467,91 @@ def update_proxmox_data():
         # ノード詳細情報を追加
         if 'node_details' in raw_data:
             for node_name, node_detail in raw_data['node_details'].items():
-                for node in detailed_data['nodes']:
-                    if node.get('node') == node_name:
-                        node['details'] = node_detail
-                        break
+                node = detailed_nodes.get(node_name)
+                if node is not None:
+                    node['details'] = node_detail
 
         # キャッシュを更新
-        cache['proxmox']['data'] = filtered_data
-        cache['proxmox']['last_update'] = datetime.now()
-        cache['proxmox']['error'] = None
-        
-        cache['proxmox_detailed']['data'] = detailed_data
-        cache['proxmox_detailed']['last_update'] = datetime.now()
-        cache['proxmox_detailed']['error'] = None
+        # 索引は前回のスナップショットの索引から、変化したゲストの分だけ組み直す
+        previous = cache['proxmox_detailed'].indexes
+        inventory = Inventory(
+            detailed_nodes, detailed_data['vms'] + detailed_data['containers'],
+            previous['inventory'] if previous else None
+        )
+        publish('proxmox', filtered_data)
+        publish('proxmox_detailed', detailed_data, {'detailed': DetailedIndex(detailed_data), 'inventory': inventory})
         
-        # データベースに保存
-        resource_history.insert_resource('proxmox', filtered_data)
-        
-        # 履歴データもキャッシュ
-        update_proxmox_history_cache()
+        # データベースに保存（5秒毎の階層ではなく、ノード一覧の階層（10秒）を取得した回だけ RAW_INTERVAL 毎に書く）
+        if HISTORY_TIER in cluster_keys:
+            resource_history.insert_resource('proxmox', filtered_data)
         
         print(f"[{datetime.now()}] Proxmox data updated successfully")
         
     except Exception as e:
         print(f"[{datetime.now()}] Error updating Proxmox data: {str(e)}")
-        cache['proxmox']['error'] = str(e)
-        cache['proxmox_detailed']['error'] = str(e)
+        cache.fail('proxmox', str(e))
+        cache.fail('proxmox_detailed', str(e))
+        return str(e)
 
 def update_proxmox_history_cache():
     try:
-        history = resource_history.get_resource_history('proxmox')
-        formatted_history = [
-            {'timestamp': ts, 'data': d} for ts, d in history
-        ]
-        cache['proxmox_history']['data'] = formatted_history
-        cache['proxmox_history']['last_update'] = datetime.now()
-        cache['proxmox_history']['error'] = None
+        # 起動時の一括ロード（以降は insert_resource がウィンドウに追記）
+        resource_history.load_window('proxmox')
+        cache.publish('proxmox_history', None)
     except Exception as e:
         print(f"[{datetime.now()}] Error updating Proxmox history cache: {str(e)}")
-        cache['proxmox_history']['error'] = str(e)
-
-# バックグラウンドでデータを更新するタスク
-def background_updater():
-    while True:
-        try:
-            update_nextcloud_data()
-            update_proxmox_data()
-        except Exception as e:
-            print(f"[{datetime.now()}] Background update error: {str(e)}")
-        
-        time.sleep(UPDATE_INTERVAL)
+        cache.fail('proxmox_history', str(e))
+
+def update_node_exporter_data():
+    try:
+        print(f"[{datetime.now()}] Updating node_exporter data...")
+        data = node_exporter.scrape_targets(config.get('node_exporter') or {})
+        publish('node_exporter', data)
+        print(f"[{datetime.now()}] node_exporter data updated successfully ({len(data)} targets)")
+    except Exception as e:
+        print(f"[{datetime.now()}] Error updating node_exporter data: {str(e)}")
+        cache.fail('node_exporter', str(e))
+        return str(e)
+
+UPDATERS = {
+    'nextcloud': update_nextcloud_data,
+    'proxmox': update_proxmox_data,
+    'node_exporter': update_node_exporter_data,
+}
+
+# 手動更新では更新時期を待たずに全階層を取得する
+MANUAL_UPDATERS = dict(UPDATERS, proxmox=lambda: update_proxmox_data(force=True))
+
+def refresh_source(source, updaters=UPDATERS):
+    """ソースを更新（同じソースの更新が実行中なら新たに取得せず、その完了を待って結果のエラーを返す）"""
+    return refresh_flight.run(source, updaters[source])
+
+def run_refresh_job(source):
+    if source == 'proxmox_raw':
+        return refresh_flight.run(source, lambda: proxmox_api.fetch_proxmox_cluster_any(config['proxmox']))
+    # 前回までのキャッシュのエラーではなく、今回の更新のエラーだけをジョブの失敗として返す
+    error = refresh_source(source, MANUAL_UPDATERS)
+    if error:
+        raise RuntimeError(error)
+
+# 手動更新はバックグラウンドのジョブで実行（同じソースの要求はまとめ、最短間隔内は直前の結果を返す）
+refresh_jobs = RefreshJobs(run_refresh_job, (config.get('refresh') or {}).get('min_interval'))
+
+# ソース毎に独立した固定レートで収集（遅いソースが他のソースを待たせない）
+collector_scheduler = CollectorScheduler()
+
+def start_collectors():
+    intervals = dict(DEFAULT_COLLECTOR_INTERVALS)
+    intervals.update(config.get('intervals') or {})
+    # Proxmoxの各階層が収集の揺らぎで1回分遅れないよう、半周期分の余裕を持たせる
+    proxmox_scheduler.slack = intervals['proxmox'] / 2
+    for source in UPDATERS:
+        collector_scheduler.add(source, lambda source=source: refresh_source(source), intervals[source])
+    collector_scheduler.start()
+    return intervals
 
 if __name__ == '__main__':
     print('--- Starting Monitoring API ---')
-    print(f'Update interval: {UPDATE_INTERVAL} seconds (High-frequency mode)')
     print('--- Debug Links ---')
     print('Status:         http://localhost:5000/status')
     print('Status:         http://127.0.0.1:5000/status')
@@ -368,12 +559,19 @@ if __name__ == '__main__':
     print('Nextcloud History: http://localhost:5000/metrics/nextcloud/history')
     print('Proxmox:        http://localhost:5000/metrics/proxmox')
     print('Proxmox Detailed: http://localhost:5000/metrics/proxmox/detailed')
+    print('Proxmox Detailed (filtered): http://localhost:5000/metrics/proxmox/detailed?fields=nodes.cpu,storage&node=<node>&status=running')
     print('Proxmox History: http://localhost:5000/metrics/proxmox/history')
+    print('Proxmox Series: http://localhost:5000/metrics/proxmox/history/<entity>/<metric>?days=1&max_points=200')
+    print('Proxmox Syslog: http://localhost:5000/metrics/proxmox/node/<node>/syslog')
+    print('Proxmox Guests: http://localhost:5000/metrics/proxmox/node/<node>/guests')
+    print('Proxmox VM:     http://localhost:5000/metrics/proxmox/vm/<vmid>')
+    print('Node Exporter:  http://localhost:5000/metrics/node_exporter')
     print('Proxmox Raw (Debug): http://localhost:5000/debug/proxmox/raw')
     print('--- Manual Refresh ---')
     print('Refresh All:    http://localhost:5000/refresh/all')
     print('Refresh Nextcloud: http://localhost:5000/refresh/nextcloud')
     print('Refresh Proxmox: http://localhost:5000/refresh/proxmox')
+    print('Refresh Job:    http://localhost:5000/refresh/jobs/<job_id>?wait=30')
     print('--- Network Info ---')
     print('Flask server running on: 0.0.0.0:5000 (all interfaces)')
     print('Node.js should connect to: localhost:5000')
@@ -383,16 +581,22 @@ if __name__ == '__main__':
     print('Initial data fetch...')
     update_nextcloud_data()
     update_proxmox_data()
+    update_node_exporter_data()
     
     # 初回履歴データロード
     print('Loading initial history data...')
     update_nextcloud_history_cache()
     update_proxmox_history_cache()
     
-    # バックグラウンドスレッド開始
-    updater_thread = threading.Thread(target=background_updater, daemon=True)
-    updater_thread.start()
-    print(f'Background updater started (every {UPDATE_INTERVAL}s)')
+    # 保持期間を過ぎた履歴の定期削除
+    resource_history.start_retention(config.get('retention'))
+    
+    # 収集スレッドが別々になっても履歴の書き込みは UPDATE_INTERVAL 毎に1トランザクションでコミット
+    resource_history.start_batching(UPDATE_INTERVAL)
+    
+    # ソース毎の収集スレッド開始
+    intervals = start_collectors()
+    print(f'Collectors started: {", ".join(f"{name} every {interval}s" for name, interval in intervals.items())}')
     print('All APIs now respond instantly from cache!')
     
     app.run(host='0.0.0.0', port=5000)
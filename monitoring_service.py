@@ -9,13 +9,26 @@ import json
 import time
 from typing import Dict, List, Any, Optional
 from datetime import datetime, timedelta
-import sqlite3
 import os
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass
 from contextlib import asynccontextmanager
+from storage.sqlite_store import SQLiteStore
+from storage.retention import RetentionManager, build_rules
+from storage.rollup import RollupTables, choose_tier
+from update_events import UpdateNotifier
+from records import record_to_dict
+import cluster_aggregates
+from cluster_identity import IDENTITY_REFRESH_INTERVAL, cluster_identity, failover_order, group_by_cluster
+
+def compute_aggregates(nodes: List['NodeInfo'], vms: List['VMInfo']) -> Dict[str, Any]:
+    return cluster_aggregates.compute(
+        ((n.name, n.status, n.cpu_usage, n.memory_usage, n.memory_total) for n in nodes),
+        ((v.vmid, v.name, v.status, v.cpu_usage, v.memory_usage) for v in vms)
+    )
 
 # データクラス定義
-@dataclass
+# 1サイクルで数千件作られるため __slots__ 付きの不変レコードにする（インスタンス毎の __dict__ が不要）
+@dataclass(frozen=True, slots=True)
 class NodeInfo:
     name: str
     status: str
@@ -25,8 +38,10 @@ class NodeInfo:
     uptime: int
     temperature: Optional[float] = None
     power: Optional[float] = None
+    # 収集元のクラスター識別子（cluster_identity）- 複数クラスターでノード名・VMIDが重複しても区別する
+    cluster: str = ''
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class VMInfo:
     vmid: int
     name: str
@@ -36,8 +51,9 @@ class VMInfo:
     cpu_usage: Optional[float] = None
     memory_usage: Optional[int] = None
     memory_max: Optional[int] = None
+    cluster: str = ''
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class StorageInfo:
     node: str
     storage: str
@@ -45,8 +61,9 @@ class StorageInfo:
     total: int
     used: int
     available: int
+    cluster: str = ''
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class ClusterStats:
     nodes: List[NodeInfo]
     vms: List[VMInfo]
@@ -54,170 +71,205 @@ class ClusterStats:
     total_cpu_cores: int
     total_memory: int
     cluster_status: str
+    # cluster_aggregates.compute の結果（収集時に1回だけ計算し、保存・API・WebSocketで共有）
+    aggregates: Optional[Dict[str, Any]] = None
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """API・WebSocket 用の辞書に変換"""
+        return {
+            'nodes': [record_to_dict(node) for node in self.nodes],
+            'vms': [record_to_dict(vm) for vm in self.vms],
+            'storages': [record_to_dict(storage) for storage in self.storages],
+            'total_cpu_cores': self.total_cpu_cores,
+            'total_memory': self.total_memory,
+            'cluster_status': self.cluster_status,
+            'aggregates': self.aggregates
+        }
+
+# ホスト毎の同時リクエスト数の既定値（config.yaml の max_concurrency で上書き）
+DEFAULT_MAX_CONCURRENCY = 8
+
+# 収集方式（config.yaml のホスト毎に collection_mode で上書き）
+# cluster_resources: /cluster/resources 1回で全ノード・VM・ストレージを取得
+# per_node: ノード毎に status/qemu/lxc/storage を取得
+DEFAULT_COLLECTION_MODE = 'cluster_resources'
+# cluster_resources 方式でノード詳細（/nodes/{node}/status）を再取得する間隔（秒）
+DEFAULT_DETAIL_INTERVAL = 60
+
+# 接続設定
+REQUEST_TIMEOUT = 10
+CONNECT_TIMEOUT = 3
+KEEPALIVE_TIMEOUT = 30
+DNS_CACHE_TTL = 300
+# 認証チケットの有効期間（Proxmoxは2時間）と、期限前に再取得する余裕
+TICKET_LIFETIME = 2 * 60 * 60
+TICKET_REFRESH_MARGIN = 10 * 60
 
 class ProxmoxAPI:
     def __init__(self, config: Dict[str, Any]):
         self.hosts = config['proxmox']
+        # ホスト毎のセッション（コネクタ）・認証チケット・再認証の排他
         self.sessions = {}
         self.tickets = {}
+        self.auth_locks = {}
+        self.ssl_contexts = {}
+        # ホスト毎の同時リクエスト数の上限
+        self.semaphores = {}
+        # (ホスト, ノード) -> (取得時刻, /nodes/{node}/status の結果)
+        self.node_details = {}
+        # ホスト -> (判定時刻, クラスター識別子)、クラスター識別子 -> 前回収集に成功したホスト設定
+        self.cluster_ids = {}
+        self.active_hosts = {}
         
-    async def authenticate(self, host_config: Dict[str, Any]) -> Optional[str]:
-        """Proxmoxサーバーに認証"""
+    def _ssl_context(self, verify: bool) -> ssl.SSLContext:
+        """SSLコンテキストは検証有無毎に1度だけ作成（CA証明書の読み込みが重いため）"""
+        context = self.ssl_contexts.get(verify)
+        if context is None:
+            context = ssl.create_default_context()
+            if not verify:
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+            self.ssl_contexts[verify] = context
+        return context
+    
+    def _session(self, host_config: Dict[str, Any]) -> aiohttp.ClientSession:
+        """ホスト毎に1つのセッション（コネクションプール）を作成し、以降は使い回す"""
+        host = host_config['host']
+        session = self.sessions.get(host)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                ssl=self._ssl_context(host_config.get('verify_ssl', True)),
+                # 同時リクエスト数 + 認証用の1本
+                limit=host_config.get('max_concurrency', DEFAULT_MAX_CONCURRENCY) + 1,
+                keepalive_timeout=KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=DNS_CACHE_TTL,
+                enable_cleanup_closed=True
+            )
+            session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT)
+            )
+            self.sessions[host] = session
+        return session
+    
+    def _auth_lock(self, host: str) -> asyncio.Lock:
+        lock = self.auth_locks.get(host)
+        if lock is None:
+            lock = self.auth_locks[host] = asyncio.Lock()
+        return lock
+    
+    async def authenticate(self, host_config: Dict[str, Any], stale_ticket: Optional[str] = None) -> Optional[str]:
+        """Proxmoxサーバーに認証（有効なチケットがあれば再利用し、期限前または401時のみ再取得）"""
         host = host_config['host']
         
-        ssl_context = ssl.create_default_context()
-        if not host_config.get('verify_ssl', True):
-            ssl_context.check_hostname = False
-            ssl_context.verify_mode = ssl.CERT_NONE
-            
-        connector = aiohttp.TCPConnector(ssl=ssl_context)
-        
-        try:
-            if host not in self.sessions:
-                self.sessions[host] = aiohttp.ClientSession(connector=connector)
-            
-            session = self.sessions[host]
-            auth_url = f"https://{host}:8006/api2/json/access/ticket"
+        async with self._auth_lock(host):
+            current = self.tickets.get(host)
+            # 同時に401を受けた他のリクエストが既に再認証済みならそのチケットを使う
+            if current and current['expires'] > time.time() and current['ticket'] != stale_ticket:
+                return current['ticket']
             
-            auth_data = {
-                'username': host_config['username'],
-                'password': host_config['password']
-            }
-            
-            async with session.post(auth_url, data=auth_data) as response:
-                if response.status == 200:
-                    result = await response.json()
-                    ticket = result['data']['ticket']
-                    csrf_token = result['data']['CSRFPreventionToken']
-                    
-                    self.tickets[host] = {
-                        'ticket': ticket,
-                        'csrf': csrf_token,
-                        'timestamp': time.time()
-                    }
-                    
-                    # ヘッダーを設定
-                    session.headers.update({
-                        'Cookie': f'PVEAuthCookie={ticket}',
-                        'CSRFPreventionToken': csrf_token
-                    })
-                    
-                    return ticket
+            try:
+                session = self._session(host_config)
+                auth_url = f"https://{host}:8006/api2/json/access/ticket"
+                
+                auth_data = {
+                    'username': host_config['username'],
+                    'password': host_config['password']
+                }
+                
+                async with session.post(auth_url, data=auth_data) as response:
+                    if response.status == 200:
+                        result = await response.json()
+                        ticket = result['data']['ticket']
+                        csrf_token = result['data']['CSRFPreventionToken']
+                        
+                        self.tickets[host] = {
+                            'ticket': ticket,
+                            'csrf': csrf_token,
+                            'timestamp': time.time(),
+                            'expires': time.time() + TICKET_LIFETIME - TICKET_REFRESH_MARGIN
+                        }
+                        return ticket
                     
-        except Exception as e:
-            print(f"認証エラー {host}: {e}")
+            except Exception as e:
+                print(f"認証エラー {host}: {e}")
             return None
-            
+    
+    def _auth_headers(self, host: str) -> Dict[str, str]:
+        """リクエスト毎に付ける認証ヘッダー（共有セッションのヘッダーは変更しない）"""
+        ticket = self.tickets.get(host)
+        if not ticket:
+            return {}
+        return {
+            'Cookie': f"PVEAuthCookie={ticket['ticket']}",
+            'CSRFPreventionToken': ticket['csrf']
+        }
+    
+    def _semaphore(self, host: str) -> asyncio.Semaphore:
+        semaphore = self.semaphores.get(host)
+        if semaphore is None:
+            host_config = next((h for h in self.hosts if h['host'] == host), {})
+            semaphore = asyncio.Semaphore(host_config.get('max_concurrency', DEFAULT_MAX_CONCURRENCY))
+            self.semaphores[host] = semaphore
+        return semaphore
+    
+    async def _get(self, session: aiohttp.ClientSession, host: str, url: str):
+        """(ステータス, data) を返す。レスポンスは返す前に解放する"""
+        async with self._semaphore(host):
+            async with session.get(url, headers=self._auth_headers(host)) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    return response.status, result.get('data', [])
+                return response.status, None
+    
     async def api_request(self, host: str, endpoint: str) -> Optional[Dict]:
         """API リクエストを実行"""
         try:
             session = self.sessions.get(host)
-            if not session:
+            if not session or session.closed:
                 return None
                 
             url = f"https://{host}:8006/api2/json{endpoint}"
+            used_ticket = (self.tickets.get(host) or {}).get('ticket')
             
-            async with session.get(url) as response:
-                if response.status == 200:
-                    result = await response.json()
-                    return result.get('data', [])
-                elif response.status == 401:
-                    # 再認証が必要
-                    host_config = next(h for h in self.hosts if h['host'] == host)
-                    await self.authenticate(host_config)
-                    # リトライ
-                    async with session.get(url) as retry_response:
-                        if retry_response.status == 200:
-                            result = await retry_response.json()
-                            return result.get('data', [])
+            status, data = await self._get(session, host, url)
+            if status == 401:
+                # チケットが失効していたら再認証してリトライ
+                host_config = next(h for h in self.hosts if h['host'] == host)
+                await self.authenticate(host_config, stale_ticket=used_ticket)
+                status, data = await self._get(session, host, url)
+            return data
                             
         except Exception as e:
             print(f"API リクエストエラー {host}{endpoint}: {e}")
             return None
             
     async def get_cluster_status(self) -> ClusterStats:
-        """クラスター全体の状態を取得"""
+        """クラスター全体の状態を取得（全ホスト・全ノードを並行して収集）"""
         all_nodes = []
         all_vms = []
         all_storages = []
         total_cpu_cores = 0
         total_memory = 0
         
-        for host_config in self.hosts:
-            host = host_config['host']
-            
-            # 認証
-            await self.authenticate(host_config)
-            
-            # ノード情報取得
-            nodes_data = await self.api_request(host, '/nodes')
-            if nodes_data:
-                for node in nodes_data:
-                    node_name = node['node']
-                    
-                    # 詳細ノード情報取得
-                    node_status = await self.api_request(host, f'/nodes/{node_name}/status')
-                    if node_status:
-                        node_info = NodeInfo(
-                            name=node_name,
-                            status=node['status'],
-                            cpu_usage=node_status.get('cpu', 0),
-                            memory_usage=node_status.get('memory', {}).get('used', 0),
-                            memory_total=node_status.get('memory', {}).get('total', 0),
-                            uptime=node_status.get('uptime', 0),
-                            temperature=node_status.get('temperature'),
-                            power=node_status.get('power')
-                        )
-                        all_nodes.append(node_info)
-                        
-                        total_cpu_cores += node_status.get('cpuinfo', {}).get('cpus', 0)
-                        total_memory += node_status.get('memory', {}).get('total', 0)
-                    
-                    # VM/コンテナ情報取得
-                    vms_data = await self.api_request(host, f'/nodes/{node_name}/qemu')
-                    if vms_data:
-                        for vm in vms_data:
-                            vm_info = VMInfo(
-                                vmid=vm['vmid'],
-                                name=vm['name'],
-                                status=vm['status'],
-                                node=node_name,
-                                type='vm',
-                                cpu_usage=vm.get('cpu'),
-                                memory_usage=vm.get('mem'),
-                                memory_max=vm.get('maxmem')
-                            )
-                            all_vms.append(vm_info)
-                    
-                    # コンテナ情報取得
-                    containers_data = await self.api_request(host, f'/nodes/{node_name}/lxc')
-                    if containers_data:
-                        for container in containers_data:
-                            container_info = VMInfo(
-                                vmid=container['vmid'],
-                                name=container['name'],
-                                status=container['status'],
-                                node=node_name,
-                                type='container',
-                                cpu_usage=container.get('cpu'),
-                                memory_usage=container.get('mem'),
-                                memory_max=container.get('maxmem')
-                            )
-                            all_vms.append(container_info)
-                    
-                    # ストレージ情報取得
-                    storage_data = await self.api_request(host, f'/nodes/{node_name}/storage')
-                    if storage_data:
-                        for storage in storage_data:
-                            storage_info = StorageInfo(
-                                node=node_name,
-                                storage=storage['storage'],
-                                type=storage.get('type', 'unknown'),
-                                total=storage.get('total', 0),
-                                used=storage.get('used', 0),
-                                available=storage.get('avail', 0)
-                            )
-                            all_storages.append(storage_info)
+        # 同じクラスターに属するホストは1台からだけ収集し、残りは予備とする
+        await self._detect_clusters()
+        groups = group_by_cluster(
+            self.hosts, lambda h: self.cluster_ids.get(h['host'], (0, None))[1], lambda h: h['host']
+        )
+        host_results = await asyncio.gather(*(
+            self._collect_cluster(identity, members) for identity, members in groups.items()
+        ))
+        
+        # gather は入力順に結果を返すため、並び順は逐次取得時と同じ
+        for node_results in host_results:
+            for node_info, cpu_cores, memory_total, vms, storages in node_results:
+                if node_info:
+                    all_nodes.append(node_info)
+                    total_cpu_cores += cpu_cores
+                    total_memory += memory_total
+                all_vms.extend(vms)
+                all_storages.extend(storages)
         
         cluster_status = "online" if all_nodes else "offline"
         
@@ -227,94 +279,339 @@ class ProxmoxAPI:
             storages=all_storages,
             total_cpu_cores=total_cpu_cores,
             total_memory=total_memory,
-            cluster_status=cluster_status
+            cluster_status=cluster_status,
+            aggregates=compute_aggregates(all_nodes, all_vms)
         )
     
+    async def _detect_clusters(self):
+        """未判定または判定から時間が経ったホストの所属クラスターを /cluster/status で判定"""
+        now = time.time()
+        pending = [
+            h for h in self.hosts
+            if self.cluster_ids.get(h['host'], (0, None))[1] is None
+            or now - self.cluster_ids[h['host']][0] >= IDENTITY_REFRESH_INTERVAL
+        ]
+        if not pending:
+            return
+        
+        async def detect(host_config):
+            await self.authenticate(host_config)
+            return cluster_identity(await self.api_request(host_config['host'], '/cluster/status'), host_config['host'])
+        
+        identities = await asyncio.gather(*(detect(h) for h in pending))
+        for host_config, identity in zip(pending, identities):
+            previous = self.cluster_ids.get(host_config['host'], (0, None))[1]
+            if identity is None and previous is not None:
+                # 一時的な取得失敗では前回の識別結果を保持し、単独グループとして二重に数えない
+                # （判定時刻は更新しないので次のサイクルで再確認）
+                continue
+            self.cluster_ids[host_config['host']] = (now, identity)
+    
+    async def _collect_cluster(self, identity: str, members: List[Dict[str, Any]]) -> List[tuple]:
+        """クラスターを正常なメンバー1台から収集（失敗したら次のメンバーへフェイルオーバー）"""
+        for host_config in failover_order(members, self.active_hosts.get(identity)):
+            node_results = await self._collect_host(host_config, identity)
+            if node_results:
+                if self.active_hosts.get(identity) is not host_config:
+                    print(f"クラスター {identity} の収集ホスト: {host_config['host']}")
+                self.active_hosts[identity] = host_config
+                return node_results
+        return []
+    
+    async def _collect_host(self, host_config: Dict[str, Any], cluster: str = '') -> List[tuple]:
+        """1ホスト分: 認証後、設定された方式で全ノードを収集（cluster はレコードに付けるクラスター識別子）"""
+        host = host_config['host']
+        
+        # 認証
+        await self.authenticate(host_config)
+        
+        if host_config.get('collection_mode', DEFAULT_COLLECTION_MODE) == 'cluster_resources':
+            return await self._collect_cluster_resources(host_config, cluster)
+        
+        # ノード情報取得
+        nodes_data = await self.api_request(host, '/nodes')
+        if not nodes_data:
+            return []
+        return await asyncio.gather(*(self._collect_node(host, node, cluster) for node in nodes_data))
+    
+    async def _collect_cluster_resources(self, host_config: Dict[str, Any], cluster: str = '') -> List[tuple]:
+        """/cluster/resources 1回でノード・VM・コンテナ・ストレージを取得し、ノード詳細は定期的にのみ取得"""
+        host = host_config['host']
+        resources = await self.api_request(host, '/cluster/resources')
+        if not resources:
+            return []
+        
+        by_node = {}
+        for resource in resources:
+            if resource.get('type') == 'node':
+                by_node.setdefault(resource.get('node'), {'node': None, 'vms': [], 'storages': []})['node'] = resource
+        for resource in resources:
+            entry = by_node.get(resource.get('node'))
+            if entry is None:
+                continue
+            resource_type = resource.get('type')
+            if resource_type in ('qemu', 'lxc'):
+                entry['vms'].append(VMInfo(
+                    vmid=resource['vmid'],
+                    name=resource.get('name'),
+                    status=resource.get('status'),
+                    node=resource['node'],
+                    type='vm' if resource_type == 'qemu' else 'container',
+                    cpu_usage=resource.get('cpu'),
+                    memory_usage=resource.get('mem'),
+                    memory_max=resource.get('maxmem'),
+                    cluster=cluster
+                ))
+            elif resource_type == 'storage':
+                entry['storages'].append(StorageInfo(
+                    node=resource['node'],
+                    storage=resource['storage'],
+                    type=resource.get('plugintype', 'unknown'),
+                    total=resource.get('maxdisk', 0),
+                    used=resource.get('disk', 0),
+                    available=resource.get('maxdisk', 0) - resource.get('disk', 0),
+                    cluster=cluster
+                ))
+        
+        await self._refresh_node_details(host_config, [
+            name for name, entry in by_node.items() if entry['node'].get('status') == 'online'
+        ])
+        
+        results = []
+        for node_name, entry in by_node.items():
+            node = entry['node']
+            node_info = None
+            if node.get('status') == 'online':
+                details = self.node_details.get((host, node_name), (0, {}))[1]
+                node_info = NodeInfo(
+                    name=node_name,
+                    status=node['status'],
+                    cpu_usage=node.get('cpu', 0),
+                    memory_usage=node.get('mem', 0),
+                    memory_total=node.get('maxmem', 0),
+                    uptime=node.get('uptime', 0),
+                    temperature=details.get('temperature'),
+                    power=details.get('power'),
+                    cluster=cluster
+                )
+            results.append((
+                node_info,
+                node.get('maxcpu', 0) if node_info else 0,
+                node.get('maxmem', 0) if node_info else 0,
+                entry['vms'],
+                entry['storages']
+            ))
+        return results
+    
+    async def _refresh_node_details(self, host_config: Dict[str, Any], node_names: List[str]):
+        """detail_interval を過ぎたノードの /nodes/{node}/status だけを並行して再取得"""
+        host = host_config['host']
+        interval = host_config.get('detail_interval', DEFAULT_DETAIL_INTERVAL)
+        now = time.time()
+        stale = [
+            name for name in node_names
+            if now - self.node_details.get((host, name), (0, None))[0] >= interval
+        ]
+        if not stale:
+            return
+        statuses = await asyncio.gather(*(self.api_request(host, f'/nodes/{name}/status') for name in stale))
+        for name, status in zip(stale, statuses):
+            if status:
+                self.node_details[(host, name)] = (now, status)
+    
+    async def _collect_node(self, host: str, node: Dict[str, Any], cluster: str = '') -> tuple:
+        """1ノード分: ステータス・VM・コンテナ・ストレージの4リクエストを同時に発行"""
+        node_name = node['node']
+        node_status, vms_data, containers_data, storage_data = await asyncio.gather(
+            self.api_request(host, f'/nodes/{node_name}/status'),
+            self.api_request(host, f'/nodes/{node_name}/qemu'),
+            self.api_request(host, f'/nodes/{node_name}/lxc'),
+            self.api_request(host, f'/nodes/{node_name}/storage')
+        )
+        
+        # 詳細ノード情報
+        node_info = None
+        cpu_cores = 0
+        memory_total = 0
+        if node_status:
+            node_info = NodeInfo(
+                name=node_name,
+                status=node['status'],
+                cpu_usage=node_status.get('cpu', 0),
+                memory_usage=node_status.get('memory', {}).get('used', 0),
+                memory_total=node_status.get('memory', {}).get('total', 0),
+                uptime=node_status.get('uptime', 0),
+                temperature=node_status.get('temperature'),
+                power=node_status.get('power'),
+                cluster=cluster
+            )
+            cpu_cores = node_status.get('cpuinfo', {}).get('cpus', 0)
+            memory_total = node_status.get('memory', {}).get('total', 0)
+        
+        # VM/コンテナ情報
+        vms = []
+        for vm in vms_data or []:
+            vms.append(VMInfo(
+                vmid=vm['vmid'],
+                name=vm['name'],
+                status=vm['status'],
+                node=node_name,
+                type='vm',
+                cpu_usage=vm.get('cpu'),
+                memory_usage=vm.get('mem'),
+                memory_max=vm.get('maxmem'),
+                cluster=cluster
+            ))
+        for container in containers_data or []:
+            vms.append(VMInfo(
+                vmid=container['vmid'],
+                name=container['name'],
+                status=container['status'],
+                node=node_name,
+                type='container',
+                cpu_usage=container.get('cpu'),
+                memory_usage=container.get('mem'),
+                memory_max=container.get('maxmem'),
+                cluster=cluster
+            ))
+        
+        # ストレージ情報
+        storages = []
+        for storage in storage_data or []:
+            storages.append(StorageInfo(
+                node=node_name,
+                storage=storage['storage'],
+                type=storage.get('type', 'unknown'),
+                total=storage.get('total', 0),
+                used=storage.get('used', 0),
+                available=storage.get('avail', 0),
+                cluster=cluster
+            ))
+        
+        return node_info, cpu_cores, memory_total, vms, storages
+    
     async def close(self):
-        """セッションを閉じる"""
-        for session in self.sessions.values():
-            await session.close()
+        """セッションを閉じる（コネクタと保持中の接続も解放）"""
+        sessions = list(self.sessions.values())
+        self.sessions.clear()
+        self.tickets.clear()
+        for session in sessions:
+            if not session.closed:
+                await session.close()
+        # SSL接続のクローズ処理が完了するまで待つ
+        await asyncio.sleep(0.25)
 
 class DataStorage:
+    # クラスター履歴の集計テーブル（cluster_history_1m / _10m / _1h）
+    cluster_rollups = RollupTables(
+        'cluster_history', keys=(),
+        values=('total_cpu_usage', 'total_memory_usage', 'total_memory_total', 'vm_running_count')
+    )
+    
     def __init__(self, db_path: str = "monitoring.db"):
         self.db_path = db_path
+        self.store = SQLiteStore(db_path)
         self.init_database()
     
     def init_database(self):
         """データベースを初期化"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # 履歴テーブル作成
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS cluster_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                total_cpu_usage REAL,
-                total_memory_usage REAL,
-                total_memory_total INTEGER,
-                node_count INTEGER,
-                vm_running_count INTEGER,
-                vm_total_count INTEGER
-            )
-        """)
-        
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS node_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                node_name TEXT,
-                cpu_usage REAL,
-                memory_usage REAL,
-                memory_total INTEGER,
-                status TEXT
-            )
-        """)
+        with self.store.transaction() as cursor:
+            # 履歴テーブル作成
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS cluster_history (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    total_cpu_usage REAL,
+                    total_memory_usage REAL,
+                    total_memory_total INTEGER,
+                    node_count INTEGER,
+                    vm_running_count INTEGER,
+                    vm_total_count INTEGER
+                )
+            """)
+            
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS node_history (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    node_name TEXT,
+                    cpu_usage REAL,
+                    memory_usage REAL,
+                    memory_total INTEGER,
+                    status TEXT
+                )
+            """)
+            
+            self.cluster_rollups.create(cursor)
         
-        conn.commit()
-        conn.close()
+        self.cluster_rollups.backfill(self.store, 'cluster_history', "strftime('%s', timestamp)")
+    
+    def start_retention(self, cfg: Optional[Dict[str, Any]] = None) -> RetentionManager:
+        """保持期間を過ぎた履歴の定期削除を開始"""
+        cfg = cfg or {}
+        self.retention = RetentionManager(
+            self.store,
+            build_rules(
+                [('cluster_history', 'timestamp', 'datetime'), ('node_history', 'timestamp', 'datetime')],
+                [self.cluster_rollups], cfg.get('ttl_days')
+            ),
+            batch_size=cfg.get('batch_size', 5000)
+        )
+        self.retention.start(cfg.get('interval_minutes', 60))
+        return self.retention
     
     def save_cluster_data(self, stats: ClusterStats):
-        """クラスターデータを保存"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        """クラスターデータを保存（クラスター・ノード履歴を1トランザクションで書き込み）"""
+        # 収集時に計算済みのクラスター統計を使う（CPUは従来どおり0-1の平均で保存）
+        cluster = (stats.aggregates or compute_aggregates(stats.nodes, stats.vms))['cluster']
+        total_cpu = cluster['cpu_avg_pct'] / 100.0
+        total_memory_used = cluster['memory_used']
+        vm_running = cluster['guests_running']
         
-        # クラスター統計計算
-        total_cpu = sum(node.cpu_usage for node in stats.nodes) / len(stats.nodes) if stats.nodes else 0
-        total_memory_used = sum(node.memory_usage for node in stats.nodes)
-        vm_running = len([vm for vm in stats.vms if vm.status == 'running'])
-        
-        cursor.execute("""
-            INSERT INTO cluster_history 
-            (total_cpu_usage, total_memory_usage, total_memory_total, node_count, vm_running_count, vm_total_count)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (total_cpu, total_memory_used, stats.total_memory, len(stats.nodes), vm_running, len(stats.vms)))
-        
-        # ノード履歴保存
-        for node in stats.nodes:
+        with self.store.transaction() as cursor:
             cursor.execute("""
+                INSERT INTO cluster_history 
+                (total_cpu_usage, total_memory_usage, total_memory_total, node_count, vm_running_count, vm_total_count)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (total_cpu, total_memory_used, stats.total_memory, len(stats.nodes), vm_running, len(stats.vms)))
+            
+            self.cluster_rollups.update(
+                cursor, int(time.time()),
+                [((), (total_cpu, total_memory_used, stats.total_memory, vm_running))]
+            )
+            
+            # ノード履歴保存
+            cursor.executemany("""
                 INSERT INTO node_history 
                 (node_name, cpu_usage, memory_usage, memory_total, status)
                 VALUES (?, ?, ?, ?, ?)
-            """, (node.name, node.cpu_usage, node.memory_usage, node.memory_total, node.status))
-        
-        conn.commit()
-        conn.close()
+            """, [(node.name, node.cpu_usage, node.memory_usage, node.memory_total, node.status) for node in stats.nodes])
     
-    def get_cluster_history(self, hours: int = 24) -> List[Dict]:
-        """クラスター履歴を取得"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def get_cluster_history(self, hours: int = 24, max_points: Optional[int] = None) -> List[Dict]:
+        """クラスター履歴を取得（max_points を超える場合は集計テーブルから平均値を返す）"""
+        tier = choose_tier(hours * 3600, max_points)
+        if tier is not None:
+            since = int(time.time()) - int(hours * 3600)
+            with self.store.reader() as cursor:
+                rows = self.cluster_rollups.query(cursor, tier[0], since)
+            return [{
+                'timestamp': datetime.utcfromtimestamp(bucket).strftime('%Y-%m-%d %H:%M:%S'),
+                'cpu': cpu,
+                'memory': memory,
+                'vms': vms
+            } for bucket, cpu, memory, _, vms in rows]
         
-        cursor.execute("""
-            SELECT timestamp, total_cpu_usage, total_memory_usage, vm_running_count
-            FROM cluster_history 
-            WHERE timestamp > datetime('now', '-{} hours')
-            ORDER BY timestamp
-        """.format(hours))
+        with self.store.reader() as cursor:
+            cursor.execute("""
+                SELECT timestamp, total_cpu_usage, total_memory_usage, vm_running_count
+                FROM cluster_history 
+                WHERE timestamp > datetime('now', ?)
+                ORDER BY timestamp
+            """, (f'-{int(hours)} hours',))
+            rows = cursor.fetchall()
         
         results = []
-        for row in cursor.fetchall():
+        for row in rows:
             results.append({
                 'timestamp': row[0],
                 'cpu': row[1],
@@ -322,7 +619,6 @@ class DataStorage:
                 'vms': row[3]
             })
         
-        conn.close()
         return results
 
 class MonitoringService:
@@ -332,7 +628,10 @@ class MonitoringService:
         
         self.proxmox_api = ProxmoxAPI(self.config)
         self.storage = DataStorage()
+        self.storage.start_retention(self.config.get('retention'))
         self.latest_data = None
+        # 収集サイクル完了の通知（配信側はポーリングせずに待機）
+        self.updates = UpdateNotifier()
         self.running = False
     
     async def start_monitoring(self):
@@ -349,6 +648,7 @@ class MonitoringService:
                 
                 # 最新データを更新
                 self.latest_data = stats
+                self.updates.publish()
                 
                 print(f"監視データ更新完了: {datetime.now()}")
                 print(f"ノード数: {len(stats.nodes)}, VM/CT数: {len(stats.vms)}")
@@ -364,9 +664,13 @@ class MonitoringService:
         """最新データを取得"""
         return self.latest_data
     
-    def get_history_data(self, hours: int = 24) -> List[Dict]:
+    def get_history_data(self, hours: int = 24, max_points: Optional[int] = None) -> List[Dict]:
         """履歴データを取得"""
-        return self.storage.get_cluster_history(hours)
+        return self.storage.get_cluster_history(hours, max_points)
+    
+    def get_storage_report(self) -> Dict[str, Any]:
+        """DBサイズ・行数・保持期間処理の状況を取得"""
+        return self.storage.retention.report()
     
     async def stop_monitoring(self):
         """監視を停止"""
@@ -0,0 +1,21 @@
+"""
+レコード変換 - __slots__ 付きの不変レコード（NodeInfo, VMInfo など）を辞書にする共通処理
+"""
+from operator import attrgetter
+from typing import Any, Dict
+
+_record_getters = {}
+
+def record_to_dict(record) -> Dict[str, Any]:
+    """入れ子のないレコードを辞書に変換（asdict の再帰的な deepcopy を使わない高速経路）"""
+    cls = type(record)
+    getter = _record_getters.get(cls)
+    if getter is None:
+        names = cls.__slots__
+        get_values = attrgetter(*names)
+        if len(names) == 1:
+            # 1項目の attrgetter はタプルではなく値そのものを返す
+            get_values = lambda obj, get=get_values: (get(obj),)
+        getter = _record_getters[cls] = (names, get_values)
+    names, get_values = getter
+    return dict(zip(names, get_values(record)))
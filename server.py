@@ -7,19 +7,37 @@ import yaml
 import ssl
 import json
 import time
-import sqlite3
 from datetime import datetime
-from flask import Flask, jsonify, render_template
+from flask import Flask, jsonify, render_template, request
 from flask_socketio import SocketIO, emit
 import threading
 from typing import Dict, List, Optional
+from storage.sqlite_store import SQLiteStore
+from storage.retention import RetentionManager, build_rules
+from storage.rollup import RollupTables, choose_tier
+from update_events import UpdateNotifier
+import cluster_aggregates
+from cluster_identity import IDENTITY_REFRESH_INTERVAL, cluster_identity, failover_order, group_by_cluster
+
+# 収集方式 - cluster_resources: /cluster/resources 1回で取得 / per_node: ノード毎に4リクエスト
+DEFAULT_COLLECTION_MODE = 'cluster_resources'
+# cluster_resources 方式でノード詳細（loadavg等）を再取得する間隔（秒）
+DEFAULT_DETAIL_INTERVAL = 60
 
 class ProxmoxClient:
-    def __init__(self, host: str, username: str, password: str, verify_ssl: bool = False):
+    def __init__(self, host: str, username: str, password: str, verify_ssl: bool = False,
+                 collection_mode: str = DEFAULT_COLLECTION_MODE, detail_interval: float = DEFAULT_DETAIL_INTERVAL):
         self.host = host
         self.username = username
         self.password = password
         self.verify_ssl = verify_ssl
+        self.collection_mode = collection_mode
+        self.detail_interval = detail_interval
+        # ノード名 -> (取得時刻, /nodes/{node}/status の結果)
+        self.node_details = {}
+        # 所属クラスターの識別子と判定時刻
+        self.cluster_id = None
+        self.cluster_checked_at = 0
         self.session = None
         self.ticket = None
         self.csrf_token = None
@@ -66,8 +84,22 @@ class ProxmoxClient:
             print(f"API エラー {path}: {e}")
         return None
     
+    async def detect_cluster(self):
+        """/cluster/status から所属クラスターを判定"""
+        identity = cluster_identity(await self.api_get('/cluster/status'), self.host)
+        if identity is None and self.cluster_id is not None:
+            # 一時的な取得失敗では前回の識別結果を保持し、単独グループとして二重に数えない
+            # （判定時刻は更新しないので次のサイクルで再確認）
+            return self.cluster_id
+        self.cluster_id = identity
+        self.cluster_checked_at = time.time()
+        return self.cluster_id
+    
     async def get_cluster_data(self):
         """クラスター全体の情報を取得"""
+        if self.collection_mode == 'cluster_resources':
+            return await self.get_cluster_resources_data()
+        
         data = {
             'nodes': [],
             'vms': [],
@@ -144,76 +176,177 @@ class ProxmoxClient:
         
         return data
     
+    async def get_cluster_resources_data(self):
+        """/cluster/resources 1回でノード・VM・ストレージを取得（ノード詳細は detail_interval 毎）"""
+        data = {
+            'nodes': [],
+            'vms': [],
+            'storage': [],
+            'cluster_status': 'online'
+        }
+        
+        resources = await self.api_get('/cluster/resources')
+        if not resources:
+            data['cluster_status'] = 'offline'
+            return data
+        
+        online_nodes = [r['node'] for r in resources if r.get('type') == 'node' and r.get('status') == 'online']
+        await self.refresh_node_details(online_nodes)
+        
+        for resource in resources:
+            resource_type = resource.get('type')
+            if resource_type == 'node' and resource.get('status') == 'online':
+                node_name = resource['node']
+                details = self.node_details.get(node_name, (0, {}))[1]
+                data['nodes'].append({
+                    'name': node_name,
+                    'status': resource['status'],
+                    'cpu': resource.get('cpu', 0) * 100,
+                    'memory_used': resource.get('mem', 0),
+                    'memory_total': resource.get('maxmem', 0),
+                    'uptime': resource.get('uptime', 0),
+                    'load': details.get('loadavg', [0, 0, 0])
+                })
+            elif resource_type in ('qemu', 'lxc'):
+                data['vms'].append({
+                    'id': resource['vmid'],
+                    'name': resource.get('name'),
+                    'status': resource.get('status'),
+                    'node': resource.get('node'),
+                    'type': 'vm' if resource_type == 'qemu' else 'container',
+                    'cpu': resource.get('cpu', 0) * 100 if resource.get('cpu') else 0,
+                    'memory': resource.get('mem', 0)
+                })
+            elif resource_type == 'storage':
+                data['storage'].append({
+                    'node': resource.get('node'),
+                    'name': resource['storage'],
+                    'type': resource.get('plugintype', 'unknown'),
+                    'total': resource.get('maxdisk', 0),
+                    'used': resource.get('disk', 0),
+                    'available': resource.get('maxdisk', 0) - resource.get('disk', 0)
+                })
+        
+        return data
+    
+    async def refresh_node_details(self, node_names: List[str]):
+        """detail_interval を過ぎたノードの /nodes/{node}/status だけを並行して再取得"""
+        now = time.time()
+        stale = [name for name in node_names if now - self.node_details.get(name, (0, None))[0] >= self.detail_interval]
+        if not stale:
+            return
+        statuses = await asyncio.gather(*(self.api_get(f'/nodes/{name}/status') for name in stale))
+        for name, status in zip(stale, statuses):
+            if status:
+                self.node_details[name] = (now, status)
+    
     async def close(self):
         """接続を閉じる"""
         if self.session:
             await self.session.close()
 
+def compute_aggregates(nodes: List[dict], vms: List[dict]) -> dict:
+    """クラスター統計（CPUはパーセント値で保持しているため0-1に戻して渡す）"""
+    return cluster_aggregates.compute(
+        ((n['name'], n['status'], n['cpu'] / 100.0, n['memory_used'], n['memory_total']) for n in nodes),
+        ((v['id'], v['name'], v['status'], v['cpu'] / 100.0, v['memory']) for v in vms)
+    )
+
 class DatabaseManager:
+    # メトリクス履歴の集計テーブル（metrics_history_1m / _10m / _1h）
+    rollups = RollupTables(
+        'metrics_history', keys=(),
+        values=('total_cpu', 'total_memory_used', 'total_memory_total', 'vms_running')
+    )
+    
     def __init__(self, db_path: str = "proxmox_monitoring.db"):
         self.db_path = db_path
+        self.store = SQLiteStore(db_path)
         self.init_db()
     
     def init_db(self):
         """データベース初期化"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS metrics_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                total_cpu REAL,
-                total_memory_used INTEGER,
-                total_memory_total INTEGER,
-                nodes_count INTEGER,
-                vms_running INTEGER,
-                vms_total INTEGER
-            )
-        """)
+        with self.store.transaction() as cursor:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS metrics_history (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    total_cpu REAL,
+                    total_memory_used INTEGER,
+                    total_memory_total INTEGER,
+                    nodes_count INTEGER,
+                    vms_running INTEGER,
+                    vms_total INTEGER
+                )
+            """)
+            
+            self.rollups.create(cursor)
         
-        conn.commit()
-        conn.close()
+        self.rollups.backfill(self.store, 'metrics_history', "strftime('%s', timestamp)")
+    
+    def start_retention(self, cfg: Optional[dict] = None) -> RetentionManager:
+        """保持期間を過ぎた履歴の定期削除を開始"""
+        cfg = cfg or {}
+        self.retention = RetentionManager(
+            self.store,
+            build_rules([('metrics_history', 'timestamp', 'datetime')], [self.rollups], cfg.get('ttl_days')),
+            batch_size=cfg.get('batch_size', 5000)
+        )
+        self.retention.start(cfg.get('interval_minutes', 60))
+        return self.retention
     
     def save_metrics(self, data: dict):
         """メトリクスを保存"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
         # 統計計算
         nodes = data.get('nodes', [])
         vms = data.get('vms', [])
         
-        total_cpu = sum(node['cpu'] for node in nodes) / len(nodes) if nodes else 0
-        total_memory_used = sum(node['memory_used'] for node in nodes)
-        total_memory_total = sum(node['memory_total'] for node in nodes)
-        vms_running = len([vm for vm in vms if vm['status'] == 'running'])
-        
-        cursor.execute("""
-            INSERT INTO metrics_history 
-            (total_cpu, total_memory_used, total_memory_total, nodes_count, vms_running, vms_total)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (total_cpu, total_memory_used, total_memory_total, len(nodes), vms_running, len(vms)))
+        # 収集時に計算済みのクラスター統計を使う
+        cluster = (data.get('aggregates') or compute_aggregates(nodes, vms))['cluster']
+        total_cpu = cluster['cpu_avg_pct']
+        total_memory_used = cluster['memory_used']
+        total_memory_total = cluster['memory_total']
+        vms_running = cluster['guests_running']
         
-        conn.commit()
-        conn.close()
+        with self.store.transaction() as cursor:
+            cursor.execute("""
+                INSERT INTO metrics_history 
+                (total_cpu, total_memory_used, total_memory_total, nodes_count, vms_running, vms_total)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (total_cpu, total_memory_used, total_memory_total, len(nodes), vms_running, len(vms)))
+            
+            self.rollups.update(
+                cursor, int(time.time()),
+                [((), (total_cpu, total_memory_used, total_memory_total, vms_running))]
+            )
     
-    def get_history(self, hours: int = 24):
-        """履歴データ取得"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def get_history(self, hours: int = 24, max_points: Optional[int] = None):
+        """履歴データ取得（max_points を超える場合は集計テーブルから平均値を返す）"""
+        tier = choose_tier(hours * 3600, max_points)
+        if tier is not None:
+            since = int(time.time()) - int(hours * 3600)
+            with self.store.reader() as cursor:
+                rows = self.rollups.query(cursor, tier[0], since)
+            return [{
+                'time': datetime.utcfromtimestamp(bucket).strftime('%Y-%m-%d %H:%M:%S'),
+                'cpu': cpu,
+                'memory': memory_used * 100.0 / memory_total if memory_total else None,
+                'vms': vms
+            } for bucket, cpu, memory_used, memory_total, vms in rows]
         
-        cursor.execute("""
-            SELECT timestamp, total_cpu, 
-                   (total_memory_used * 100.0 / total_memory_total) as memory_percent,
-                   vms_running
-            FROM metrics_history 
-            WHERE timestamp > datetime('now', '-{} hours')
-            ORDER BY timestamp
-        """.format(hours))
+        with self.store.reader() as cursor:
+            cursor.execute("""
+                SELECT timestamp, total_cpu, 
+                       (total_memory_used * 100.0 / total_memory_total) as memory_percent,
+                       vms_running
+                FROM metrics_history 
+                WHERE timestamp > datetime('now', ?)
+                ORDER BY timestamp
+            """, (f'-{int(hours)} hours',))
+            rows = cursor.fetchall()
         
         history = []
-        for row in cursor.fetchall():
+        for row in rows:
             history.append({
                 'time': row[0],
                 'cpu': row[1],
@@ -221,7 +354,6 @@ class DatabaseManager:
                 'vms': row[3]
             })
         
-        conn.close()
         return history
 
 class ProxmoxMonitor:
@@ -235,21 +367,31 @@ class ProxmoxMonitor:
                 host=host_config['host'],
                 username=host_config['username'],
                 password=host_config['password'],
-                verify_ssl=host_config.get('verify_ssl', False)
+                verify_ssl=host_config.get('verify_ssl', False),
+                collection_mode=host_config.get('collection_mode', DEFAULT_COLLECTION_MODE),
+                detail_interval=host_config.get('detail_interval', DEFAULT_DETAIL_INTERVAL)
             )
             self.clients.append(client)
         
         self.db = DatabaseManager()
+        self.db.start_retention(config.get('retention'))
         self.latest_data = {}
+        # クラスター識別子 -> 前回収集に成功したクライアント
+        self.active_clients = {}
+        # 収集サイクル完了の通知（配信側はポーリングせずに待機）
+        self.updates = UpdateNotifier()
         self.running = False
     
     async def start_monitoring(self):
         """監視開始"""
         self.running = True
         
-        # 全クライアント接続
+        # 全クライアント接続（接続できないホストがあっても他のホストで監視を続ける）
         for client in self.clients:
-            await client.connect()
+            try:
+                await client.connect()
+            except Exception as e:
+                print(f"接続エラー {client.host}: {e}")
         
         while self.running:
             try:
@@ -261,14 +403,22 @@ class ProxmoxMonitor:
                     'cluster_status': 'online'
                 }
                 
-                for client in self.clients:
-                    data = await client.get_cluster_data()
+                # 同じクラスターに属するホストは1台からだけ収集し、残りは予備とする
+                await self.detect_clusters()
+                groups = group_by_cluster(self.clients, lambda c: c.cluster_id, lambda c: c.host)
+                results = await asyncio.gather(*(
+                    self.collect_cluster(identity, members) for identity, members in groups.items()
+                ))
+                
+                for data in results:
                     if data:
                         all_data['nodes'].extend(data['nodes'])
                         all_data['vms'].extend(data['vms'])
                         all_data['storage'].extend(data['storage'])
                 
+                all_data['aggregates'] = compute_aggregates(all_data['nodes'], all_data['vms'])
                 self.latest_data = all_data
+                self.updates.publish()
                 self.db.save_metrics(all_data)
                 
                 print(f"[{datetime.now()}] データ更新完了 - ノード:{len(all_data['nodes'])}, VM/CT:{len(all_data['vms'])}")
@@ -279,11 +429,35 @@ class ProxmoxMonitor:
                 print(f"監視エラー: {e}")
                 await asyncio.sleep(5)
     
+    async def detect_clusters(self):
+        """未判定または判定から時間が経ったクライアントの所属クラスターを判定"""
+        now = time.time()
+        pending = [
+            c for c in self.clients
+            if c.cluster_id is None or now - c.cluster_checked_at >= IDENTITY_REFRESH_INTERVAL
+        ]
+        if pending:
+            await asyncio.gather(*(c.detect_cluster() for c in pending))
+    
+    async def collect_cluster(self, identity: str, members: List[ProxmoxClient]):
+        """クラスターを正常なメンバー1台から収集（失敗したら次のメンバーへフェイルオーバー）"""
+        for client in failover_order(members, self.active_clients.get(identity)):
+            data = await client.get_cluster_data()
+            if data and data['cluster_status'] != 'offline':
+                if self.active_clients.get(identity) is not client:
+                    print(f"クラスター {identity} の収集ホスト: {client.host}")
+                self.active_clients[identity] = client
+                return data
+        return None
+    
     def get_latest_data(self):
         return self.latest_data
     
-    def get_history(self):
-        return self.db.get_history()
+    def get_history(self, hours: int = 24, max_points: Optional[int] = None):
+        return self.db.get_history(hours, max_points)
+    
+    def get_storage_report(self):
+        return self.db.retention.report()
     
     async def stop(self):
         self.running = False
@@ -321,13 +495,24 @@ def api_status():
 @app.route('/api/history')
 def api_history():
     """履歴データAPI"""
-    history = monitor.get_history()
+    hours = request.args.get('hours', default=24, type=int)
+    max_points = request.args.get('max_points', default=None, type=int)
+    history = monitor.get_history(hours, max_points)
     return jsonify({
         'success': True,
         'data': history,
         'timestamp': datetime.now().isoformat()
     })
 
+@app.route('/api/storage')
+def api_storage():
+    """ストレージ状況API（DBサイズ・行数・保持期間処理）"""
+    return jsonify({
+        'success': True,
+        'data': monitor.get_storage_report(),
+        'timestamp': datetime.now().isoformat()
+    })
+
 @socketio.on('connect')
 def handle_connect():
     """WebSocket接続"""
@@ -340,14 +525,21 @@ def monitoring_thread():
     asyncio.set_event_loop(loop)
     loop.run_until_complete(monitor.start_monitoring())
 
+# 通知待ちの最大時間（秒）- 待機中も定期的にループを回す
+BROADCAST_WAIT_TIMEOUT = 60
+
 def broadcast_thread():
-    """ブロードキャストスレッド"""
+    """ブロードキャストスレッド（収集完了の通知を受けて配信）"""
+    seen_version = 0
+    last_sent = None
     while True:
         try:
+            seen_version = monitor.updates.wait(seen_version, timeout=BROADCAST_WAIT_TIMEOUT)
             data = monitor.get_latest_data()
-            if data:
+            # 前回と同じ内容は再送しない
+            if data and data != last_sent:
                 socketio.emit('data_update', data)
-            time.sleep(5)
+                last_sent = data
         except Exception as e:
             print(f"ブロードキャストエラー: {e}")
             time.sleep(10)
@@ -0,0 +1,92 @@
+"""
+/metrics/proxmox/detailed のインデックス - スナップショット公開時にノード・ステータス別の索引を作り、
+?fields=&node=&type=&status= の絞り込みと射影を要求された分だけの走査で返す
+"""
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# 一覧名 -> 要素の種類（?type= の値）
+COLLECTION_TYPES = {
+    'nodes': 'node',
+    'vms': 'qemu',
+    'containers': 'lxc',
+    'storage': 'storage',
+}
+TYPE_COLLECTIONS = {kind: name for name, kind in COLLECTION_TYPES.items()}
+
+# 射影しても必ず残す識別用のフィールド
+KEY_FIELDS = {
+    'nodes': ('node',),
+    'vms': ('vmid', 'node'),
+    'containers': ('vmid', 'node'),
+    'storage': ('storage', 'node'),
+}
+
+class QueryError(ValueError):
+    pass
+
+def _group(items: List[dict]) -> Dict[Tuple[Optional[str], Optional[str]], List[dict]]:
+    # (ノード, ステータス) の組毎の一覧（None はその条件なし）
+    groups: Dict[Tuple[Optional[str], Optional[str]], List[dict]] = {(None, None): items}
+    for item in items:
+        node, status = item.get('node'), item.get('status')
+        for key in ((node, None), (None, status), (node, status)):
+            groups.setdefault(key, []).append(item)
+    return groups
+
+def parse_fields(value: Optional[str]) -> Optional[Dict[str, Optional[Tuple[str, ...]]]]:
+    """'nodes.cpu,storage' -> {'nodes': ('cpu',), 'storage': None}（None は全フィールド、指定なしは None）"""
+    fields: Dict[str, Optional[List[str]]] = {}
+    for token in filter(None, (part.strip() for part in (value or '').split(','))):
+        name, _, field = token.partition('.')
+        if name not in COLLECTION_TYPES and (name != 'cluster_info' or field):
+            raise QueryError(f"Unknown field: {token}")
+        if not field or fields.get(name, []) is None:
+            fields[name] = None
+        else:
+            fields.setdefault(name, []).append(field)
+    if not fields:
+        # 'fields=' や 'fields=,' は指定なしと同じ扱い
+        return None
+    return {name: tuple(selected) if selected is not None else None for name, selected in fields.items()}
+
+class DetailedIndex:
+    def __init__(self, data: Dict[str, Any]):
+        self.data = data
+        self._groups = {name: _group(data.get(name) or []) for name in COLLECTION_TYPES}
+        # 一覧毎に現れるフィールド名（?fields= の検証用）
+        self._fields = {
+            name: {key for item in data.get(name) or [] for key in item}
+            for name in COLLECTION_TYPES
+        }
+
+    def select(self, collection: str, node: Optional[str] = None, status: Optional[str] = None) -> List[dict]:
+        return self._groups[collection].get((node, status), [])
+
+    def query(self, fields: Optional[str] = None, node: Optional[str] = None,
+              kind: Optional[str] = None, status: Optional[str] = None) -> Dict[str, Any]:
+        selected = parse_fields(fields)
+        collections: Iterable[str] = COLLECTION_TYPES
+        if kind:
+            if kind not in TYPE_COLLECTIONS:
+                raise QueryError(f"Unknown type: {kind}")
+            collections = [TYPE_COLLECTIONS[kind]]
+        if selected is not None:
+            collections = [name for name in collections if name in selected]
+            for name, projection in selected.items():
+                # 要素のない一覧はフィールド名を判断できないので検証しない
+                unknown = [field for field in projection or () if self._fields.get(name) and field not in self._fields[name]]
+                if unknown:
+                    raise QueryError(f"Unknown field: {name}.{unknown[0]}")
+
+        result: Dict[str, Any] = {}
+        # クラスター情報は種類・ノードで絞り込まない時だけ返す
+        if not kind and not node and (selected is None or 'cluster_info' in selected):
+            result['cluster_info'] = self.data.get('cluster_info', {})
+        for name in collections:
+            items = self.select(name, node, status)
+            projection = selected.get(name) if selected is not None else None
+            if projection is not None:
+                keys = KEY_FIELDS[name] + tuple(field for field in projection if field not in KEY_FIELDS[name])
+                items = [{key: item[key] for key in keys if key in item} for item in items]
+            result[name] = items
+        return result
@@ -0,0 +1,93 @@
+"""
+インベントリ索引 - VM/コンテナを VMID・ノード・種類・ステータス別の辞書と集合で引けるようにする
+スナップショット毎に前回の索引から作り、索引のキー（ノード・種類・ステータス）が変わったゲストの分だけ組み直す
+"""
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from serving.detailed_index import QueryError
+
+# ?type= に指定できるゲストの種類
+GUEST_TYPES = ('qemu', 'lxc')
+
+def _key(guest: dict) -> Tuple[Any, Any, Any]:
+    return guest.get('node'), guest.get('type'), guest.get('status')
+
+class Inventory:
+    """公開後は変更しない（スナップショットと一緒に公開し、次の更新では新しいインスタンスを作る）"""
+
+    def __init__(self, nodes: Iterable[str], guests: Iterable[dict], previous: Optional['Inventory'] = None):
+        self._nodes = frozenset(nodes)
+        # VMID -> ゲスト（参照は毎回新しい辞書に差し替える）
+        self._guests: Dict[Any, dict] = {}
+        # VMID -> (ノード, 種類, ステータス)
+        self._keys: Dict[Any, Tuple[Any, Any, Any]] = {}
+        for guest in guests:
+            vmid = guest.get('vmid')
+            if vmid is not None:
+                self._guests[vmid] = guest
+                self._keys[vmid] = _key(guest)
+
+        # 各索引: 値 -> VMID の集合（挿入順を保つため dict をキーの集合として使う）
+        if previous is None:
+            self._by_node: Dict[Any, Dict[Any, None]] = {}
+            self._by_type: Dict[Any, Dict[Any, None]] = {}
+            self._by_status: Dict[Any, Dict[Any, None]] = {}
+            changed = list(self._keys)
+            old_keys: Dict[Any, Tuple[Any, Any, Any]] = {}
+        else:
+            # 外側の辞書だけコピーし、変化のない値の集合は前回のものを共有する
+            self._by_node = dict(previous._by_node)
+            self._by_type = dict(previous._by_type)
+            self._by_status = dict(previous._by_status)
+            old_keys = previous._keys
+            changed = [vmid for vmid, key in self._keys.items() if old_keys.get(vmid) != key]
+            changed.extend(vmid for vmid in old_keys if vmid not in self._keys)
+        self.changed = len(changed)
+
+        copied: Set[Tuple[int, Any]] = set()
+        indexes = (self._by_node, self._by_type, self._by_status)
+
+        def members(position: int, value: Any) -> Dict[Any, None]:
+            # 前回と共有している集合は最初に変更する時にコピー
+            index = indexes[position]
+            if (position, value) not in copied:
+                copied.add((position, value))
+                index[value] = dict(index.get(value) or {})
+            return index[value]
+
+        for vmid in changed:
+            old, new = old_keys.get(vmid), self._keys.get(vmid)
+            if old is not None:
+                for position, value in enumerate(old):
+                    members(position, value).pop(vmid, None)
+            if new is not None:
+                for position, value in enumerate(new):
+                    members(position, value)[vmid] = None
+
+    def guest(self, vmid: Any) -> Optional[dict]:
+        return self._guests.get(vmid)
+
+    def has_node(self, node: str) -> bool:
+        return node in self._nodes or bool(self._by_node.get(node))
+
+    def node_guests(self, node: str, kind: Optional[str] = None, status: Optional[str] = None) -> List[dict]:
+        """ノード上のゲスト一覧（種類・ステータスで絞り込み可）"""
+        if kind is not None and kind not in GUEST_TYPES:
+            raise QueryError(f"Unknown type: {kind}")
+        vmids = self._by_node.get(node) or {}
+        if kind is not None:
+            of_kind = self._by_type.get(kind) or {}
+            vmids = [vmid for vmid in vmids if vmid in of_kind]
+        if status is not None:
+            of_status = self._by_status.get(status) or {}
+            vmids = [vmid for vmid in vmids if vmid in of_status]
+        return [self._guests[vmid] for vmid in vmids]
+
+    def counts(self) -> Dict[str, Any]:
+        return {
+            'guests': len(self._guests),
+            'changed': self.changed,
+            'nodes': {node: len(vmids) for node, vmids in self._by_node.items() if vmids},
+            'types': {kind: len(vmids) for kind, vmids in self._by_type.items() if vmids},
+            'status': {status: len(vmids) for status, vmids in self._by_status.items() if vmids}
+        }
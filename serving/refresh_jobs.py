@@ -0,0 +1,99 @@
+"""
+非同期の手動更新ジョブ - 同じソースの同時要求を1つのジョブにまとめ、最短間隔内の再要求は直前の結果を返す
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+# ソース毎の最短実行間隔（秒）の既定値
+DEFAULT_MIN_INTERVAL = 15
+# 保持する完了済みジョブの数
+MAX_JOBS = 100
+# ジョブを実行するワーカースレッドの数（ソースは数個なので少数で足りる）
+MAX_WORKERS = 4
+
+class RefreshJob:
+    def __init__(self, source: str):
+        self.id = uuid.uuid4().hex
+        self.source = source
+        self.status = 'running'
+        self.created = datetime.now()
+        self.finished: Optional[datetime] = None
+        self.started_at = time.monotonic()
+        self.error: Optional[str] = None
+        self.result: Any = None
+        self.done = threading.Event()
+
+    def to_dict(self, include_result: bool = False) -> Dict[str, Any]:
+        job = {
+            'id': self.id,
+            'source': self.source,
+            'status': self.status,
+            'created': self.created.isoformat(),
+            'finished': self.finished.isoformat() if self.finished else None,
+            'error': self.error
+        }
+        if include_result:
+            job['result'] = self.result
+        return job
+
+class RefreshJobs:
+    def __init__(self, runner: Callable[[str], Any], min_intervals: Optional[Dict[str, float]] = None,
+                 default_min_interval: float = DEFAULT_MIN_INTERVAL, max_workers: int = MAX_WORKERS):
+        self.runner = runner
+        self.min_intervals = min_intervals or {}
+        self.default_min_interval = default_min_interval
+        self._jobs: 'OrderedDict[str, RefreshJob]' = OrderedDict()
+        # ソース -> 実行中または直近に完了したジョブ
+        self._latest: Dict[str, RefreshJob] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='refresh')
+
+    def submit(self, source: str) -> RefreshJob:
+        """ジョブを開始してすぐに返す（実行中、または直前のジョブの開始から最短間隔内なら既存のジョブを返す）"""
+        with self._lock:
+            latest = self._latest.get(source)
+            if latest is not None:
+                if not latest.done.is_set():
+                    return latest
+                # 失敗したジョブも含めて開始時刻から数える（失敗し続けるソースへの連打も抑える）
+                min_interval = self.min_intervals.get(source, self.default_min_interval)
+                if time.monotonic() - latest.started_at < min_interval:
+                    return latest
+            job = RefreshJob(source)
+            self._latest[source] = job
+            self._jobs[job.id] = job
+            while len(self._jobs) > MAX_JOBS:
+                self._jobs.popitem(last=False)
+        self._executor.submit(self._run, job)
+        return job
+
+    def _run(self, job: RefreshJob):
+        try:
+            job.result = self.runner(job.source)
+            job.status = 'done'
+        except Exception as e:
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished = datetime.now()
+            job.done.set()
+
+    def get(self, job_id: str) -> Optional[RefreshJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        """ソース毎の実行中または直近のジョブ"""
+        with self._lock:
+            return {source: job.to_dict() for source, job in self._latest.items()}
+
+    def wait(self, job: RefreshJob, timeout: Optional[float]) -> RefreshJob:
+        """完了まで最大 timeout 秒待つ"""
+        if timeout and timeout > 0:
+            job.done.wait(timeout)
+        return job
@@ -0,0 +1,117 @@
+"""
+シリアライズ済みレスポンスキャッシュ - 更新時に1度だけJSON化し、リクエストはバイト列を返すだけにする
+"""
+import gzip
+import hashlib
+import json
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# この長さ未満のボディは圧縮しない
+MIN_COMPRESS_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+class CachedBody:
+    """1バージョン分のJSONボディと、必要になった時点で作る圧縮版"""
+    def __init__(self, body: bytes):
+        self.body = body
+        self.etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+        self._encoded = {}
+        self._lock = threading.Lock()
+
+    def encoded(self, encoding: str) -> bytes:
+        with self._lock:
+            data = self._encoded.get(encoding)
+            if data is None:
+                if encoding == 'br':
+                    data = brotli.compress(self.body, quality=BROTLI_QUALITY)
+                else:
+                    data = gzip.compress(self.body, compresslevel=GZIP_LEVEL)
+                self._encoded[encoding] = data
+            return data
+
+def serialize(payload: Any) -> bytes:
+    return json.dumps(payload, separators=(',', ':'), default=str).encode('utf-8')
+
+class ResponseCache:
+    def __init__(self):
+        self._entries: Dict[str, CachedBody] = {}
+        # 遅延シリアライズ用: キー -> (バージョン, ペイロードを作る関数)
+        self._lazy: Dict[str, Tuple[Any, Callable[[], Any]]] = {}
+        self._lazy_versions: Dict[str, Any] = {}
+        # キー毎の組み立て中の排他（同じキーの同時リクエストは1回の組み立てを待って共有）
+        self._build_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def put(self, key: str, payload: Any):
+        """更新時にペイロードをシリアライズして差し替え"""
+        entry = CachedBody(serialize(payload))
+        with self._lock:
+            self._entries[key] = entry
+            self._lazy.pop(key, None)
+
+    def put_lazy(self, key: str, version: Any, builder: Callable[[], Any]):
+        """最初のリクエスト時にシリアライズ（同じバージョンの間は使い回す）"""
+        with self._lock:
+            if self._lazy_versions.get(key) == version and key in self._entries:
+                return
+            pending = self._lazy.get(key)
+            if pending is not None and pending[0] == version:
+                return
+            self._lazy[key] = (version, builder)
+
+    def get(self, key: str) -> Optional[CachedBody]:
+        with self._lock:
+            if key not in self._lazy:
+                return self._entries.get(key)
+            build_lock = self._build_locks.setdefault(key, threading.Lock())
+        # 組み立て中に来たリクエストは、古い版や None を返さずに組み立ての完了を待つ
+        with build_lock:
+            with self._lock:
+                pending = self._lazy.get(key)
+                if pending is None:
+                    return self._entries.get(key)
+            version, builder = pending
+            entry = CachedBody(serialize(builder()))
+            with self._lock:
+                # 組み立て中に put() や新しいバージョンの登録がなければ採用
+                current = self._lazy.get(key)
+                if current is not None and current[0] == version:
+                    del self._lazy[key]
+                    self._entries[key] = entry
+                    self._lazy_versions[key] = version
+        return entry
+
+    def response(self, key: str) -> Optional[Response]:
+        """If-None-Match と Accept-Encoding に応じたレスポンス（未登録なら None）"""
+        entry = self.get(key)
+        if entry is None:
+            return None
+        return self._respond(entry)
+
+    def render(self, payload: Any) -> Response:
+        """キャッシュしないペイロード（絞り込み結果など）を同じ ETag・圧縮の扱いで返す"""
+        return self._respond(CachedBody(serialize(payload)))
+
+    def _respond(self, entry: CachedBody) -> Response:
+        headers = {'ETag': f'"{entry.etag}"', 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+        if request.if_none_match.contains(entry.etag):
+            return Response(status=304, headers=headers)
+
+        body = entry.body
+        if len(body) >= MIN_COMPRESS_SIZE:
+            if brotli is not None and request.accept_encodings.quality('br') > 0:
+                body = entry.encoded('br')
+                headers['Content-Encoding'] = 'br'
+            elif request.accept_encodings.quality('gzip') > 0:
+                body = entry.encoded('gzip')
+                headers['Content-Encoding'] = 'gzip'
+        return Response(body, mimetype='application/json', headers=headers)
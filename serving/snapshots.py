@@ -0,0 +1,78 @@
+"""
+ソース毎の不変スナップショット - 更新は新しいスナップショットへの参照の差し替え1回で行い、読み出し側はロック不要
+"""
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, NamedTuple, Optional
+
+class SourceSnapshot(NamedTuple):
+    data: Any = None
+    last_update: Optional[datetime] = None
+    error: Optional[str] = None
+    # data から作った索引（data と同じスナップショットで公開し、読み出し側は同じ世代の組を見る）
+    indexes: Optional[Dict[str, Any]] = None
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "last_update": self.last_update.isoformat() if self.last_update else None,
+            "has_data": self.data is not None,
+            "error": self.error
+        }
+
+class SnapshotStore:
+    def __init__(self, names: Iterable[str]):
+        self._snapshots = {name: SourceSnapshot() for name in names}
+
+    def __getitem__(self, name: str) -> SourceSnapshot:
+        # 読み出し側は取得したスナップショットだけを見る（途中状態は見えない）
+        return self._snapshots[name]
+
+    def publish(self, name: str, data: Any, indexes: Optional[Dict[str, Any]] = None) -> SourceSnapshot:
+        """新しいデータ（と索引）で差し替え（公開後の data・索引は変更しないこと）"""
+        snapshot = SourceSnapshot(data, datetime.now(), None, indexes)
+        self._snapshots[name] = snapshot
+        return snapshot
+
+    def fail(self, name: str, error: str) -> SourceSnapshot:
+        """前回のデータを保持したままエラーを設定"""
+        snapshot = self._snapshots[name]._replace(error=error)
+        self._snapshots[name] = snapshot
+        return snapshot
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """同じキーの実行中の呼び出しがあれば新たに実行せず、その結果を待って共有する"""
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+
+    def run(self, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if leader:
+            try:
+                call.result = fn()
+            except Exception as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        else:
+            call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def in_flight(self, key: str) -> bool:
+        with self._lock:
+            return key in self._calls
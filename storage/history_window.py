@@ -0,0 +1,58 @@
+"""
+履歴ウィンドウ - 直近の履歴をメモリ上のリングバッファで保持（追記はO(1)、期間外は先頭から破棄）
+"""
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Any, Iterable, List, Optional, Tuple
+
+class HistoryWindow:
+    def __init__(self, window_seconds: float):
+        self.window_seconds = window_seconds
+        # (エポック秒, ISO時刻, データ) を古い順に保持
+        self._entries = deque()
+        self._lock = threading.Lock()
+        self.loaded = False
+        self.last_update: Optional[datetime] = None
+        # 内容が変わる度に増える（レスポンスキャッシュの世代判定用）
+        self.version = 0
+        # newest_first() の結果を次の追記まで使い回す
+        self._snapshot: Optional[List[dict]] = None
+
+    def _evict(self, now: float):
+        cutoff = now - self.window_seconds
+        while self._entries and self._entries[0][0] < cutoff:
+            self._entries.popleft()
+
+    def load(self, entries: Iterable[Tuple[float, str, Any]]):
+        """起動時にDBから古い順のエントリを一括ロード"""
+        with self._lock:
+            self._entries = deque(sorted(entries, key=lambda entry: entry[0]))
+            if self._entries:
+                self._evict(self._entries[-1][0])
+            self._snapshot = None
+            self.version += 1
+            self.loaded = True
+            self.last_update = datetime.now()
+
+    def append(self, ts: float, timestamp: str, data: Any):
+        """1サイクル分を追記し、期間外の古いエントリを破棄"""
+        with self._lock:
+            self._entries.append((ts, timestamp, data))
+            self._evict(ts)
+            self._snapshot = None
+            self.version += 1
+            self.last_update = datetime.now()
+
+    def newest_first(self) -> List[dict]:
+        """/metrics/*/history 形式（新しい順）のリストを返す"""
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = [
+                    {'timestamp': timestamp, 'data': data}
+                    for _, timestamp, data in reversed(self._entries)
+                ]
+            return self._snapshot
+
+    def __len__(self):
+        return len(self._entries)
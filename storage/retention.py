@@ -0,0 +1,159 @@
+"""
+保持期間ポリシー - 古いデータを小さなバッチで削除し、空きページを段階的に回収
+"""
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from storage.rollup import TIERS
+
+# 階層毎のデフォルト保持日数（config.yaml の retention.ttl_days で上書き可能）
+DEFAULT_TTL_DAYS = {'raw': 7, '1m': 30, '10m': 180, '1h': 730}
+DEFAULT_INTERVAL_MINUTES = 60
+# 1トランザクションで削除する最大行数（ライターを長時間占有しない）
+DEFAULT_BATCH_SIZE = 5000
+# 1回の実行で回収する最大ページ数
+DEFAULT_VACUUM_PAGES = 2000
+# バッチ間でライターを他スレッドに譲る時間（秒）
+BATCH_PAUSE = 0.05
+
+@dataclass
+class RetentionRule:
+    table: str
+    column: str
+    ttl_days: float
+    # 'epoch'（整数秒）または 'datetime'（SQLiteの CURRENT_TIMESTAMP 形式）
+    kind: str = 'epoch'
+
+    def cutoff(self, now: float):
+        cutoff = now - self.ttl_days * 86400
+        if self.kind == 'datetime':
+            return datetime.fromtimestamp(cutoff, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        return int(cutoff)
+
+def build_rules(raw_tables: List[tuple], rollups: List[Any], ttl_days: Optional[Dict] = None) -> List[RetentionRule]:
+    """生データテーブル [(テーブル, 時刻列, 種別)] と集計テーブルから削除ルールを作る"""
+    ttl = dict(DEFAULT_TTL_DAYS)
+    ttl.update({str(k): v for k, v in (ttl_days or {}).items()})
+    rules = [RetentionRule(table, column, ttl['raw'], kind) for table, column, kind in raw_tables]
+    for rollup in rollups:
+        for tier, _ in TIERS:
+            rules.append(RetentionRule(rollup.table(tier), 'bucket', ttl[tier]))
+    return rules
+
+class RetentionManager:
+    def __init__(self, store, rules: List[RetentionRule], batch_size: int = DEFAULT_BATCH_SIZE,
+                 vacuum_pages: int = DEFAULT_VACUUM_PAGES):
+        self.store = store
+        self.rules = rules
+        self.batch_size = batch_size
+        self.vacuum_pages = vacuum_pages
+        self.last_run = None
+        self.last_deleted = {}
+        self.last_report = None
+        self._thread = None
+        self._incremental_vacuum_ready = False
+
+    def ensure_indexes(self):
+        """削除条件の列に索引を作る（なければバッチ毎の削除が全件走査になる）"""
+        with self.store.transaction() as cursor:
+            for rule in self.rules:
+                cursor.execute(
+                    f"CREATE INDEX IF NOT EXISTS idx_{rule.table}_{rule.column} ON {rule.table} ({rule.column})"
+                )
+
+    def enable_incremental_vacuum(self):
+        """auto_vacuum=INCREMENTAL に切り替え（既存DBは一度だけVACUUMが必要）
+        VACUUMはDB全体を作り直しその間ライターを止めるため、収集開始前の start() からだけ呼ぶ"""
+        with self.store.maintenance() as cursor:
+            mode = cursor.execute('PRAGMA auto_vacuum').fetchone()[0]
+            if mode != 2:
+                print(f"[{datetime.now()}] Enabling incremental vacuum on {self.store.db_path}...")
+                cursor.execute('PRAGMA auto_vacuum=INCREMENTAL')
+                cursor.execute('VACUUM')
+        self._incremental_vacuum_ready = True
+
+    def _delete_expired(self, rule: RetentionRule, now: float) -> int:
+        cutoff = rule.cutoff(now)
+        deleted = 0
+        while True:
+            with self.store.transaction() as cursor:
+                cursor.execute(f"""
+                    DELETE FROM {rule.table} WHERE rowid IN (
+                        SELECT rowid FROM {rule.table} WHERE {rule.column} < ? LIMIT ?
+                    )
+                """, (cutoff, self.batch_size))
+                count = cursor.rowcount
+            deleted += count
+            if count < self.batch_size:
+                return deleted
+            time.sleep(BATCH_PAUSE)
+
+    def run_once(self) -> Dict[str, Any]:
+        """期限切れデータの削除・空きページ回収・統計更新を実行"""
+        now = time.time()
+        deleted = {}
+        for rule in self.rules:
+            try:
+                deleted[rule.table] = self._delete_expired(rule, now)
+            except Exception as e:
+                print(f"[{datetime.now()}] Retention error on {rule.table}: {str(e)}")
+        with self.store.maintenance() as cursor:
+            if self._incremental_vacuum_ready:
+                # execute() は1ページ分しか進まないため executescript で最後まで実行
+                cursor.executescript(f'PRAGMA incremental_vacuum({int(self.vacuum_pages)});')
+            cursor.execute('PRAGMA wal_checkpoint(PASSIVE)')
+        self.last_run = datetime.now()
+        self.last_deleted = deleted
+        self.last_report = self.collect_stats()
+        return self.last_report
+
+    def collect_stats(self) -> Dict[str, Any]:
+        """DBサイズとテーブル毎の行数を集計"""
+        with self.store.reader() as cursor:
+            page_size = cursor.execute('PRAGMA page_size').fetchone()[0]
+            page_count = cursor.execute('PRAGMA page_count').fetchone()[0]
+            free_pages = cursor.execute('PRAGMA freelist_count').fetchone()[0]
+            tables = [row[0] for row in cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+            ).fetchall()]
+            row_counts = {table: cursor.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] for table in tables}
+        wal_path = self.store.db_path + '-wal'
+        return {
+            'path': self.store.db_path,
+            'size_bytes': page_size * page_count,
+            'wal_bytes': os.path.getsize(wal_path) if os.path.exists(wal_path) else 0,
+            'free_bytes': page_size * free_pages,
+            'row_counts': row_counts
+        }
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            'last_run': self.last_run.isoformat() if self.last_run else None,
+            'last_deleted': self.last_deleted,
+            'stats': self.last_report
+        }
+
+    def start(self, interval_minutes: float = DEFAULT_INTERVAL_MINUTES):
+        """起動時の準備（索引・auto_vacuum の切り替え）を済ませてからバックグラウンドで定期実行
+        収集を始める前に呼ぶこと"""
+        if self._thread is not None:
+            return
+        try:
+            self.ensure_indexes()
+            self.enable_incremental_vacuum()
+        except Exception as e:
+            print(f"[{datetime.now()}] Retention setup failed for {self.store.db_path}: {str(e)}")
+        self._thread = threading.Thread(target=self._loop, args=(interval_minutes * 60,), daemon=True)
+        self._thread.start()
+
+    def _loop(self, interval: float):
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"[{datetime.now()}] Retention run failed for {self.store.db_path}: {str(e)}")
+            time.sleep(interval)
@@ -0,0 +1,144 @@
+"""
+ロールアップ（ダウンサンプリング）集計 - 1分/10分/1時間単位の min/max/avg/last を書き込み時に更新
+"""
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+# (階層名, バケット幅（秒）) 細かい順
+TIERS = (('1m', 60), ('10m', 600), ('1h', 3600))
+
+# 生データのサンプリング間隔（秒）
+RAW_INTERVAL = 10
+
+# 集計の種類
+AGGREGATES = ('avg', 'min', 'max', 'last')
+
+def choose_tier(span_seconds: float, max_points: Optional[int], raw_interval: float = RAW_INTERVAL) -> Optional[Tuple[str, int]]:
+    """期間と最大点数から使う階層を選ぶ（None は生データ）"""
+    if not max_points or span_seconds / raw_interval <= max_points:
+        return None
+    for tier, width in TIERS:
+        if span_seconds / width <= max_points:
+            return tier, width
+    return TIERS[-1]
+
+class RollupTables:
+    def __init__(self, base: str, keys: Sequence[str], values: Sequence[str]):
+        self.base = base
+        self.keys = tuple(keys)
+        self.values = tuple(values)
+        self._upsert_sql = {tier: self._build_upsert(tier) for tier, _ in TIERS}
+
+    def table(self, tier: str) -> str:
+        return f"{self.base}_{tier}"
+
+    def create(self, cursor):
+        """階層毎の集計テーブルを作成"""
+        for tier, _ in TIERS:
+            columns = [f"{key} TEXT NOT NULL" for key in self.keys]
+            columns.append("bucket INTEGER NOT NULL")
+            for value in self.values:
+                columns.extend([f"{value}_min REAL", f"{value}_max REAL", f"{value}_sum REAL", f"{value}_last REAL"])
+            columns.extend(["n INTEGER NOT NULL", "last_ts INTEGER NOT NULL"])
+            primary_key = ', '.join(self.keys + ('bucket',))
+            cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.table(tier)} (
+                    {', '.join(columns)},
+                    PRIMARY KEY ({primary_key})
+                )
+            """)
+            if self.keys:
+                cursor.execute(
+                    f"CREATE INDEX IF NOT EXISTS idx_{self.table(tier)}_bucket ON {self.table(tier)} (bucket)"
+                )
+
+    def _build_upsert(self, tier: str) -> str:
+        columns = list(self.keys) + ['bucket']
+        updates = []
+        for value in self.values:
+            columns.extend([f"{value}_min", f"{value}_max", f"{value}_sum", f"{value}_last"])
+            updates.extend([
+                f"{value}_min = min(coalesce({value}_min, excluded.{value}_min), coalesce(excluded.{value}_min, {value}_min))",
+                f"{value}_max = max(coalesce({value}_max, excluded.{value}_max), coalesce(excluded.{value}_max, {value}_max))",
+                f"{value}_sum = coalesce({value}_sum, 0) + coalesce(excluded.{value}_sum, 0)",
+                f"{value}_last = CASE WHEN excluded.last_ts >= last_ts THEN excluded.{value}_last ELSE {value}_last END",
+            ])
+        columns.extend(['n', 'last_ts'])
+        updates.extend(['n = n + 1', 'last_ts = max(last_ts, excluded.last_ts)'])
+        placeholders = ', '.join('?' for _ in columns)
+        conflict = ', '.join(self.keys + ('bucket',))
+        return (
+            f"INSERT INTO {self.table(tier)} ({', '.join(columns)}) VALUES ({placeholders}) "
+            f"ON CONFLICT({conflict}) DO UPDATE SET {', '.join(updates)}"
+        )
+
+    def update(self, cursor, ts: int, rows: Iterable[Tuple[tuple, tuple]]):
+        """生データ (キー, 値) を各階層に反映（生データの書き込みと同じトランザクションで呼ぶ）"""
+        rows = list(rows)
+        if not rows:
+            return
+        for tier, width in TIERS:
+            bucket = ts - ts % width
+            params = []
+            for keys, values in rows:
+                row = list(keys) + [bucket]
+                for value in values:
+                    row.extend([value, value, value, value])
+                row.extend([1, ts])
+                params.append(row)
+            cursor.executemany(self._upsert_sql[tier], params)
+
+    def query(self, cursor, tier: str, since: int, where: Optional[dict] = None,
+              aggregate: str = 'avg', descending: bool = False) -> List[tuple]:
+        """(キー..., バケット時刻, 値...) を返す"""
+        if aggregate not in AGGREGATES:
+            raise ValueError(f"unknown aggregate: {aggregate}")
+        selected = []
+        for value in self.values:
+            if aggregate == 'avg':
+                selected.append(f"{value}_sum / n")
+            else:
+                selected.append(f"{value}_{aggregate}")
+        conditions = ['bucket >= ?']
+        params = [since - since % dict(TIERS)[tier]]
+        for key, expected in (where or {}).items():
+            conditions.append(f"{key} = ?")
+            params.append(expected)
+        cursor.execute(f"""
+            SELECT {', '.join(self.keys + ('bucket',) + tuple(selected))}
+            FROM {self.table(tier)}
+            WHERE {' AND '.join(conditions)}
+            ORDER BY bucket {'DESC' if descending else 'ASC'}
+        """, params)
+        return cursor.fetchall()
+
+    def backfill(self, store, raw_table: str, ts_expr: str, key_exprs: Sequence[str] = (),
+                 value_exprs: Optional[Sequence[str]] = None, where: str = '1', batch: int = 50000):
+        """集計テーブルが空で生データがある場合（集計導入前のDB）に生データから作り直す"""
+        value_exprs = tuple(value_exprs or self.values)
+        with store.reader() as cursor:
+            cursor.execute(f"SELECT 1 FROM {self.table(TIERS[-1][0])} LIMIT 1")
+            if cursor.fetchone() is not None:
+                return
+            cursor.execute(f"SELECT 1 FROM {raw_table} LIMIT 1")
+            if cursor.fetchone() is None:
+                return
+
+        columns = ', '.join((f"CAST({ts_expr} AS INTEGER)",) + tuple(key_exprs) + value_exprs)
+        key_count = len(key_exprs)
+        last_rowid = 0
+        while True:
+            # バッチ毎にコミットし、ライターを長時間占有しない
+            with store.transaction() as cursor:
+                cursor.execute(
+                    f"SELECT rowid, {columns} FROM {raw_table} WHERE rowid > ? AND ({where}) ORDER BY rowid LIMIT ?",
+                    (last_rowid, batch)
+                )
+                rows = cursor.fetchall()
+                by_ts = {}
+                for row in rows:
+                    last_rowid = row[0]
+                    by_ts.setdefault(row[1], []).append((row[2:2 + key_count], row[2 + key_count:]))
+                for ts, grouped in by_ts.items():
+                    self.update(cursor, ts, grouped)
+            if not rows:
+                break
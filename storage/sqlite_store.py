@@ -0,0 +1,171 @@
+"""
+SQLite共有ストレージ層 - 常駐ライター接続（WAL）+ リーダー接続プール + グループコミット
+"""
+import atexit
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# リーダー接続の上限（Flaskのリクエストスレッド数程度）
+DEFAULT_MAX_READERS = 4
+BUSY_TIMEOUT_MS = 5000
+
+class SQLiteStore:
+    def __init__(self, db_path: str, max_readers: int = DEFAULT_MAX_READERS):
+        self.db_path = db_path
+        self.max_readers = max_readers
+
+        # 書き込みは常駐する1本の接続で直列化（トランザクションは明示的に管理）
+        self._writer = self._connect()
+        self._writer.execute('PRAGMA journal_mode=WAL')
+        # WALではNORMALでもクラッシュ耐性は保たれ、コミット毎のfsyncが不要になる
+        self._writer.execute('PRAGMA synchronous=NORMAL')
+        self._write_lock = threading.RLock()
+        self._depth = 0
+        # 最も外側のトランザクションがコミットされた後に呼ぶコールバック
+        self._after_commit = []
+
+        self._readers = queue.LifoQueue()
+        self._reader_count = 0
+        self._reader_lock = threading.Lock()
+
+        # start_batching() 後は全スレッドの書き込みをここに溜め、一定間隔でまとめてコミット
+        self._batch = None
+        self._batch_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """書き込みトランザクション（入れ子の場合は外側にまとめる）"""
+        with self._write_lock:
+            outermost = self._depth == 0
+            if outermost:
+                self._writer.execute('BEGIN IMMEDIATE')
+            self._depth += 1
+            try:
+                yield self._writer.cursor()
+            except BaseException:
+                self._depth -= 1
+                if outermost:
+                    self._after_commit = []
+                    self._writer.execute('ROLLBACK')
+                raise
+            else:
+                self._depth -= 1
+                if outermost:
+                    self._writer.execute('COMMIT')
+                    callbacks, self._after_commit = self._after_commit, []
+                    self._run_callbacks(callbacks)
+
+    def _run_callbacks(self, callbacks):
+        # コミット済みの書き込みに対するコールバック（1つの失敗で他を止めない）
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"[{datetime.now()}] Commit callback failed for {self.db_path}: {str(e)}")
+
+    @contextmanager
+    def maintenance(self):
+        """トランザクション外で実行が必要なPRAGMA/VACUUM用にライター接続を占有"""
+        with self._write_lock:
+            if self._depth:
+                raise RuntimeError('maintenance() cannot run inside a transaction')
+            yield self._writer.cursor()
+
+    def write(self, fn, on_commit=None):
+        """fn(cursor) を書き込む。バッチ中なら後でまとめて実行。
+        on_commit はその書き込みがコミットされた後にだけ呼ぶ（ロールバック時は呼ばない）"""
+        entry = (fn, on_commit)
+        with self._batch_lock:
+            if self._batch is not None:
+                self._batch.append(entry)
+                return
+        with self.transaction() as cursor:
+            fn(cursor)
+            if on_commit is not None:
+                self._after_commit.append(on_commit)
+
+    def _commit_batch(self, pending):
+        # 書き込み毎にセーブポイントを切り、失敗した1件だけを巻き戻して残りはコミットする
+        with self.transaction() as cursor:
+            for fn, on_commit in pending:
+                cursor.execute('SAVEPOINT batch_entry')
+                try:
+                    fn(cursor)
+                except Exception as e:
+                    cursor.execute('ROLLBACK TO batch_entry')
+                    cursor.execute('RELEASE batch_entry')
+                    print(f"[{datetime.now()}] Batched write failed for {self.db_path}: {str(e)}")
+                    continue
+                cursor.execute('RELEASE batch_entry')
+                if on_commit is not None:
+                    self._after_commit.append(on_commit)
+
+    def start_batching(self, interval: float):
+        """別々のスレッド（ソース毎の収集スレッド）からの write() も interval 秒毎に1トランザクションでコミット"""
+        with self._batch_lock:
+            if self._batch is not None:
+                return
+            self._batch = []
+        # 終了時に溜まっている書き込みを捨てない
+        atexit.register(self._flush_at_exit)
+        threading.Thread(target=self._flush_loop, args=(interval,), name='sqlite-batch', daemon=True).start()
+
+    def flush(self):
+        """溜まっている書き込みを今すぐコミット"""
+        with self._batch_lock:
+            if not self._batch:
+                return
+            pending, self._batch = self._batch, []
+        self._commit_batch(pending)
+
+    def _flush_at_exit(self):
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"[{datetime.now()}] Final batched commit failed for {self.db_path}: {str(e)}")
+
+    def _flush_loop(self, interval: float):
+        while True:
+            time.sleep(interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[{datetime.now()}] Batched commit failed for {self.db_path}: {str(e)}")
+
+    @contextmanager
+    def reader(self):
+        """リーダー接続をプールから借りる（WALによりライターをブロックしない）"""
+        conn = None
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            with self._reader_lock:
+                if self._reader_count < self.max_readers:
+                    self._reader_count += 1
+                    conn = self._connect()
+            if conn is None:
+                conn = self._readers.get()
+        try:
+            yield conn.cursor()
+        finally:
+            self._readers.put(conn)
+
+    def close(self):
+        atexit.unregister(self._flush_at_exit)
+        self._flush_at_exit()
+        with self._write_lock:
+            self._writer.close()
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
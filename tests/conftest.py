@@ -0,0 +1,29 @@
+import importlib
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+# リポジトリ直下のモジュール（fetch/, storage/, serving/ など）を読み込めるようにする
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# fetch.resource_history は読み込み時にDBを開くため、リポジトリ外の一時ファイルを使う
+os.environ.setdefault('RESOURCE_HISTORY_DB', os.path.join(tempfile.mkdtemp(), 'resource_history.db'))
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+
+@pytest.fixture(scope='session')
+def isolated_import(tmp_path_factory):
+    """読み込み時に config.yaml と履歴DBをカレントディレクトリに開くモジュール（monitoring_service, server）を一時ディレクトリで読み込む"""
+    def load(name):
+        workdir = tmp_path_factory.mktemp(name)
+        shutil.copy(os.path.join(ROOT, 'config.yaml'), workdir)
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            return importlib.import_module(name)
+        finally:
+            os.chdir(cwd)
+    return load
@@ -0,0 +1,28 @@
+import pytest
+
+import cluster_aggregates
+
+def test_percentiles_interpolate():
+    assert cluster_aggregates.percentiles([10, 0, 20]) == {'p50': 10, 'p90': pytest.approx(18), 'p99': pytest.approx(19.8)}
+    assert cluster_aggregates.percentiles([]) == {'p50': None, 'p90': None, 'p99': None}
+
+def test_compute():
+    result = cluster_aggregates.compute(
+        [('pve1', 'online', 0.5, 2, 8), ('pve2', 'offline', None, None, 0)],
+        [(100, 'web', 'running', 0.25, 300), (101, 'db', 'running', 0.75, 100), (102, 'old', 'stopped', None, None)],
+        top_n=2
+    )
+    cluster = result['cluster']
+    assert cluster['cpu_avg_pct'] == 25 and cluster['memory_avg_pct'] == 12.5
+    assert cluster['memory_pct'] == 25 and cluster['memory_total'] == 8
+    assert (cluster['nodes'], cluster['nodes_online'], cluster['guests'], cluster['guests_running']) == (2, 1, 3, 2)
+    assert result['nodes']['pve2'] == {'cpu_pct': 0, 'memory_pct': 0}
+    assert [guest['vmid'] for guest in result['top']['cpu']] == [101, 100]
+    assert [guest['vmid'] for guest in result['top']['memory']] == [100, 101]
+    assert result['counts']['guest_status'] == {'running': 2, 'stopped': 1}
+    assert result['percentiles']['guest_cpu_pct']['p50'] == 25
+
+def test_compute_empty_cluster():
+    result = cluster_aggregates.compute([], [])
+    assert result['cluster']['cpu_avg_pct'] == 0 and result['cluster']['memory_pct'] is None
+    assert result['top'] == {'cpu': [], 'memory': []}
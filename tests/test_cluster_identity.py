@@ -0,0 +1,29 @@
+from cluster_identity import cluster_identity, failover_order, group_by_cluster
+
+def test_cluster_identity_prefers_cluster_name():
+    status = [
+        {'type': 'node', 'name': 'pve1', 'local': 1},
+        {'type': 'cluster', 'name': 'prod'},
+    ]
+    assert cluster_identity(status, '10.0.0.1') == 'cluster:prod'
+
+def test_standalone_hosts_with_the_same_node_name_stay_separate():
+    # Proxmox の既定ノード名 'pve' の単体ホストが2台あっても別々に収集する
+    status = [{'type': 'node', 'name': 'pve', 'local': 1}]
+    assert cluster_identity(status, '10.0.0.1') == 'host:10.0.0.1'
+    assert cluster_identity(status, '10.0.0.2') == 'host:10.0.0.2'
+
+def test_failed_probe_has_no_identity():
+    assert cluster_identity(None, '10.0.0.1') is None
+    assert cluster_identity([], '10.0.0.1') is None
+
+def test_group_by_cluster_keeps_config_order_and_isolates_unknown_hosts():
+    identities = {'a': 'cluster:prod', 'b': None, 'c': 'cluster:prod', 'd': 'host:d'}
+    groups = group_by_cluster(list(identities), identities.get, lambda host: host)
+    assert groups == {'cluster:prod': ['a', 'c'], 'host:b': ['b'], 'host:d': ['d']}
+
+def test_failover_order_puts_active_member_first():
+    group = ['a', 'b', 'c']
+    assert failover_order(group, 'b') == ['b', 'a', 'c']
+    assert failover_order(group, 'x') == group
+    assert failover_order(group, None) == group
@@ -0,0 +1,47 @@
+import threading
+import time
+
+from fetch.collector_scheduler import CollectorScheduler, FixedRateCollector
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+def test_collectors_run_independently():
+    slow_started = threading.Event()
+    release = threading.Event()
+
+    def slow():
+        slow_started.set()
+        release.wait(5)
+
+    scheduler = CollectorScheduler()
+    fast = scheduler.add('fast', lambda: None, 0.02)
+    scheduler.add('slow', slow, 0.02)
+    for collector in scheduler.collectors.values():
+        collector.start(delay=0)
+    try:
+        assert slow_started.wait(5)
+        # 遅いソースの実行中も他のソースは収集を続ける
+        assert wait_for(lambda: fast.runs >= 5)
+    finally:
+        release.set()
+        scheduler.stop()
+    assert set(scheduler.status()) == {'fast', 'slow'}
+
+def test_overrunning_collector_skips_missed_runs_and_survives_errors():
+    def overrun():
+        time.sleep(0.05)
+        raise RuntimeError('boom')
+
+    collector = FixedRateCollector('overrun', overrun, 0.02)
+    collector.start(delay=0)
+    try:
+        assert wait_for(lambda: collector.runs >= 3)
+    finally:
+        collector.stop()
+    status = collector.status()
+    assert status['skipped'] >= 2 and status['last_duration'] >= 0.05
+    assert status['last_started'] is not None
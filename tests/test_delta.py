@@ -0,0 +1,90 @@
+from dataclasses import dataclass
+from typing import List
+
+from delta import DeltaTracker
+
+@dataclass(frozen=True, slots=True)
+class Node:
+    name: str
+    cpu: float
+
+@dataclass(frozen=True, slots=True)
+class VM:
+    vmid: int
+    status: str
+
+@dataclass(frozen=True, slots=True)
+class Storage:
+    node: str
+    storage: str
+
+@dataclass(frozen=True, slots=True)
+class ClusterVM:
+    vmid: int
+    status: str
+    cluster: str = ''
+
+@dataclass(frozen=True, slots=True)
+class Stats:
+    total_cpu: float
+    nodes: List[Node]
+    vms: List[VM]
+    storages: List[Storage]
+
+def test_first_update_adds_everything_and_sets_the_snapshot():
+    tracker = DeltaTracker()
+    assert tracker.snapshot() is None
+    message = tracker.update(Stats(0.5, [Node('pve1', 0.5)], [VM(100, 'running')], [Storage('pve1', 'local/zfs')]), 't1')
+    assert message['seq'] == 1
+    assert {'op': 'replace', 'path': '/total_cpu', 'value': 0.5} in message['ops']
+    assert {'op': 'add', 'path': '/nodes/pve1', 'value': {'name': 'pve1', 'cpu': 0.5}} in message['ops']
+    # キーの '/' はエスケープ
+    assert {'op': 'add', 'path': '/storages/pve1~1local~1zfs', 'value': {'node': 'pve1', 'storage': 'local/zfs'}} in message['ops']
+    assert tracker.snapshot() == {
+        'seq': 1,
+        'timestamp': 't1',
+        'data': {
+            'total_cpu': 0.5,
+            'nodes': [{'name': 'pve1', 'cpu': 0.5}],
+            'vms': [{'vmid': 100, 'status': 'running'}],
+            'storages': [{'node': 'pve1', 'storage': 'local/zfs'}]
+        }
+    }
+
+def test_only_changed_fields_and_removed_items_are_sent():
+    tracker = DeltaTracker()
+    tracker.update(Stats(0.5, [Node('pve1', 0.5), Node('pve2', 0.1)], [VM(100, 'running')], []), 't1')
+    message = tracker.update(Stats(0.5, [Node('pve1', 0.5)], [VM(100, 'stopped')], []), 't2')
+    assert message == {
+        'seq': 2,
+        'timestamp': 't2',
+        'ops': [
+            {'op': 'remove', 'path': '/nodes/pve2'},
+            {'op': 'replace', 'path': '/vms/100/status', 'value': 'stopped'}
+        ]
+    }
+
+def test_unchanged_stats_produce_no_message():
+    tracker = DeltaTracker()
+    stats = Stats(0.5, [Node('pve1', 0.5)], [], [])
+    tracker.update(stats, 't1')
+    assert tracker.update(stats, 't2') is None
+    assert tracker.seq == 1 and tracker.snapshot()['timestamp'] == 't1'
+
+def test_guests_from_different_clusters_do_not_collide():
+    tracker = DeltaTracker()
+    vms = [ClusterVM(100, 'running', 'cluster:prod'), ClusterVM(100, 'stopped', 'host:10.0.0.5')]
+    message = tracker.update(Stats(0, [], vms, []), 't1')
+    assert [op['path'] for op in message['ops'] if op['path'].startswith('/vms')] == [
+        '/vms/cluster:prod~1100', '/vms/host:10.0.0.5~1100'
+    ]
+    # 同じ内容の次のサイクルで置き換えが行き来しない
+    assert tracker.update(Stats(0, [], vms, []), 't2') is None
+    assert len(tracker.snapshot()['data']['vms']) == 2
+
+def test_duplicate_keys_are_numbered_in_order():
+    tracker = DeltaTracker()
+    vms = [VM(100, 'running'), VM(100, 'stopped')]
+    message = tracker.update(Stats(0, [], vms, []), 't1')
+    assert [op['path'] for op in message['ops'] if op['path'].startswith('/vms')] == ['/vms/100', '/vms/100#2']
+    assert tracker.update(Stats(0, [], vms, []), 't2') is None
@@ -0,0 +1,61 @@
+import pytest
+
+from serving.detailed_index import DetailedIndex, QueryError, parse_fields
+
+DATA = {
+    'cluster_info': {'data': [{'type': 'cluster', 'name': 'prod'}]},
+    'nodes': [
+        {'node': 'pve1', 'status': 'online', 'cpu': 0.1, 'details': {'syslog': ['x'] * 100}},
+        {'node': 'pve2', 'status': 'online', 'cpu': 0.2},
+    ],
+    'vms': [
+        {'vmid': 100, 'node': 'pve1', 'status': 'running', 'name': 'web', 'cpu': 0.1},
+        {'vmid': 101, 'node': 'pve2', 'status': 'stopped', 'name': 'db', 'cpu': 0},
+    ],
+    'containers': [{'vmid': 200, 'node': 'pve1', 'status': 'running', 'name': 'dns'}],
+    'storage': [{'storage': 'local', 'node': 'pve1', 'status': 'available', 'used': 1, 'total': 2}],
+}
+
+@pytest.fixture
+def index():
+    return DetailedIndex(DATA)
+
+def test_parse_fields():
+    assert parse_fields('nodes.cpu,storage') == {'nodes': ('cpu',), 'storage': None}
+    assert parse_fields('vms.name,vms') == {'vms': None}
+    assert parse_fields(None) is None
+    assert parse_fields('') is None
+    assert parse_fields(' , ,') is None
+
+def test_no_parameters_returns_everything(index):
+    assert index.query() == DATA
+
+def test_empty_fields_is_same_as_no_fields(index):
+    assert index.query(',') == DATA
+
+def test_projection_keeps_identifying_keys(index):
+    result = index.query('nodes.cpu,storage', node='pve1')
+    assert result == {
+        'nodes': [{'node': 'pve1', 'cpu': 0.1}],
+        'storage': DATA['storage'],
+    }
+
+def test_type_and_status_filters(index):
+    assert index.query(kind='qemu', status='running') == {'vms': [DATA['vms'][0]]}
+    assert index.query(kind='lxc', node='pve2') == {'containers': []}
+
+def test_filters_use_prebuilt_groups(index):
+    assert index.select('vms', 'pve1', 'running') is index.select('vms', 'pve1', 'running')
+    assert index.select('vms', 'missing') == []
+
+@pytest.mark.parametrize('fields', ['foo', 'vms.nope', 'cluster_info.name'])
+def test_unknown_fields_are_rejected(index, fields):
+    with pytest.raises(QueryError):
+        index.query(fields)
+
+def test_unknown_type_is_rejected(index):
+    with pytest.raises(QueryError):
+        index.query(kind='vm')
+
+def test_fields_of_empty_collection_are_not_validated():
+    assert DetailedIndex({'vms': []}).query('vms.name') == {'vms': []}
@@ -0,0 +1,20 @@
+from storage.history_window import HistoryWindow
+
+def test_append_evicts_entries_outside_the_window():
+    window = HistoryWindow(100)
+    window.load([(50, 't50', 'b'), (0, 't0', 'a')])
+    assert [entry['data'] for entry in window.newest_first()] == ['b', 'a']
+    window.append(120, 't120', 'c')
+    assert [entry['timestamp'] for entry in window.newest_first()] == ['t120', 't50']
+
+def test_snapshot_is_reused_until_the_next_append():
+    window = HistoryWindow(100)
+    assert not window.loaded and window.last_update is None
+    window.load([])
+    first = window.newest_first()
+    version = window.version
+    assert window.newest_first() is first
+    window.append(1, 't1', 'a')
+    assert window.newest_first() is not first
+    assert window.version == version + 1 and window.last_update is not None
+    assert len(window) == 1
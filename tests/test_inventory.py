@@ -0,0 +1,45 @@
+import pytest
+
+from serving.detailed_index import QueryError
+from serving.inventory import Inventory
+
+def guest(vmid, node, kind='qemu', status='running', cpu=0.1):
+    return {'vmid': vmid, 'node': node, 'type': kind, 'status': status, 'cpu': cpu}
+
+@pytest.fixture
+def first():
+    return Inventory(['a', 'b'], [guest(1, 'a'), guest(2, 'a', 'lxc', 'stopped'), guest(3, 'b')])
+
+def test_lookups(first):
+    assert first.guest(1)['node'] == 'a'
+    assert first.guest(9) is None
+    assert [g['vmid'] for g in first.node_guests('a')] == [1, 2]
+    assert [g['vmid'] for g in first.node_guests('a', 'lxc')] == [2]
+    assert [g['vmid'] for g in first.node_guests('a', status='running')] == [1]
+    assert first.node_guests('a', 'qemu', 'stopped') == []
+    assert first.has_node('b') and not first.has_node('c')
+
+def test_unknown_type_is_rejected(first):
+    with pytest.raises(QueryError):
+        first.node_guests('a', 'vm')
+
+def test_metric_only_change_swaps_references_without_reindexing(first):
+    guests = [guest(1, 'a', cpu=0.9), guest(2, 'a', 'lxc', 'stopped'), guest(3, 'b')]
+    second = Inventory(['a', 'b'], guests, first)
+    assert second.changed == 0
+    assert second.guest(1)['cpu'] == 0.9
+    assert second.node_guests('a')[0] is guests[0]
+    # 変化のない集合は前回と共有
+    assert second._by_node['a'] is first._by_node['a']
+
+def test_moved_stopped_and_removed_guests(first):
+    second = Inventory(['a', 'b'], [guest(1, 'b', status='stopped'), guest(2, 'a', 'lxc', 'stopped')], first)
+    assert second.changed == 2
+    assert [g['vmid'] for g in second.node_guests('a')] == [2]
+    assert [g['vmid'] for g in second.node_guests('b')] == [1]
+    assert second.node_guests('b', status='running') == []
+    assert second.guest(3) is None
+    assert second.counts()['status'] == {'stopped': 2}
+    # 前回の索引は変更されない（公開済みスナップショットの不変性）
+    assert [g['vmid'] for g in first.node_guests('a')] == [1, 2]
+    assert first.guest(3) is not None
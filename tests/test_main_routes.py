@@ -0,0 +1,148 @@
+import gzip
+import importlib
+import json
+import os
+
+import pytest
+
+pytest.importorskip('flask')
+pytest.importorskip('requests')
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+
+@pytest.fixture(scope='module')
+def main():
+    # config.yaml はリポジトリ直下から読む（履歴DBは conftest.py で一時ファイルに向けている）
+    cwd = os.getcwd()
+    os.chdir(ROOT)
+    try:
+        yield importlib.import_module('main')
+    finally:
+        os.chdir(cwd)
+
+@pytest.fixture
+def client(main):
+    return main.app.test_client()
+
+def test_metrics_route_serves_published_snapshot(main, client):
+    main.publish('nextcloud', {'ocs': {'data': {'users': 3}}})
+    response = client.get('/metrics/nextcloud')
+    assert response.status_code == 200
+    assert json.loads(response.data)['data'] == {'ocs': {'data': {'users': 3}}}
+
+    cached = client.get('/metrics/nextcloud', headers={'If-None-Match': response.headers['ETag']})
+    assert cached.status_code == 304
+
+def test_metrics_route_gzip(main, client):
+    nodes = [{'node': f'pve{i}', 'status': 'online', 'cpu': 0.1} for i in range(200)]
+    main.publish('node_exporter', {'targets': nodes})
+    response = client.get('/metrics/node_exporter', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(response.data))['data'] == {'targets': nodes}
+
+def test_metrics_route_reports_error(main, client):
+    main.cache.fail('proxmox', 'boom')
+    response = client.get('/metrics/proxmox')
+    assert response.status_code == 500
+    assert json.loads(response.data) == {'error': 'boom'}
+
+def test_history_route_reserializes_after_append(main, client):
+    window = main.resource_history.history_window('nextcloud')
+    window.load([(1700000000, '2023-11-14T22:13:20', {'users': 1})])
+    first = client.get('/metrics/nextcloud/history')
+    assert json.loads(first.data)['data'] == [{'timestamp': '2023-11-14T22:13:20', 'data': {'users': 1}}]
+    assert client.get('/metrics/nextcloud/history', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+
+    window.append(1700000010, '2023-11-14T22:13:30', {'users': 2})
+    second = client.get('/metrics/nextcloud/history', headers={'If-None-Match': first.headers['ETag']})
+    assert second.status_code == 200
+    assert [entry['data']['users'] for entry in json.loads(second.data)['data']] == [2, 1]
+
+def test_detailed_filter_reads_index_from_same_snapshot(main, client):
+    from serving.detailed_index import DetailedIndex
+    data = {'cluster_info': {}, 'nodes': [{'node': 'pve1', 'status': 'online', 'cpu': 0.5}], 'vms': [], 'containers': [], 'storage': []}
+    snapshot = main.publish('proxmox_detailed', data, {'detailed': DetailedIndex(data)})
+    response = client.get('/metrics/proxmox/detailed?fields=nodes.cpu')
+    body = json.loads(response.data)
+    assert body == {'data': {'nodes': [{'node': 'pve1', 'cpu': 0.5}]}, 'last_update': snapshot.last_update.isoformat()}
+    assert client.get('/metrics/proxmox/detailed?fields=nodes.nope').status_code == 400
+
+def publish_inventory(main):
+    from serving.detailed_index import DetailedIndex
+    from serving.inventory import Inventory
+    vms = [{'vmid': 100, 'node': 'pve1', 'type': 'qemu', 'status': 'running', 'name': 'web'}]
+    data = {'cluster_info': {}, 'nodes': [{'node': 'pve1', 'status': 'online'}], 'vms': vms, 'containers': [], 'storage': []}
+    return main.publish('proxmox_detailed', data, {'detailed': DetailedIndex(data), 'inventory': Inventory(['pve1'], vms)})
+
+def test_vm_and_node_guest_routes(main, client):
+    snapshot = publish_inventory(main)
+    body = json.loads(client.get('/metrics/proxmox/vm/100').data)
+    assert body['data']['name'] == 'web'
+    assert body['last_update'] == snapshot.last_update.isoformat()
+    assert client.get('/metrics/proxmox/vm/999').status_code == 404
+
+    assert [g['vmid'] for g in json.loads(client.get('/metrics/proxmox/node/pve1/guests?type=qemu').data)['data']] == [100]
+    assert client.get('/metrics/proxmox/node/pve1/guests?type=vm').status_code == 400
+    assert client.get('/metrics/proxmox/node/nope/guests').status_code == 404
+
+def test_status_history_last_update_comes_from_the_window(main, client):
+    window = main.resource_history.history_window('nextcloud')
+    window.load([])
+    window.append(1, '1970-01-01T00:00:01', {'users': 1})
+    body = json.loads(client.get('/status').data)
+    assert body['nextcloud_history']['last_update'] == window.last_update.isoformat()
+    assert body['nextcloud_history']['entries'] == len(window)
+
+def test_proxmox_history_is_written_on_the_history_tier_only(main, monkeypatch):
+    from fetch.proxmox_schedule import TieredScheduler
+    inserted = []
+    monkeypatch.setattr(main, 'proxmox_scheduler', TieredScheduler())
+    monkeypatch.setattr(main, 'proxmox_raw_cache', {'node_details': {}})
+    monkeypatch.setattr(main.resource_history, 'insert_resource', lambda source, data: inserted.append(source))
+    monkeypatch.setattr(main.proxmox_api, 'fetch_proxmox_cluster_any', lambda cfg, cluster_keys, **kwargs: {
+        key: {'data': []} for key in cluster_keys
+    })
+    main.update_proxmox_data()
+    assert inserted == ['proxmox']
+    # cluster_resources（5秒）だけが更新時期を迎えた回は履歴に書かない
+    main.proxmox_scheduler.last_fetch = {key: float('inf') for key in main.proxmox_scheduler.tiers if key != 'cluster_resources'}
+    assert main.proxmox_scheduler.due() == (['cluster_resources'], [])
+    main.update_proxmox_data()
+    assert inserted == ['proxmox']
+
+def test_proxmox_series_route(main, client, monkeypatch):
+    monkeypatch.setattr(main.resource_history, 'last_insert', {})
+    main.resource_history.insert_resource('proxmox', {'nodes': [], 'vms': [{'vmid': 100, 'status': 'running', 'cpu': 0.5}], 'containers': []})
+    body = json.loads(client.get('/metrics/proxmox/history/qemu/100/cpu?days=1&max_points=1000').data)
+    assert [point['value'] for point in body['data']] == [0.5]
+    assert json.loads(client.get('/metrics/proxmox/history/qemu/100/up').data)['data'][0]['value'] == 1
+    assert client.get('/metrics/proxmox/history/qemu/100/cpu?aggregate=median').status_code == 400
+
+def test_manual_proxmox_refresh_fetches_tiers_that_are_not_due(main, monkeypatch):
+    from fetch.proxmox_schedule import TieredScheduler
+    fetched = []
+    monkeypatch.setattr(main, 'proxmox_scheduler', TieredScheduler())
+    monkeypatch.setattr(main, 'proxmox_raw_cache', {'node_details': {}})
+    monkeypatch.setattr(main.resource_history, 'insert_resource', lambda source, data: None)
+    monkeypatch.setattr(main.proxmox_api, 'fetch_proxmox_cluster_any', lambda cfg, cluster_keys, **kwargs: (
+        fetched.append(cluster_keys), {key: {'data': []} for key in cluster_keys}
+    )[1])
+    main.update_proxmox_data()
+    # 定期更新ではまだ更新時期ではないが、手動更新は全階層を取得する
+    assert main.proxmox_scheduler.due()[0] == []
+    main.cache.fail('proxmox', 'stale')
+    main.run_refresh_job('proxmox')
+    assert len(fetched) == 2 and 'nodes' in fetched[1] and 'cluster_options' in fetched[1]
+
+def test_refresh_job_reports_only_errors_from_its_own_run(main, monkeypatch):
+    monkeypatch.setattr(main.nextcloud_api, 'fetch_nextcloud_serverinfo', lambda cfg: {'users': 1})
+    monkeypatch.setattr(main.resource_history, 'insert_resource', lambda source, data: None)
+    main.cache.fail('nextcloud', 'stale')
+    main.run_refresh_job('nextcloud')
+    assert main.cache['nextcloud'].error is None
+
+    def broken(cfg):
+        raise RuntimeError('unreachable')
+    monkeypatch.setattr(main.nextcloud_api, 'fetch_nextcloud_serverinfo', broken)
+    with pytest.raises(RuntimeError, match='unreachable'):
+        main.run_refresh_job('nextcloud')
@@ -0,0 +1,252 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('aiohttp')
+pytest.importorskip('yaml')
+
+@pytest.fixture(scope='module')
+def ms(isolated_import):
+    return isolated_import('monitoring_service')
+
+def make_api(ms, responses, **host_settings):
+    """(ホスト, エンドポイント) -> data の辞書で api_request を置き換えた ProxmoxAPI"""
+    hosts = [dict({'host': host, 'username': 'root@pam', 'password': 'secret'}, **host_settings)
+             for host in dict.fromkeys(host for host, _ in responses)]
+    api = ms.ProxmoxAPI({'proxmox': hosts})
+    api.requests = []
+
+    async def authenticate(host_config, stale_ticket=None):
+        return 'ticket'
+
+    async def api_request(host, endpoint):
+        api.requests.append((host, endpoint))
+        return responses.get((host, endpoint))
+
+    api.authenticate = authenticate
+    api.api_request = api_request
+    return api
+
+def standalone(host, vmid):
+    return {
+        (host, '/cluster/status'): [{'type': 'node', 'name': 'pve', 'local': 1}],
+        (host, '/cluster/resources'): [
+            {'type': 'node', 'node': 'pve', 'status': 'online', 'cpu': 0.1, 'mem': 1, 'maxmem': 2, 'maxcpu': 4},
+            {'type': 'qemu', 'node': 'pve', 'vmid': vmid, 'name': f'vm{vmid}', 'status': 'running'},
+        ],
+        (host, '/nodes/pve/status'): {'temperature': 40},
+    }
+
+def test_standalone_hosts_with_the_same_node_name_are_both_collected(ms):
+    api = make_api(ms, {**standalone('a', 100), **standalone('b', 200)})
+    stats = asyncio.run(api.get_cluster_status())
+    assert sorted(vm.vmid for vm in stats.vms) == [100, 200]
+    assert ('b', '/cluster/resources') in api.requests
+
+def test_records_carry_their_cluster(ms):
+    responses = {**standalone('a', 100), **standalone('b', 100)}
+    responses[('a', '/cluster/status')] = [{'type': 'cluster', 'name': 'prod'}]
+    stats = asyncio.run(make_api(ms, responses).get_cluster_status())
+    assert sorted((vm.cluster, vm.vmid) for vm in stats.vms) == [('cluster:prod', 100), ('host:b', 100)]
+    assert sorted(node.cluster for node in stats.nodes) == ['cluster:prod', 'host:b']
+
+class FakePost:
+    def __init__(self, api):
+        self.api = api
+
+    async def __aenter__(self):
+        self.api.logins += 1
+        response = type('Response', (), {})()
+        response.status = 200
+
+        async def body():
+            return {'data': {'ticket': f't{self.api.logins}', 'CSRFPreventionToken': 'csrf'}}
+
+        response.json = body
+        return response
+
+    async def __aexit__(self, *exc):
+        return False
+
+class FakeSession:
+    def __init__(self, api):
+        self.api = api
+        self.closed = False
+
+    def post(self, url, data):
+        return FakePost(self.api)
+
+    async def close(self):
+        self.closed = True
+
+def auth_api(ms, rejected=()):
+    """session.post と _get を置き換えた ProxmoxAPI（_get は rejected のチケットに401を返し、使ったチケットを記録）"""
+    api = ms.ProxmoxAPI({'proxmox': [{'host': 'a', 'username': 'root@pam', 'password': 'secret'}]})
+    api.logins = 0
+    api.used_tickets = []
+    api.rejected = set(rejected)
+    session = FakeSession(api)
+    api._session = lambda host_config: api.sessions.setdefault(host_config['host'], session)
+
+    async def get(session, host, url):
+        ticket = api.tickets[host]['ticket']
+        api.used_tickets.append(ticket)
+        await asyncio.sleep(0)
+        if ticket in api.rejected:
+            return 401, None
+        return 200, {'ticket': ticket}
+
+    api._get = get
+    return api
+
+def test_ticket_is_reused_until_the_refresh_margin(ms, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ms.time, 'time', lambda: now[0])
+    api = auth_api(ms)
+    host = api.hosts[0]
+
+    async def run():
+        assert await api.authenticate(host) == 't1'
+        assert await api.authenticate(host) == 't1'
+        # 期限（2時間）の REFRESH_MARGIN 前になったら取り直す
+        now[0] += ms.TICKET_LIFETIME - ms.TICKET_REFRESH_MARGIN - 1
+        assert await api.authenticate(host) == 't1'
+        now[0] += 1
+        assert await api.authenticate(host) == 't2'
+
+    asyncio.run(run())
+    assert api.logins == 2
+
+def test_stale_ticket_is_renewed_once_on_401(ms):
+    # サーバー側で失効したチケット
+    api = auth_api(ms, rejected=['t1'])
+
+    async def run():
+        await api.authenticate(api.hosts[0])
+        # 同時に401を受けても再認証は1回だけ
+        return await asyncio.gather(api.api_request('a', '/version'), api.api_request('a', '/nodes'))
+
+    assert asyncio.run(run()) == [{'ticket': 't2'}, {'ticket': 't2'}]
+    assert api.logins == 2
+    assert api.used_tickets == ['t1', 't1', 't2', 't2']
+
+def test_close_releases_sessions_and_tickets(ms):
+    api = auth_api(ms)
+
+    async def run():
+        await api.authenticate(api.hosts[0])
+        session = api.sessions['a']
+        await api.close()
+        return session
+
+    session = asyncio.run(run())
+    assert session.closed and api.sessions == {} and api.tickets == {}
+    # セッションがなければリクエストは送らない
+    assert asyncio.run(api.api_request('a', '/version')) is None
+
+RESOURCES = [
+    {'type': 'node', 'node': 'pve1', 'status': 'online', 'cpu': 0.25, 'mem': 4, 'maxmem': 16, 'maxcpu': 8, 'uptime': 60},
+    {'type': 'node', 'node': 'pve2', 'status': 'offline'},
+    {'type': 'qemu', 'node': 'pve1', 'vmid': 100, 'name': 'web', 'status': 'running', 'cpu': 0.5, 'mem': 2, 'maxmem': 4},
+    {'type': 'lxc', 'node': 'pve2', 'vmid': 200, 'name': 'db', 'status': 'stopped'},
+    {'type': 'storage', 'node': 'pve1', 'storage': 'local', 'plugintype': 'dir', 'disk': 3, 'maxdisk': 10},
+    {'type': 'sdn', 'node': 'pve1', 'sdn': 'localnetwork'},
+]
+
+def test_cluster_resources_are_mapped_per_node(ms):
+    api = make_api(ms, {('a', '/cluster/resources'): RESOURCES, ('a', '/nodes/pve1/status'): {'temperature': 45, 'power': 80}})
+    results = asyncio.run(api._collect_cluster_resources(api.hosts[0], 'cluster:prod'))
+    (node, cores, memory, vms, storages), (offline, offline_cores, _, offline_vms, _) = results
+    assert node == ms.NodeInfo('pve1', 'online', 0.25, 4, 16, 60, 45, 80, 'cluster:prod')
+    assert (cores, memory) == (8, 16)
+    assert vms == [ms.VMInfo(100, 'web', 'running', 'pve1', 'vm', 0.5, 2, 4, 'cluster:prod')]
+    assert storages == [ms.StorageInfo('pve1', 'local', 'dir', 10, 3, 7, 'cluster:prod')]
+    # オフラインのノードは NodeInfo なしで、ゲストだけ返す
+    assert offline is None and offline_cores == 0
+    assert [(vm.vmid, vm.type) for vm in offline_vms] == [(200, 'container')]
+    # オフラインのノードの詳細は取得しない
+    assert ('a', '/nodes/pve2/status') not in api.requests
+
+def test_node_details_are_refreshed_after_detail_interval(ms, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ms.time, 'time', lambda: now[0])
+    api = make_api(ms, {('a', '/cluster/resources'): RESOURCES, ('a', '/nodes/pve1/status'): {'temperature': 45}},
+                   detail_interval=60)
+
+    def detail_requests():
+        asyncio.run(api._collect_cluster_resources(api.hosts[0]))
+        return api.requests.count(('a', '/nodes/pve1/status'))
+
+    assert detail_requests() == 1
+    now[0] += 59
+    assert detail_requests() == 1
+    now[0] += 1
+    assert detail_requests() == 2
+
+def test_failed_detail_fetch_keeps_the_previous_details(ms):
+    responses = {('a', '/cluster/resources'): RESOURCES, ('a', '/nodes/pve1/status'): {'temperature': 45}}
+    api = make_api(ms, responses, detail_interval=0)
+    asyncio.run(api._collect_cluster_resources(api.hosts[0]))
+    responses[('a', '/nodes/pve1/status')] = None
+    results = asyncio.run(api._collect_cluster_resources(api.hosts[0]))
+    assert results[0][0].temperature == 45
+
+def test_no_resources_means_no_nodes(ms):
+    api = make_api(ms, {('a', '/cluster/resources'): None})
+    assert asyncio.run(api._collect_cluster_resources(api.hosts[0])) == []
+
+def test_per_node_collection_is_concurrent_capped_and_ordered(ms):
+    nodes = [{'node': f'pve{i}', 'status': 'online'} for i in range(6)]
+    api = ms.ProxmoxAPI({'proxmox': [
+        {'host': 'a', 'username': 'root@pam', 'password': 'secret', 'collection_mode': 'per_node', 'max_concurrency': 3}
+    ]})
+    in_flight = [0]
+    peak = [0]
+
+    def payload(endpoint):
+        if endpoint == '/nodes':
+            return nodes
+        index = int(endpoint.split('/')[2][3:])
+        if endpoint.endswith('/status'):
+            return {'cpu': 0.1, 'memory': {'used': 1, 'total': 2}, 'cpuinfo': {'cpus': 4}}
+        if endpoint.endswith('/qemu'):
+            return [{'vmid': 100 + index, 'name': f'vm{index}', 'status': 'running'}]
+        return []
+
+    class Response:
+        status = 200
+
+        def __init__(self, endpoint):
+            self.endpoint = endpoint
+
+        async def __aenter__(self):
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+            # 後のノードほど早く応答させ、結果が完了順ではなく入力順に並ぶことを確かめる
+            index = 0 if self.endpoint == '/nodes' else int(self.endpoint.split('/')[2][3:])
+            await asyncio.sleep(0.001 * (6 - index))
+            return self
+
+        async def __aexit__(self, *exc):
+            in_flight[0] -= 1
+            return False
+
+        async def json(self):
+            return {'data': payload(self.endpoint)}
+
+    class Session:
+        closed = False
+
+        def get(self, url, headers):
+            return Response(url.split('/api2/json', 1)[1])
+
+    async def authenticate(host_config, stale_ticket=None):
+        return 'ticket'
+
+    api.authenticate = authenticate
+    api.sessions['a'] = Session()
+    results = asyncio.run(api._collect_host(api.hosts[0]))
+    assert [node_info.name for node_info, *_ in results] == [node['node'] for node in nodes]
+    assert [vms[0].vmid for *_, vms, _ in results] == [100 + i for i in range(6)]
+    # 6ノード x 4リクエストを同時に発行しても、ホスト毎の上限（max_concurrency）を超えない
+    assert peak[0] == 3
@@ -0,0 +1,24 @@
+import time
+
+from fetch import node_exporter
+
+def test_scrape_targets_runs_in_parallel_and_times_out(monkeypatch):
+    def fetch(ip, port, timeout):
+        if ip == 'slow':
+            time.sleep(1)
+        return {'load1': 1.0, 'port': port}
+
+    monkeypatch.setattr(node_exporter, 'fetch_metrics', fetch)
+    started = time.monotonic()
+    results = node_exporter.scrape_targets({
+        'jitter': 0,
+        'timeout': 0.3,
+        'targets': [{'host': 'a'}, {'host': 'b', 'port': 9200, 'name': 'beta'}, {'host': 'slow'}]
+    })
+    assert time.monotonic() - started < 0.9
+    assert results['a:9100']['load1'] == 1.0 and 'scrape_duration' in results['a:9100']
+    assert results['beta']['port'] == 9200
+    assert results['slow:9100'] == {'error': 'scrape timeout'}
+
+def test_no_targets():
+    assert node_exporter.scrape_targets({}) == {}
@@ -0,0 +1,43 @@
+import pytest
+
+from fetch import node_exporter, prometheus_text
+
+PAYLOAD = b'''# HELP node_load1 1m load average.
+# TYPE node_load1 gauge
+node_load1 0.5
+node_load15 0.25
+node_load5 1e-1
+node_cpu_seconds_total{cpu="0",mode="idle"} 100
+node_filesystem_avail_bytes{device="/dev/sda1",mountpoint="/a \\"b\\"\\n"} 42
+node_memory_MemTotal_bytes 8.589934592e+09'''
+
+WANTED = ['node_load1', 'node_load5', 'node_load15', 'node_filesystem_avail_bytes', 'node_memory_MemTotal_bytes']
+
+def samples(chunks):
+    return sorted(prometheus_text.parse_stream(chunks, WANTED), key=lambda sample: sample[0])
+
+def test_parses_wanted_metrics_only():
+    result = samples([PAYLOAD])
+    assert [name for name, _, _ in result] == sorted(WANTED)
+    values = {name: value for name, _, value in result}
+    assert values['node_load1'] == 0.5 and values['node_load15'] == 0.25 and values['node_load5'] == 0.1
+
+def test_labels_are_unescaped():
+    labels = dict((name, labels) for name, labels, _ in samples([PAYLOAD]))['node_filesystem_avail_bytes']
+    assert labels == {'device': '/dev/sda1', 'mountpoint': '/a "b"\n'}
+
+@pytest.mark.parametrize('size', [1, 7, 64])
+def test_chunk_boundaries_do_not_change_the_result(size):
+    chunks = [PAYLOAD[i:i + size] for i in range(0, len(PAYLOAD), size)]
+    assert samples(chunks) == samples([PAYLOAD])
+
+def test_invalid_values_are_skipped():
+    assert list(prometheus_text.parse_stream([b'node_load1 NaNx\nnode_load1\n'], ['node_load1'])) == []
+
+def test_empty_wanted_is_rejected():
+    with pytest.raises(ValueError):
+        prometheus_text.ExpositionParser([])
+
+def test_node_exporter_parse_metrics_casts_values():
+    metrics = node_exporter.parse_metrics([PAYLOAD])
+    assert metrics == {'load1': 0.5, 'load5': 0.1, 'load15': 0.25, 'mem_total': 8589934592}
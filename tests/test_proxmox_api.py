@@ -0,0 +1,90 @@
+import threading
+import time
+
+from fetch import proxmox_api
+
+class FakeClient:
+    def __init__(self, slow=()):
+        self.slow = set(slow)
+        self.paths = []
+        self._lock = threading.Lock()
+
+    def auth_headers(self):
+        return {}
+
+    def get_json(self, path):
+        with self._lock:
+            self.paths.append(path)
+        if path in self.slow:
+            time.sleep(1)
+        if path == '/nodes':
+            return {'data': [{'node': 'pve1'}, {'node': 'pve2'}]}
+        return {'data': path}
+
+def test_fetch_requests_node_endpoints_for_every_listed_node():
+    client = FakeClient()
+    result = proxmox_api.fetch_proxmox({}, client, cluster_keys=['cluster_status'], node_keys=['status'])
+    # ノード詳細のために 'nodes' も取得される
+    assert result['cluster_status'] == {'data': '/cluster/status'}
+    assert result['node_details'] == {
+        'pve1': {'status': {'data': '/nodes/pve1/status'}},
+        'pve2': {'status': {'data': '/nodes/pve2/status'}}
+    }
+
+def test_known_node_names_skip_the_node_list():
+    client = FakeClient()
+    result = proxmox_api.fetch_proxmox({}, client, cluster_keys=[], node_keys=['rrd'], node_names=['pve3'])
+    assert '/nodes' not in client.paths
+    assert result['node_details'] == {'pve3': {'rrd': {'data': '/nodes/pve3/rrddata'}}}
+
+def test_requests_past_the_cycle_deadline_are_recorded_as_errors():
+    client = FakeClient(slow=['/cluster/log'])
+    started = time.monotonic()
+    result = proxmox_api.fetch_proxmox({'cycle_deadline': 0.2}, client, cluster_keys=['cluster_log', 'cluster_status'], node_keys=[])
+    assert time.monotonic() - started < 0.9
+    assert result['cluster_log'] == {'error': 'cycle deadline exceeded'}
+    assert result['cluster_status'] == {'data': '/cluster/status'}
+
+class FakeResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self._body = body
+
+    def json(self):
+        return self._body
+
+class FakeSession:
+    def __init__(self, statuses):
+        self.logins = 0
+        self.statuses = list(statuses)
+
+    def post(self, url, data, timeout):
+        self.logins += 1
+        return FakeResponse(200, {'data': {'CSRFPreventionToken': 'csrf', 'ticket': f't{self.logins}'}})
+
+    def get(self, url, headers, timeout):
+        return FakeResponse(self.statuses.pop(0), {'data': headers['Cookie']})
+
+    def close(self):
+        pass
+
+CFG = {'host': 'pve1', 'username': 'root@pam', 'password': 'secret'}
+
+def test_ticket_is_reused_and_renewed_after_401():
+    client = proxmox_api.ProxmoxClient(CFG)
+    client.session = FakeSession([200, 200, 401, 200])
+    assert client.get_json('/version') == {'data': 'PVEAuthCookie=t1'}
+    assert client.get_json('/version') == {'data': 'PVEAuthCookie=t1'}
+    # 401 を受けた時だけ取り直して1回再試行
+    assert client.get_json('/version') == {'data': 'PVEAuthCookie=t2'}
+    assert client.session.logins == 2
+
+def test_clients_are_shared_per_host_until_the_config_changes():
+    first = proxmox_api.get_client(dict(CFG))
+    assert proxmox_api.get_client(dict(CFG)) is first
+    assert proxmox_api.get_client(dict(CFG, verify_ssl=False)) is not first
+
+def test_host_failure_requires_every_endpoint_to_fail():
+    assert proxmox_api._is_host_failure({'nodes': {'error': 'x'}, 'node_details': {'pve1': {'status': {'error': 'y'}}}})
+    assert not proxmox_api._is_host_failure({'nodes': {'error': 'x'}, 'node_details': {'pve1': {'status': {'data': 1}}}})
+    assert not proxmox_api._is_host_failure({'node_details': {}})
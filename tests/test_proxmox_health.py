@@ -0,0 +1,90 @@
+import threading
+
+from fetch import proxmox_health
+from fetch.proxmox_health import CLOSED, FAILURE_THRESHOLD, HALF_OPEN, OPEN, FailoverSelector, HostHealth
+
+def trip(selector, host):
+    for _ in range(FAILURE_THRESHOLD):
+        selector.record_failure(host, 'timeout')
+
+def expire_cooldown(selector, host):
+    selector.health[host].opened_at -= proxmox_health.OPEN_COOLDOWN
+
+def test_breaker_opens_after_threshold_and_closes_on_success():
+    health = HostHealth('a')
+    for _ in range(FAILURE_THRESHOLD - 1):
+        health.record_failure('timeout')
+    assert health.state == CLOSED
+    health.record_failure('timeout')
+    assert health.state == OPEN
+    health.record_success(0.1)
+    assert health.state == CLOSED
+    assert health.consecutive_failures == 0
+
+def test_half_open_failure_reopens():
+    health = HostHealth('a')
+    health.state = HALF_OPEN
+    health.record_failure('timeout')
+    assert health.state == OPEN
+
+def test_candidates_keep_primary_first_and_skip_open_hosts():
+    selector = FailoverSelector(['a', 'b', 'c'], probe=lambda host: None)
+    selector.record_success('c', 0.05, 0)
+    selector.record_success('b', 0.01, 0)
+    assert selector.primary == 'b'
+    trip(selector, 'a')
+    assert selector.candidates() == ['b', 'c']
+
+def test_candidates_fall_back_to_open_hosts_when_all_are_open():
+    selector = FailoverSelector(['a', 'b'], probe=lambda host: None)
+    trip(selector, 'a')
+    trip(selector, 'b')
+    assert sorted(selector.candidates()) == ['a', 'b']
+
+def test_probe_recovers_open_primary():
+    probed = []
+    selector = FailoverSelector(['a', 'b'], probe=probed.append)
+    trip(selector, 'a')
+    expire_cooldown(selector, 'a')
+    selector.probe_once()
+    assert probed == ['a']
+    assert selector.health['a'].state == CLOSED
+
+def test_probe_skips_healthy_primary_and_failed_probe_reopens():
+    def probe(host):
+        raise ConnectionError(host)
+
+    selector = FailoverSelector(['a', 'b'], probe=probe)
+    selector.record_failure('a', 'timeout')
+    trip(selector, 'b')
+    expire_cooldown(selector, 'b')
+    selector.probe_once()
+    # プライマリ a はクローズのまま（実トラフィックで判定）、b はハーフオープンから再びオープン
+    assert selector.health['a'].consecutive_failures == 1
+    assert selector.health['b'].state == OPEN
+
+def test_start_probing_starts_one_thread(monkeypatch):
+    started = []
+    real_thread = threading.Thread
+
+    class FakeThread:
+        def __init__(self, target, daemon):
+            self.target = target
+
+        def start(self):
+            started.append(self)
+
+    monkeypatch.setattr(proxmox_health.threading, 'Thread', FakeThread)
+    selector = FailoverSelector(['a'], probe=lambda host: None)
+    barrier = threading.Barrier(8)
+
+    def call():
+        barrier.wait()
+        selector.start_probing()
+
+    threads = [real_thread(target=call) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(started) == 1
@@ -0,0 +1,55 @@
+from fetch import proxmox_schedule
+from fetch.proxmox_schedule import TieredScheduler
+
+def test_due_respects_intervals_and_on_demand_tiers(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(proxmox_schedule.time, 'monotonic', lambda: now[0])
+    scheduler = TieredScheduler({'cluster_tasks': 20})
+    cluster_keys, node_keys = scheduler.due()
+    assert 'cluster_resources' in cluster_keys and 'status' in node_keys
+    assert 'syslog' not in node_keys
+
+    scheduler.merge({}, {key: {'data': []} for key in cluster_keys})
+    now[0] += 10
+    cluster_keys, _ = scheduler.due()
+    assert 'cluster_resources' in cluster_keys and 'nodes' in cluster_keys
+    assert 'cluster_tasks' not in cluster_keys
+
+def test_slack_keeps_tiers_on_their_interval(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(proxmox_schedule.time, 'monotonic', lambda: now[0])
+    scheduler = TieredScheduler({**{key: None for key in proxmox_schedule.DEFAULT_TIERS}, 'nodes': 10}, slack=2.5)
+    runs = []
+    # 5秒周期の収集が少し遅れて起床しても、10秒の階層は2回に1回取得される
+    for cycle in range(6):
+        now[0] = cycle * 5 + (0.1 if cycle % 2 else 0)
+        cluster_keys, _ = scheduler.due()
+        if cluster_keys:
+            runs.append(cycle)
+            scheduler.merge({}, {'nodes': {'data': []}})
+    assert runs == [0, 2, 4]
+
+def test_failed_fetches_keep_previous_values_and_are_retried():
+    scheduler = TieredScheduler()
+    cache = {'cluster_status': {'data': 'old'}}
+    scheduler.due()
+    scheduler.merge(cache, {'cluster_status': {'error': 'timeout'}, 'nodes': {'data': [{'node': 'pve1'}]}})
+    assert cache['cluster_status'] == {'data': 'old'}
+    assert 'cluster_status' in scheduler.due()[0]
+    assert 'nodes' not in scheduler.due()[0]
+
+def test_node_details_of_removed_nodes_are_dropped():
+    scheduler = TieredScheduler()
+    cache = {'node_details': {'gone': {'status': {'data': 1}}}}
+    scheduler.merge(cache, {
+        'nodes': {'data': [{'node': 'pve1'}]},
+        'node_details': {'pve1': {'status': {'data': 2}, 'rrd': {'error': 'x'}}}
+    })
+    assert cache['node_details'] == {'pve1': {'status': {'data': 2}}}
+
+def test_forced_due_returns_every_scheduled_tier():
+    scheduler = TieredScheduler()
+    cluster_keys, node_keys = scheduler.due()
+    scheduler.merge({}, {key: {'data': []} for key in cluster_keys})
+    assert scheduler.due()[0] == []
+    assert scheduler.due(force=True) == (cluster_keys, node_keys)
@@ -0,0 +1,31 @@
+import os
+import subprocess
+import sys
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+from records import record_to_dict
+
+@dataclass(frozen=True, slots=True)
+class Guest:
+    vmid: int
+    name: str
+    cpu_usage: Optional[float] = None
+
+@dataclass(frozen=True, slots=True)
+class Single:
+    value: int
+
+def test_record_to_dict_matches_asdict():
+    guest = Guest(100, 'web', 0.5)
+    assert record_to_dict(guest) == asdict(guest)
+    assert list(record_to_dict(guest)) == ['vmid', 'name', 'cpu_usage']
+
+def test_single_field_record():
+    assert record_to_dict(Single(1)) == {'value': 1}
+
+def test_delta_does_not_import_monitoring_service():
+    # monitoring_service は読み込み時にDBを開き保持期間スレッドを起動するため、delta からは読み込まない
+    code = 'import sys, delta; sys.exit(1 if "monitoring_service" in sys.modules else 0)'
+    result = subprocess.run([sys.executable, '-c', code], cwd=os.path.join(os.path.dirname(__file__), '..'))
+    assert result.returncode == 0
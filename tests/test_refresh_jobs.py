@@ -0,0 +1,45 @@
+import threading
+
+from serving import refresh_jobs as refresh_jobs_module
+from serving.refresh_jobs import RefreshJobs
+
+def test_concurrent_submits_share_the_running_job():
+    release = threading.Event()
+    calls = []
+
+    def runner(source):
+        calls.append(source)
+        release.wait(5)
+        return source
+
+    jobs = RefreshJobs(runner, default_min_interval=0)
+    first = jobs.submit('proxmox')
+    assert jobs.submit('proxmox') is first
+    release.set()
+    jobs.wait(first, 5)
+    assert first.status == 'done' and first.result == 'proxmox'
+    assert calls == ['proxmox']
+
+def test_min_interval_counts_from_the_start_of_failed_jobs(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(refresh_jobs_module.time, 'monotonic', lambda: now[0])
+
+    def runner(source):
+        raise RuntimeError('down')
+
+    jobs = RefreshJobs(runner, {'nextcloud': 15})
+    failed = jobs.wait(jobs.submit('nextcloud'), 5)
+    assert failed.status == 'failed' and failed.error == 'down'
+    # 失敗したジョブでも開始から間隔内なら同じジョブを返す
+    now[0] = 114.0
+    assert jobs.submit('nextcloud') is failed
+    now[0] = 115.0
+    assert jobs.submit('nextcloud') is not failed
+
+def test_jobs_run_on_the_shared_executor():
+    names = []
+    jobs = RefreshJobs(lambda source: names.append(threading.current_thread().name), default_min_interval=0)
+    for source in ('nextcloud', 'proxmox', 'proxmox_raw'):
+        jobs.wait(jobs.submit(source), 5)
+    assert all(name.startswith('refresh') for name in names)
+    assert len(jobs._executor._threads) <= refresh_jobs_module.MAX_WORKERS
@@ -0,0 +1,135 @@
+import json
+
+import pytest
+
+from fetch import resource_history
+from storage.sqlite_store import SQLiteStore
+
+PROXMOX = {
+    'nodes': [
+        {'node': 'pve1', 'status': 'online', 'cpu': 0.25, 'memory': {'used': 2048, 'total': 8192, 'percentage': 25.0}},
+        {'node': '123', 'status': 'offline', 'cpu': 0, 'memory': None},
+    ],
+    'vms': [{'vmid': 100, 'name': 'web', 'node': 'pve1', 'status': 'paused', 'cpu': 0.5, 'memory': None}],
+    'containers': [{'vmid': 200, 'name': 'db', 'node': '123', 'status': 'running', 'cpu': 0.1, 'memory': None}],
+}
+
+def test_proxmox_round_trip_keeps_strings_and_id_types():
+    data = resource_history.implode('proxmox', resource_history.explode('proxmox', PROXMOX))
+    assert data['vms'] == [{'vmid': 100, 'name': 'web', 'node': 'pve1', 'status': 'paused', 'cpu': 0.5}]
+    assert data['containers'][0]['node'] == '123'
+    assert data['nodes'][1] == {'node': '123', 'status': 'offline', 'cpu': 0}
+    assert data['nodes'][0]['memory'] == {'used': 2048, 'total': 8192, 'percentage': 25}
+
+def test_generic_round_trip_keeps_lists_and_numeric_keys():
+    payload = {'ocs': {'data': {
+        'version': '28.0.1',
+        'enabled': True,
+        'users': {'100': {'quota': 5}, '101': {'quota': 7}},
+        'load': [0.5, 0.25, 0.125],
+    }}}
+    assert resource_history.implode('nextcloud', resource_history.explode('nextcloud', payload)) == payload
+
+def test_numeric_values_are_rolled_up_and_strings_are_not():
+    rows = resource_history.explode('proxmox', PROXMOX)
+    assert ('qemu/100', 'name', None, json.dumps('web')) in rows
+    assert ('qemu/100', 'vmid', None, '100') in rows
+    assert ('qemu/100', 'cpu', 0.5, None) in rows
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = SQLiteStore(str(tmp_path / 'history.db'))
+    monkeypatch.setattr(resource_history, 'store', store)
+    monkeypatch.setattr(resource_history, 'windows', {})
+    monkeypatch.setattr(resource_history, 'last_insert', {})
+    with store.transaction() as c:
+        resource_history._create_tables(c)
+    yield store
+    store.close()
+
+def test_empty_snapshot_keeps_a_sample(store):
+    resource_history.insert_resource('proxmox', {'nodes': [], 'vms': [], 'containers': []})
+    history = resource_history.get_resource_history('proxmox', days=1)
+    assert [data for _, data in history] == [{'nodes': [], 'vms': [], 'containers': []}]
+
+def test_insert_is_thinned_to_raw_interval(store):
+    resource_history.insert_resource('nextcloud', {'users': 1})
+    resource_history.insert_resource('nextcloud', {'users': 2})
+    history = resource_history.get_resource_history('nextcloud', days=1)
+    assert [data for _, data in history] == [{'users': 1}]
+
+def test_window_is_appended_only_after_commit(store):
+    window = resource_history.load_window('nextcloud')
+    with pytest.raises(RuntimeError):
+        with store.transaction():
+            resource_history.insert_resource('nextcloud', {'users': 1})
+            assert len(window) == 0
+            raise RuntimeError('disk full')
+    # ロールバックされたサイクルはウィンドウに載らない
+    assert len(window) == 0
+    assert resource_history.get_resource_history('nextcloud', days=1) == []
+
+    resource_history.last_insert.clear()
+    resource_history.insert_resource('nextcloud', {'users': 2})
+    assert [entry['data'] for entry in window.newest_first()] == [{'users': 2}]
+
+def test_get_series_returns_one_metric(store, monkeypatch):
+    for offset, cpu in enumerate([0.25, 0.5]):
+        monkeypatch.setattr(resource_history.time, 'time', lambda: 1_700_000_000 + offset * 60)
+        monkeypatch.setattr(resource_history.time, 'monotonic', lambda: offset * 60)
+        resource_history.insert_resource('proxmox', {'nodes': [], 'vms': [{'vmid': 100, 'status': 'running', 'cpu': cpu}], 'containers': []})
+    series = resource_history.get_series('proxmox', 'qemu/100', 'cpu', days=365 * 100)
+    assert [value for _, value in series] == [0.25, 0.5]
+    assert resource_history.get_series('proxmox', 'qemu/999', 'cpu', days=365 * 100) == []
+    with pytest.raises(ValueError):
+        resource_history.get_series('proxmox', 'qemu/100', 'cpu', aggregate='median')
+
+def create_legacy(store, rows):
+    with store.transaction() as c:
+        c.execute('CREATE TABLE resource_history (id INTEGER PRIMARY KEY, timestamp TEXT, source TEXT, data TEXT)')
+        c.executemany('INSERT INTO resource_history (timestamp, source, data) VALUES (?, ?, ?)', rows)
+
+def test_legacy_migration_keeps_table_and_separates_same_second_rows(store):
+    now = resource_history._to_iso(int(resource_history.time.time()) - 60)
+    create_legacy(store, [
+        (now, 'nextcloud', json.dumps({'users': 1, 'version': '28'})),
+        (now, 'nextcloud', json.dumps({'users': 2, 'version': '28'})),
+        (now, 'nextcloud', 'not json'),
+    ])
+    resource_history.migrate_legacy_table()
+
+    history = resource_history.get_resource_history('nextcloud', days=1)
+    assert [data for _, data in history] == [{'users': 2, 'version': '28'}, {'users': 1, 'version': '28'}]
+    with store.reader() as c:
+        tables = {row[0] for row in c.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        backup_rows = c.execute(f'SELECT COUNT(*) FROM {resource_history.LEGACY_BACKUP_TABLE}').fetchone()[0]
+    assert 'resource_history' not in tables
+    assert backup_rows == 3
+
+    # 2回目は何もしない
+    resource_history.migrate_legacy_table()
+    assert len(resource_history.get_resource_history('nextcloud', days=1)) == 2
+
+def test_legacy_migration_resumes_without_duplicates(store):
+    now = resource_history._to_iso(int(resource_history.time.time()) - 60)
+    create_legacy(store, [(now, 'nextcloud', json.dumps({'users': 1}))])
+    with store.transaction() as c:
+        resource_history._insert_rows(c, resource_history._to_epoch(now), 'nextcloud', resource_history.explode('nextcloud', {'users': 1}))
+        c.execute("INSERT INTO migration_progress (name, last_id) VALUES ('resource_history', 1)")
+    resource_history.migrate_legacy_table()
+    assert len(resource_history.get_resource_history('nextcloud', days=1)) == 1
+
+def test_thinning_tolerates_fetch_time_jitter(store, monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(resource_history.time, 'monotonic', lambda: now[0])
+    monkeypatch.setattr(resource_history.time, 'time', lambda: 1700000000 + now[0])
+    # x.5秒に起動する10秒毎の収集で、取得時間が 0.6秒 / 0.2秒 と交互に変わっても全サイクルを書く
+    for finished in (0.5 + 0.6, 10.5 + 0.2, 20.5 + 0.6, 30.5 + 0.2):
+        now[0] = finished
+        resource_history.insert_resource('nextcloud', {'users': 1})
+    # 手動更新などで RAW_INTERVAL の半分未満に続いた書き込みは間引く
+    now[0] = 33.0
+    resource_history.insert_resource('nextcloud', {'users': 2})
+    with store.reader() as c:
+        c.execute("SELECT COUNT(DISTINCT ts) FROM samples WHERE source = 'nextcloud'")
+        assert c.fetchone()[0] == 4
@@ -0,0 +1,178 @@
+import gzip
+import json
+import threading
+
+import pytest
+
+flask = pytest.importorskip('flask')
+
+from serving import response_cache as response_cache_module
+from serving.response_cache import MIN_COMPRESS_SIZE, ResponseCache
+
+@pytest.fixture
+def app():
+    return flask.Flask(__name__)
+
+def large_payload():
+    return {'data': ['x' * 32] * (MIN_COMPRESS_SIZE // 8)}
+
+def test_response_returns_serialized_body_with_etag(app):
+    cache = ResponseCache()
+    cache.put('nextcloud', {'data': {'users': 3}, 'last_update': None})
+    with app.test_request_context('/'):
+        response = cache.response('nextcloud')
+    assert response.status_code == 200
+    assert json.loads(response.get_data()) == {'data': {'users': 3}, 'last_update': None}
+    assert response.headers['ETag'].startswith('"')
+    assert response.headers['Vary'] == 'Accept-Encoding'
+
+def test_unknown_key_returns_none(app):
+    with app.test_request_context('/'):
+        assert ResponseCache().response('missing') is None
+
+def test_matching_if_none_match_returns_304(app):
+    cache = ResponseCache()
+    cache.put('proxmox', {'data': [1, 2, 3]})
+    with app.test_request_context('/'):
+        etag = cache.response('proxmox').headers['ETag']
+    with app.test_request_context('/', headers={'If-None-Match': etag}):
+        response = cache.response('proxmox')
+    assert response.status_code == 304
+    assert response.get_data() == b''
+    assert response.headers['ETag'] == etag
+
+def test_new_version_changes_etag(app):
+    cache = ResponseCache()
+    cache.put('proxmox', {'data': 1})
+    with app.test_request_context('/'):
+        old_etag = cache.response('proxmox').headers['ETag']
+    cache.put('proxmox', {'data': 2})
+    with app.test_request_context('/', headers={'If-None-Match': old_etag}):
+        response = cache.response('proxmox')
+    assert response.status_code == 200
+    assert response.headers['ETag'] != old_etag
+
+def test_gzip_when_accepted(app):
+    cache = ResponseCache()
+    cache.put('detailed', large_payload())
+    with app.test_request_context('/', headers={'Accept-Encoding': 'gzip'}):
+        response = cache.response('detailed')
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(response.get_data())) == large_payload()
+
+def test_small_body_is_not_compressed(app):
+    cache = ResponseCache()
+    cache.put('small', {'data': 1})
+    with app.test_request_context('/', headers={'Accept-Encoding': 'gzip, br'}):
+        response = cache.response('small')
+    assert 'Content-Encoding' not in response.headers
+
+def test_identity_when_no_encoding_accepted(app):
+    cache = ResponseCache()
+    cache.put('detailed', large_payload())
+    with app.test_request_context('/'):
+        response = cache.response('detailed')
+    assert 'Content-Encoding' not in response.headers
+    assert json.loads(response.get_data()) == large_payload()
+
+def test_br_falls_back_to_identity_without_brotli(app, monkeypatch):
+    monkeypatch.setattr(response_cache_module, 'brotli', None)
+    cache = ResponseCache()
+    cache.put('detailed', large_payload())
+    with app.test_request_context('/', headers={'Accept-Encoding': 'br'}):
+        response = cache.response('detailed')
+    assert 'Content-Encoding' not in response.headers
+
+def test_br_when_available(app):
+    brotli = pytest.importorskip('brotli')
+    cache = ResponseCache()
+    cache.put('detailed', large_payload())
+    with app.test_request_context('/', headers={'Accept-Encoding': 'gzip, br'}):
+        response = cache.response('detailed')
+    assert response.headers['Content-Encoding'] == 'br'
+    assert json.loads(brotli.decompress(response.get_data())) == large_payload()
+
+def test_compressed_body_is_built_once_per_version(app):
+    cache = ResponseCache()
+    cache.put('detailed', large_payload())
+    entry = cache.get('detailed')
+    assert entry.encoded('gzip') is entry.encoded('gzip')
+
+def test_put_lazy_builds_on_first_request_only(app):
+    cache = ResponseCache()
+    calls = []
+
+    def builder():
+        calls.append(1)
+        return {'data': len(calls)}
+
+    cache.put_lazy('history', 1, builder)
+    assert calls == []
+    with app.test_request_context('/'):
+        first = cache.response('history')
+        second = cache.response('history')
+    assert len(calls) == 1
+    assert first.get_data() == second.get_data()
+
+    # 同じバージョンの再登録では作り直さない
+    cache.put_lazy('history', 1, builder)
+    cache.get('history')
+    assert len(calls) == 1
+
+    cache.put_lazy('history', 2, builder)
+    assert json.loads(cache.get('history').body) == {'data': 2}
+    assert len(calls) == 2
+
+def test_put_lazy_newer_version_registered_during_build_wins():
+    cache = ResponseCache()
+
+    def stale_builder():
+        # 組み立て中に新しいバージョンが登録される
+        cache.put_lazy('history', 2, lambda: {'version': 2})
+        return {'version': 1}
+
+    cache.put_lazy('history', 1, stale_builder)
+    # 組み立てたリクエスト自身には組み立てた内容を返すが、キャッシュには採用しない
+    assert json.loads(cache.get('history').body) == {'version': 1}
+    assert json.loads(cache.get('history').body) == {'version': 2}
+    assert json.loads(cache.get('history').body) == {'version': 2}
+
+def test_concurrent_requests_wait_for_the_lazy_build():
+    cache = ResponseCache()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def builder():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {'version': 2}
+
+    cache.put('history', {'version': 1})
+    cache.put_lazy('history', 2, builder)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get('history'))) for _ in range(3)]
+    threads[0].start()
+    assert started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    # 組み立て中の要求も None や古い版ではなく、1回だけ組み立てた新しい版を受け取る
+    assert [json.loads(entry.body) for entry in results] == [{'version': 2}] * 3
+    assert calls == [1]
+
+def test_put_replaces_pending_lazy_entry():
+    cache = ResponseCache()
+    cache.put_lazy('history', 1, lambda: {'lazy': True})
+    cache.put('history', {'lazy': False})
+    assert json.loads(cache.get('history').body) == {'lazy': False}
+
+def test_render_uses_etag_and_compression(app):
+    cache = ResponseCache()
+    with app.test_request_context('/', headers={'Accept-Encoding': 'gzip'}):
+        response = cache.render(large_payload())
+    assert response.headers['Content-Encoding'] == 'gzip'
+    with app.test_request_context('/', headers={'If-None-Match': response.headers['ETag']}):
+        assert cache.render(large_payload()).status_code == 304
@@ -0,0 +1,62 @@
+import time
+
+import pytest
+
+from storage.retention import RetentionManager, RetentionRule, build_rules
+from storage.rollup import RollupTables
+from storage.sqlite_store import SQLiteStore
+
+@pytest.fixture
+def store(tmp_path):
+    store = SQLiteStore(str(tmp_path / 'retention.db'))
+    with store.transaction() as c:
+        c.execute('CREATE TABLE samples (ts INTEGER NOT NULL, value REAL)')
+        c.execute('CREATE TABLE history (timestamp DATETIME DEFAULT CURRENT_TIMESTAMP, value REAL)')
+    yield store
+    store.close()
+
+def test_cutoff_formats():
+    now = 1700000000
+    assert RetentionRule('samples', 'ts', 1).cutoff(now) == now - 86400
+    assert RetentionRule('history', 'timestamp', 1, 'datetime').cutoff(now) == '2023-11-13 22:13:20'
+
+def test_build_rules_uses_tier_ttls():
+    rollups = RollupTables('samples', keys=('source',), values=('value',))
+    rules = build_rules([('samples', 'ts', 'epoch')], [rollups], {'raw': 3, '1h': 365})
+    ttl = {rule.table: rule.ttl_days for rule in rules}
+    assert ttl == {'samples': 3, 'samples_1m': 30, 'samples_10m': 180, 'samples_1h': 365}
+
+def test_run_once_deletes_expired_rows_in_batches(store):
+    now = int(time.time())
+    with store.transaction() as c:
+        c.executemany('INSERT INTO samples VALUES (?, ?)', [(now - 10 * 86400 + i, i) for i in range(25)])
+        c.executemany('INSERT INTO samples VALUES (?, ?)', [(now - i, i) for i in range(5)])
+        c.execute("INSERT INTO history (timestamp, value) VALUES ('2000-01-01 00:00:00', 1)")
+        c.execute('INSERT INTO history (value) VALUES (2)')
+    manager = RetentionManager(store, [
+        RetentionRule('samples', 'ts', 7),
+        RetentionRule('history', 'timestamp', 7, 'datetime'),
+    ], batch_size=10)
+    report = manager.run_once()
+    assert manager.last_deleted == {'samples': 25, 'history': 1}
+    assert report['row_counts'] == {'history': 1, 'samples': 5}
+
+def test_ensure_indexes_covers_rule_columns(store):
+    manager = RetentionManager(store, [RetentionRule('samples', 'ts', 7)])
+    manager.ensure_indexes()
+    with store.reader() as c:
+        plan = ' '.join(row[-1] for row in c.execute('EXPLAIN QUERY PLAN SELECT rowid FROM samples WHERE ts < 1'))
+    assert 'idx_samples_ts' in plan
+
+def test_incremental_vacuum_reclaims_pages(store):
+    manager = RetentionManager(store, [RetentionRule('samples', 'ts', 7)], vacuum_pages=100000)
+    manager.enable_incremental_vacuum()
+    with store.reader() as c:
+        assert c.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+    with store.transaction() as c:
+        c.executemany('INSERT INTO samples VALUES (?, ?)', [(i, float(i)) for i in range(20000)])
+    size_before = manager.collect_stats()['size_bytes']
+    manager.run_once()
+    stats = manager.collect_stats()
+    assert stats['row_counts']['samples'] == 0
+    assert stats['size_bytes'] < size_before
@@ -0,0 +1,48 @@
+import pytest
+
+from storage.rollup import RollupTables, choose_tier
+from storage.sqlite_store import SQLiteStore
+
+@pytest.fixture
+def store(tmp_path):
+    store = SQLiteStore(str(tmp_path / 'rollup.db'))
+    yield store
+    store.close()
+
+@pytest.fixture
+def tables(store):
+    tables = RollupTables('samples', ['entity'], ['value'])
+    with store.transaction() as c:
+        tables.create(c)
+    return tables
+
+def test_choose_tier():
+    assert choose_tier(3600, None) is None
+    assert choose_tier(3600, 360) is None
+    assert choose_tier(86400, 1440) == ('1m', 60)
+    assert choose_tier(86400, 200) == ('10m', 600)
+    assert choose_tier(365 * 86400, 10) == ('1h', 3600)
+
+def test_update_aggregates_each_tier(store, tables):
+    with store.transaction() as c:
+        tables.update(c, 120, [(('a',), (1.0,)), (('b',), (5.0,))])
+        tables.update(c, 130, [(('a',), (3.0,))])
+    with store.reader() as c:
+        for aggregate, expected in (('avg', 2.0), ('min', 1.0), ('max', 3.0), ('last', 3.0)):
+            assert tables.query(c, '1m', 0, {'entity': 'a'}, aggregate) == [('a', 120, expected)]
+        assert tables.query(c, '1h', 0, {'entity': 'b'}) == [('b', 0, 5.0)]
+        with pytest.raises(ValueError):
+            tables.query(c, '1m', 0, aggregate='median')
+
+def test_backfill_rebuilds_empty_rollups(store, tables):
+    with store.transaction() as c:
+        c.execute('CREATE TABLE raw (ts INTEGER, entity TEXT, value REAL)')
+        c.executemany('INSERT INTO raw VALUES (?, ?, ?)', [(60, 'a', 2.0), (70, 'a', 4.0), (700, 'a', 6.0)])
+    tables.backfill(store, 'raw', 'ts', ['entity'], batch=2)
+    with store.reader() as c:
+        assert tables.query(c, '1m', 0) == [('a', 60, 3.0), ('a', 660, 6.0)]
+        assert tables.query(c, '10m', 0, descending=True) == [('a', 600, 6.0), ('a', 0, 3.0)]
+    # 集計済みなら作り直さない
+    tables.backfill(store, 'raw', 'ts', ['entity'])
+    with store.reader() as c:
+        assert tables.query(c, '1h', 0, aggregate='max') == [('a', 0, 6.0)]
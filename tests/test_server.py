@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('aiohttp')
+pytest.importorskip('flask_socketio')
+
+RESOURCES = [
+    {'type': 'node', 'node': 'pve1', 'status': 'online', 'cpu': 0.25, 'mem': 4, 'maxmem': 16, 'uptime': 60},
+    {'type': 'node', 'node': 'pve2', 'status': 'offline'},
+    {'type': 'qemu', 'node': 'pve1', 'vmid': 100, 'name': 'web', 'status': 'running', 'cpu': 0.5, 'mem': 2},
+    {'type': 'lxc', 'node': 'pve2', 'vmid': 200, 'name': 'db', 'status': 'stopped'},
+    {'type': 'storage', 'node': 'pve1', 'storage': 'local', 'plugintype': 'dir', 'disk': 3, 'maxdisk': 10},
+]
+
+@pytest.fixture(scope='module')
+def server(isolated_import):
+    return isolated_import('server')
+
+def make_client(server, responses, detail_interval=60):
+    client = server.ProxmoxClient('a', 'root@pam', 'secret', detail_interval=detail_interval)
+    client.requests = []
+
+    async def api_get(path):
+        client.requests.append(path)
+        return responses.get(path)
+
+    client.api_get = api_get
+    return client
+
+def test_cluster_resources_are_mapped(server):
+    client = make_client(server, {'/cluster/resources': RESOURCES, '/nodes/pve1/status': {'loadavg': ['0.5', '0.4', '0.3']}})
+    data = asyncio.run(client.get_cluster_data())
+    assert data['cluster_status'] == 'online'
+    # オフラインのノードは一覧に含めず、詳細も取得しない
+    assert data['nodes'] == [{
+        'name': 'pve1', 'status': 'online', 'cpu': 25.0, 'memory_used': 4, 'memory_total': 16,
+        'uptime': 60, 'load': ['0.5', '0.4', '0.3']
+    }]
+    assert '/nodes/pve2/status' not in client.requests
+    assert data['vms'] == [
+        {'id': 100, 'name': 'web', 'status': 'running', 'node': 'pve1', 'type': 'vm', 'cpu': 50.0, 'memory': 2},
+        {'id': 200, 'name': 'db', 'status': 'stopped', 'node': 'pve2', 'type': 'container', 'cpu': 0, 'memory': 0},
+    ]
+    assert data['storage'] == [{'node': 'pve1', 'name': 'local', 'type': 'dir', 'total': 10, 'used': 3, 'available': 7}]
+
+def test_node_details_are_refreshed_after_detail_interval(server, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(server.time, 'time', lambda: now[0])
+    client = make_client(server, {'/cluster/resources': RESOURCES, '/nodes/pve1/status': {'loadavg': [1, 1, 1]}})
+
+    def detail_requests():
+        asyncio.run(client.get_cluster_resources_data())
+        return client.requests.count('/nodes/pve1/status')
+
+    assert detail_requests() == 1
+    now[0] += 59
+    assert detail_requests() == 1
+    now[0] += 1
+    assert detail_requests() == 2
+
+def test_no_resources_means_offline(server):
+    data = asyncio.run(make_client(server, {}).get_cluster_resources_data())
+    assert data == {'nodes': [], 'vms': [], 'storage': [], 'cluster_status': 'offline'}
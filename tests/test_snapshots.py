@@ -0,0 +1,49 @@
+import threading
+import time
+
+import pytest
+
+from serving.snapshots import SingleFlight, SnapshotStore
+
+def test_publish_swaps_and_fail_keeps_the_previous_data():
+    store = SnapshotStore(['proxmox'])
+    assert store['proxmox'].status() == {'last_update': None, 'has_data': False, 'error': None}
+    published = store.publish('proxmox', {'nodes': []}, {'index': 1})
+    assert store['proxmox'] is published and published.indexes == {'index': 1}
+    failed = store.fail('proxmox', 'timeout')
+    assert failed.data == {'nodes': []} and failed.error == 'timeout'
+    assert failed.last_update == published.last_update
+    # 読み出し側が持っているスナップショットは変わらない
+    assert published.error is None
+    assert store.publish('proxmox', {'nodes': [1]}).error is None
+
+def test_single_flight_shares_one_call():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return 'data'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.run('proxmox', fetch))) for _ in range(5)]
+    threads[0].start()
+    while not flight.in_flight('proxmox'):
+        time.sleep(0.001)
+    for thread in threads[1:]:
+        thread.start()
+    # 後続の呼び出しが実行中の呼び出しに合流するまで待ってから完了させる
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert calls == [1] and results == ['data'] * 5
+    assert not flight.in_flight('proxmox')
+
+def test_single_flight_propagates_errors_and_does_not_cache_them():
+    flight = SingleFlight()
+    with pytest.raises(RuntimeError):
+        flight.run('nextcloud', lambda: (_ for _ in ()).throw(RuntimeError('down')))
+    assert flight.run('nextcloud', lambda: 'ok') == 'ok'
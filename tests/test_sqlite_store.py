@@ -0,0 +1,123 @@
+import atexit
+import threading
+
+import pytest
+
+from storage.sqlite_store import SQLiteStore
+
+@pytest.fixture
+def store(tmp_path):
+    store = SQLiteStore(str(tmp_path / 'store.db'))
+    with store.transaction() as c:
+        c.execute('CREATE TABLE t (v INTEGER)')
+    yield store
+    store.close()
+
+def count(store):
+    with store.reader() as c:
+        c.execute('SELECT COUNT(*) FROM t')
+        return c.fetchone()[0]
+
+def insert(value):
+    return lambda c: c.execute('INSERT INTO t (v) VALUES (?)', (value,))
+
+def test_on_commit_runs_after_commit(store):
+    seen = []
+    store.write(insert(1), lambda: seen.append(count(store)))
+    assert seen == [1]
+
+def fail(c):
+    raise RuntimeError('fail')
+
+def test_on_commit_is_skipped_on_rollback(store):
+    seen = []
+    with pytest.raises(RuntimeError):
+        with store.transaction():
+            store.write(insert(1), lambda: seen.append('first'))
+            store.write(fail)
+    assert seen == [] and count(store) == 0
+
+def test_on_commit_waits_for_the_outermost_transaction(store):
+    seen = []
+    with store.transaction():
+        store.write(insert(1), lambda: seen.append('committed'))
+        assert seen == []
+    assert seen == ['committed']
+
+def test_batching_collects_writes_from_threads(store):
+    seen = []
+    store.start_batching(3600)
+    threads = [threading.Thread(target=store.write, args=(insert(i), lambda: seen.append(1))) for i in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert count(store) == 0 and seen == []
+    store.flush()
+    assert count(store) == 5 and len(seen) == 5
+
+def test_failing_batched_write_does_not_drop_the_others(store):
+    seen = []
+    store.start_batching(3600)
+    store.write(insert(1), lambda: seen.append(1))
+    store.write(lambda c: (insert(2)(c), fail(c)), lambda: seen.append(2))
+    store.write(insert(3), lambda: seen.append(3))
+    store.flush()
+    # 失敗した書き込みは途中まで実行した分も含めて巻き戻し、そのコールバックだけを呼ばない
+    with store.reader() as c:
+        c.execute('SELECT v FROM t ORDER BY v')
+        assert [row[0] for row in c.fetchall()] == [1, 3]
+    assert seen == [1, 3]
+
+def test_pending_batch_is_flushed_on_exit(store, monkeypatch):
+    registered = []
+    monkeypatch.setattr(atexit, 'register', registered.append)
+    store.start_batching(3600)
+    store.write(insert(1))
+    assert count(store) == 0
+    for callback in registered:
+        callback()
+    assert count(store) == 1
+
+def test_close_flushes_pending_batch(tmp_path):
+    path = str(tmp_path / 'close.db')
+    store = SQLiteStore(path)
+    store.write(lambda c: c.execute('CREATE TABLE t (v INTEGER)'))
+    store.start_batching(3600)
+    store.write(insert(1))
+    store.close()
+    reopened = SQLiteStore(path)
+    assert count(reopened) == 1
+    reopened.close()
+
+def test_writer_uses_wal(store):
+    with store.maintenance() as c:
+        c.execute('PRAGMA journal_mode')
+        assert c.fetchone()[0] == 'wal'
+
+def test_nested_transactions_commit_with_the_outermost(store):
+    with pytest.raises(RuntimeError):
+        with store.transaction() as c:
+            insert(1)(c)
+            with store.transaction() as inner:
+                insert(2)(inner)
+            raise RuntimeError('fail')
+    assert count(store) == 0
+
+def test_maintenance_is_rejected_inside_a_transaction(store):
+    with store.transaction():
+        with pytest.raises(RuntimeError):
+            with store.maintenance():
+                pass
+
+def test_readers_are_pooled_and_see_committed_rows_during_a_write(store):
+    store.write(insert(1))
+    with store.transaction() as c:
+        insert(2)(c)
+        # WALのため書き込み中でもリーダーはブロックされず、コミット済みの行だけが見える
+        assert count(store) == 1
+    with store.reader() as first:
+        pass
+    with store.reader() as second:
+        assert second.connection is first.connection
+    assert store._reader_count == 1
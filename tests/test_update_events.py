@@ -0,0 +1,19 @@
+import threading
+
+from update_events import UpdateNotifier
+
+def test_wait_returns_when_a_new_version_is_published():
+    notifier = UpdateNotifier()
+    seen = []
+    waiter = threading.Thread(target=lambda: seen.append(notifier.wait(0, timeout=5)))
+    waiter.start()
+    assert notifier.publish() == 1
+    waiter.join(5)
+    assert seen == [1]
+
+def test_wait_returns_immediately_for_a_missed_version_and_times_out_otherwise():
+    notifier = UpdateNotifier()
+    notifier.publish()
+    notifier.publish()
+    assert notifier.wait(0, timeout=0) == 2
+    assert notifier.wait(2, timeout=0.01) == 2
@@ -0,0 +1,23 @@
+"""
+更新通知 - 収集サイクル完了を世代番号付きで通知し、配信スレッドを待機状態から起こす
+"""
+import threading
+from typing import Optional
+
+class UpdateNotifier:
+    def __init__(self):
+        self.version = 0
+        self._condition = threading.Condition()
+
+    def publish(self) -> int:
+        """新しいデータが揃ったことを待機中の全スレッドに通知"""
+        with self._condition:
+            self.version += 1
+            self._condition.notify_all()
+            return self.version
+
+    def wait(self, seen_version: int, timeout: Optional[float] = None) -> int:
+        """seen_version より新しい世代が公開されるまで待つ（タイムアウト時は現在の世代を返す）"""
+        with self._condition:
+            self._condition.wait_for(lambda: self.version != seen_version, timeout)
+            return self.version